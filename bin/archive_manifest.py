@@ -12,13 +12,16 @@ Options:
      --headers=LIST      Comma separated list of dicom header names to print.
      --oneseries         Only show one series (useful for just exam info)
      --showheaders       Just list all of the headers for each archive
+     --index=FILE        A dicom header index (see dm_header_index.py) to
+                         read headers from, and to add any missing archives
+                         to.
 """
 
 from docopt import docopt
 import pandas as pd
 
 import datman
-import datman.utils
+import datman.header_index
 
 default_headers = [
     'StudyDescription',
@@ -30,11 +33,12 @@ default_headers = [
 
 def main():
     arguments = docopt(__doc__)
+    index = datman.header_index.get_header_index(path=arguments['--index'])
 
     if arguments['--showheaders']:
         for archive in arguments['<archive>']:
-            manifest = datman.utils.get_archive_headers(archive,
-                                                        stop_after_first=False)
+            manifest = datman.header_index.get_archive_headers(
+                archive, stop_after_first=False, index=index)
             filepath, headers = list(manifest.items())[0]
             print(",".join([archive, filepath]))
             print("\t" + "\n\t".join(headers.dir()))
@@ -46,7 +50,8 @@ def main():
 
     rows = []
     for archive in arguments["<archive>"]:
-        manifest = datman.utils.get_archive_headers(archive)
+        manifest = datman.header_index.get_archive_headers(archive,
+                                                           index=index)
         sortedseries = sorted(manifest.items(),
                               key=lambda x: x[1].get('SeriesNumber'))
         for path, dataset in sortedseries:
@@ -39,7 +39,6 @@ Info on allow-incomplete:
 import os
 import json
 import glob
-from shutil import copyfile
 import logging
 from string import Template
 
@@ -47,7 +46,9 @@ from docopt import docopt
 
 import datman.config as config
 import datman.scanid as scanid
+from datman.utils import materialize_file, get_transfer_methods
 import datman.scan as scan
+import datman.inventory as inventory
 import datman.dashboard as dashboard
 
 from datman.bids.check_bids import BIDSEnforcer
@@ -135,16 +136,19 @@ class BIDSFile(object):
         return BIDSFile(self.sub, self.ses, self.series, self.dest_dir,
                         self.bids, self.spec)
 
-    def transfer_files(self):
+    def transfer_files(self, methods=None):
         """
         Perform data transformation from DATMAN into BIDS
+
+        'methods' restricts how files may be transferred, see
+        datman.utils.materialize_file
         """
 
         # Make destination directory
         os.makedirs(self.dest_dir, exist_ok=True)
 
         # Copy over NIFTI file and transform into BIDS name
-        copyfile(self.source, self.dest_nii)
+        materialize_file(self.source, self.dest_nii, methods=methods)
 
         # Write JSON file
         json_destination = os.path.join(self.dest_dir, self.bids + ".json")
@@ -158,7 +162,7 @@ class BIDSFile(object):
                 dst = os.path.join(self.dest_dir, self.bids + b)
 
                 try:
-                    copyfile(src, dst)
+                    materialize_file(src, dst, methods=methods)
                 except IOError:
                     logger.error("Cannot find file {}".format(src))
         return
@@ -673,13 +677,13 @@ def prioritize_scans(series_list):
     return [f for f in series_list if f not in to_filt]
 
 
-def process_subject(subject, cfg, be, bids_dir, rewrite):
+def process_subject(subject, cfg, be, bids_dir, rewrite, study_files=None):
     """
     Convert subject in DATMAN folder to BIDS-style
     """
 
     ident = scanid.parse(subject)
-    subscan = scan.Scan(subject, cfg)
+    subscan = scan.Scan(subject, cfg, inventory=study_files)
     bids_sub = ident.get_bids_name()
     bids_ses = ident.timepoint
     exp_path = make_bids_template(bids_dir, "sub-" + bids_sub,
@@ -732,11 +736,12 @@ def process_subject(subject, cfg, be, bids_dir, rewrite):
     dm_to_bids = prepare_fieldmaps(dm_to_bids)
 
     # Transfer files over
+    methods = get_transfer_methods(cfg)
     for k in dm_to_bids:
         if os.path.exists(k.dest_nii) and not rewrite:
             logger.info("Output file {} already exists!".format(k.dest_nii))
             continue
-        k.transfer_files()
+        k.transfer_files(methods=methods)
         if dashboard.dash_found:
             db_series = dashboard.get_scan(k.series.path)
             db_series.add_bids(str(k))
@@ -768,8 +773,9 @@ def main():
 
     make_dataset_description(bids_dir, study, be.version)
 
+    study_files = inventory.StudyInventory(cfg, folders=["nii"])
     if not subjects:
-        subjects = os.listdir(cfg.get_path("nii"))
+        subjects = study_files.subject_ids("nii")
 
     for s in subjects:
 
@@ -778,7 +784,7 @@ def main():
             continue
 
         logger.info("Processing: {}".format(s))
-        process_subject(s, cfg, be, bids_dir, rewrite)
+        process_subject(s, cfg, be, bids_dir, rewrite, study_files)
 
 
 if __name__ == "__main__":
@@ -31,6 +31,7 @@ import shutil
 from docopt import docopt
 
 import datman.config
+import datman.inventory
 import datman.scan
 import datman.utils
 
@@ -62,13 +63,14 @@ def main():
     config = datman.config.config(study=project)
     metadata = datman.utils.get_subject_metadata(config, allow_partial=True)
     search_paths = get_search_paths(config, override_paths)
+    inventory = datman.inventory.StudyInventory(config, folders=search_paths)
 
     for sub in metadata:
         if not metadata[sub]:
             continue
 
         logger.debug(f"Working on {sub}")
-        session = datman.scan.Scan(sub, config)
+        session = inventory.get_scan(sub)
         handle_blacklisted_scans(
             session, metadata[sub], search_paths, keep=keep
         )
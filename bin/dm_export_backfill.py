@@ -0,0 +1,442 @@
+#!/usr/bin/env python
+"""
+Re-runs the 'nii_link' and 'db' session exporters for a study using only the
+contents of its local bids folder.
+
+dm_xnat_extract.py can only re-run these exporters by fetching every
+experiment from XNAT again. This is slow and unnecessary after a change to
+the datman configuration (e.g. a new tag or bids mapping) because both
+exporters work from the files already in the bids folder. This script
+rebuilds them from the local data instead, and runs many sessions at once.
+
+SESSIONS
+    Unless session IDs are given, sessions are found by searching the bids
+    folder for sub-<site><subject>/ses-<timepoint> directories. The session
+    (repeat) number is read from the 'Repeat' field of each JSON side car
+    and defaults to 01.
+
+LIMITATIONS
+    The XNAT scan list is not available offline, so the side cars stand in
+    for it. This means that error files are not written for scans that are
+    on XNAT but missing from the bids folder, and shared sessions are not
+    linked to their source session on the dashboard. Run dm_xnat_extract.py
+    for those.
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+import os
+import re
+import sys
+
+import datman.config
+import datman.dashboard
+import datman.exporters
+import datman.scan
+import datman.scanid
+from datman.utils import get_allocated_cores, read_json
+
+from bin.dm_xnat_extract import get_identifier
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+BACKFILL_FORMATS = ("nii_link", "db")
+
+
+class LocalScan:
+    """Stands in for a :obj:`datman.xnat.XNATScan` using a bids side car.
+
+    Args:
+        side_car (:obj:`dict`): The contents of a JSON side car file.
+    """
+
+    def __init__(self, side_car):
+        self.series = str(side_car.get("SeriesNumber", ""))
+        self.description = side_car.get("SeriesDescription", "")
+        # Expected names come from XNAT, so none are known offline
+        self.names = []
+
+    def __repr__(self):
+        return f"<LocalScan {self.series} - {self.description}>"
+
+
+class LocalExperiment:
+    """Stands in for a :obj:`datman.xnat.XNATExperiment` using bids data.
+
+    Args:
+        session (:obj:`datman.scan.Scan`): The datman session to describe.
+    """
+
+    def __init__(self, session):
+        self.name = str(session._ident)
+        self.source_name = None
+        self.scans = []
+        self.date = None
+        self._read_side_cars(session)
+
+    def _read_side_cars(self, session):
+        """Create a scan for each side car that belongs to this session.
+        """
+        for path, _, files in os.walk(session.bids_path):
+            for item in sorted(files):
+                if not item.endswith(".json"):
+                    continue
+                try:
+                    side_car = read_json(os.path.join(path, item))
+                except Exception as e:
+                    logger.debug(f"Can't read side car {item} - {e}")
+                    continue
+
+                repeat = side_car.get("Repeat")
+                if repeat and repeat != session.session:
+                    continue
+
+                self.scans.append(LocalScan(side_car))
+                if not self.date:
+                    self.date = get_scan_date(side_car)
+
+    def is_shared(self):
+        return False
+
+    def __repr__(self):
+        return f"<LocalExperiment {self.name}>"
+
+
+def get_scan_date(side_car):
+    """Get the scan date in YYYY-MM-DD format from a side car, if present.
+    """
+    acq_time = side_car.get("AcquisitionDateTime", "")
+    match = re.match(r"(\d{4}-\d{2}-\d{2})", acq_time)
+    if not match:
+        return None
+    return match.group(1)
+
+
+def main():
+    args = read_args()
+    configure_logging(args.study, args)
+
+    config = datman.config.config(study=args.study)
+
+    if args.bids_root:
+        bids_root = args.bids_root
+    else:
+        try:
+            bids_root = config.get_path("bids")
+        except datman.config.UndefinedSetting:
+            logger.error(f"No bids path defined for {args.study}")
+            return
+
+    formats = get_formats(args.format)
+    if not formats:
+        logger.error("No exporters left to run.")
+        return
+
+    if args.session:
+        session_ids = args.session
+    else:
+        session_ids = find_sessions(config, bids_root)
+    logger.info(f"Found {len(session_ids)} sessions for {args.study}")
+
+    results = run_backfill(
+        args.study, session_ids, formats, bids_root=bids_root,
+        dry_run=args.dry_run, jobs=args.jobs)
+    report_results(results, dry_run=args.dry_run)
+
+
+def read_args():
+    parser = ArgumentParser(
+        description="Re-runs the nii_link and db session exporters for a "
+                    "study using only its local bids folder.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "study",
+        action="store",
+        help="Nickname of the study to process",
+    )
+    parser.add_argument(
+        "session",
+        action="store",
+        nargs="*",
+        help="Datman IDs (including session number) of the sessions to "
+             "process. Defaults to every session in the bids folder."
+    )
+    parser.add_argument(
+        "--format", action="append", choices=BACKFILL_FORMATS,
+        help="An exporter to run. Can repeat option to run several. "
+             "Defaults to all of them."
+    )
+    parser.add_argument(
+        "--bids-root", action="store", metavar="DIR",
+        help="The bids folder to read from, overrides the configured path."
+    )
+    parser.add_argument(
+        "--jobs", action="store", type=int, metavar="N",
+        default=get_allocated_cores(),
+        help="The maximum number of sessions to process at once. Defaults to "
+             "the number of cores allocated to this process."
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", default=False,
+        help="Show debug messages"
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", default=False,
+        help="Minimal logging"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", default=False,
+        help="Maximal logging"
+    )
+    parser.add_argument(
+        "-n", "--dry-run", action="store_true", default=False,
+        help="Only count the changes that would be made"
+    )
+    return parser.parse_args()
+
+
+def configure_logging(study, args):
+    if args.quiet:
+        log_level = logging.ERROR
+    elif args.debug:
+        log_level = logging.DEBUG
+    elif args.verbose:
+        log_level = logging.INFO
+    else:
+        log_level = logging.WARNING
+
+    ch = logging.StreamHandler(sys.stdout)
+    logger.setLevel(log_level)
+    ch.setLevel(log_level)
+
+    formatter = logging.Formatter('%(asctime)s - %(name)s - {study} - '
+                                  '%(levelname)s - %(message)s'
+                                  .format(study=study))
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    logging.getLogger('datman.utils').addHandler(ch)
+    logging.getLogger('datman.dashboard').addHandler(ch)
+    logging.getLogger('datman.exporters').addHandler(ch)
+
+
+def get_formats(requested=None):
+    """Get the session exporters to run.
+
+    Args:
+        requested (:obj:`list`, optional): The user requested exporter
+            types. Defaults to all backfill formats.
+
+    Returns:
+        list: The exporter types to run.
+    """
+    formats = list(requested or BACKFILL_FORMATS)
+    if "db" in formats and not datman.dashboard.dash_found:
+        logger.warning("Dashboard database not found, 'db' exporter will "
+                       "not be run.")
+        formats.remove("db")
+    return formats
+
+
+def find_sessions(config, bids_root):
+    """Find the datman IDs for every session in a bids folder.
+
+    Args:
+        config (:obj:`datman.config.config`): A datman config object for
+            the study.
+        bids_root (:obj:`str`): The full path to the study's bids folder.
+
+    Returns:
+        list: A list of datman style session IDs (including session
+            number).
+    """
+    sites = sorted(config.get_sites(), key=len, reverse=True)
+    study_tags = config.get_study_tags()
+
+    session_ids = []
+    for sub_dir in sorted(os.listdir(bids_root)):
+        if not sub_dir.startswith("sub-"):
+            continue
+
+        label = sub_dir.replace("sub-", "", 1)
+        site = next((item for item in sites if label.startswith(item)), None)
+        if not site:
+            logger.debug(f"Ignoring {sub_dir}, doesn't match a known site.")
+            continue
+        subject = label[len(site):]
+
+        tags = [tag for tag, tag_sites in study_tags.items()
+                if tag and site in tag_sites]
+        if not tags:
+            logger.error(f"No study tag defined for site {site}")
+            continue
+
+        for ses_dir in sorted(os.listdir(os.path.join(bids_root, sub_dir))):
+            if not ses_dir.startswith("ses-"):
+                continue
+            timepoint = ses_dir.replace("ses-", "", 1)
+            repeats = get_repeats(os.path.join(bids_root, sub_dir, ses_dir))
+            for repeat in repeats:
+                subid = pick_session_id(
+                    config, tags, site, subject, timepoint, repeat)
+                if subid:
+                    session_ids.append(subid)
+    return session_ids
+
+
+def get_repeats(ses_path):
+    """Get all session (repeat) numbers recorded in a bids session folder.
+    """
+    repeats = set()
+    for path, _, files in os.walk(ses_path):
+        for item in files:
+            if not item.endswith(".json"):
+                continue
+            try:
+                side_car = read_json(os.path.join(path, item))
+            except Exception:
+                continue
+            repeats.add(side_car.get("Repeat") or "01")
+    return sorted(repeats) or ["01"]
+
+
+def pick_session_id(config, tags, site, subject, timepoint, repeat):
+    """Build a valid datman ID for a bids session.
+
+    A site may belong to more than one study tag. When it does, the tag
+    that already has a nii folder for the session is preferred.
+
+    Returns:
+        str: A datman style session ID or None if no valid ID can be made.
+    """
+    candidates = []
+    for tag in tags:
+        subid = f"{tag}_{site}_{subject}_{timepoint}_{repeat}"
+        try:
+            datman.scanid.parse(subid)
+        except datman.scanid.ParseException:
+            continue
+        candidates.append(subid)
+
+    if not candidates:
+        logger.error(f"Can't make a valid datman ID for bids subject "
+                     f"{site}{subject} session {timepoint}")
+        return None
+
+    try:
+        nii_dir = config.get_path("nii")
+    except datman.config.UndefinedSetting:
+        return candidates[0]
+
+    for subid in candidates:
+        ident = datman.scanid.parse(subid)
+        if os.path.exists(os.path.join(
+                nii_dir, ident.get_full_subjectid_with_timepoint())):
+            return subid
+    return candidates[0]
+
+
+def run_backfill(study, session_ids, formats, bids_root=None, dry_run=False,
+                 jobs=1):
+    """Run the offline session exporters for many sessions.
+
+    Args:
+        study (:obj:`str`): The name of the study the sessions belong to.
+        session_ids (:obj:`list`): A list of datman style session IDs.
+        formats (:obj:`list`): The session exporter types to run.
+        bids_root (:obj:`str`, optional): The bids folder to read from.
+            Defaults to None, in which case the configured path is used.
+        dry_run (bool, optional): If True, only count the pending changes.
+            Defaults to False.
+        jobs (int, optional): The maximum number of sessions to process at
+            once. Defaults to 1.
+
+    Returns:
+        :obj:`dict`: A dictionary mapping each session ID to a dictionary
+            of the number of pending changes for each exporter type.
+    """
+    args = (formats, bids_root, dry_run)
+    results = {}
+
+    if jobs < 2 or len(session_ids) < 2:
+        for subid in session_ids:
+            results[subid] = _run_session(study, subid, *args)
+        return results
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(_run_session, study, subid, *args): subid
+            for subid in session_ids
+        }
+        for future in as_completed(futures):
+            subid = futures[future]
+            try:
+                results[subid] = future.result()
+            except Exception as e:
+                logger.error(f"Backfill for {subid} failed - {e}")
+    return results
+
+
+def _run_session(study, subid, formats, bids_root=None, dry_run=False):
+    """Run the session exporters for a single session.
+
+    This is a module level function so it can be run in a worker process.
+    It returns an empty dictionary if the session could not be processed.
+    """
+    try:
+        config = datman.config.config(study=study)
+        ident = get_identifier(config, subid)
+        session = datman.scan.Scan(ident, config, bids_root=bids_root)
+    except Exception as e:
+        logger.error(f"Can't read session {subid} - {e}")
+        return {}
+
+    experiment = LocalExperiment(session)
+
+    pending = {}
+    for exp_format in formats:
+        Exporter = datman.exporters.get_exporter(exp_format, scope="session")
+        try:
+            exporter = Exporter(config, session, experiment, dry_run=dry_run)
+            pending[exp_format] = count_pending(exporter)
+        except Exception as e:
+            logger.error(f"Can't run {exp_format} exporter for {subid} - {e}")
+            continue
+
+        if pending[exp_format] and not dry_run:
+            try:
+                exporter.export()
+            except Exception as e:
+                logger.error(f"Exporter {exporter} failed - {e}")
+    return pending
+
+
+def count_pending(exporter):
+    """Count the changes an exporter would make.
+
+    The nii_link exporter reports each missing link. Other exporters can
+    only report whether they have anything left to do.
+    """
+    if isinstance(exporter, datman.exporters.NiiLinkExporter):
+        return len(exporter.find_pending())
+    return 0 if exporter.outputs_exist() else 1
+
+
+def report_results(results, dry_run=False):
+    totals = {}
+    changed = 0
+    for pending in results.values():
+        if any(pending.values()):
+            changed += 1
+        for exp_format, count in pending.items():
+            totals[exp_format] = totals.get(exp_format, 0) + count
+
+    action = "need" if dry_run else "had"
+    summary = ", ".join(f"{exp_format}: {count}"
+                        for exp_format, count in sorted(totals.items()))
+    print(f"{changed} of {len(results)} sessions {action} updates. "
+          f"Pending changes - {summary or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Maintains a study's dicom header index.
+
+dm_link.py, dm_xnat_upload.py and xnat_fetch_sessions.py read the dicom
+headers of every zip file they check. The header index stores these headers
+(without pixel data) in the study's 'meta' folder so that unchanged zip files
+don't have to be read again. These scripts add to the index as they run, so
+this script is only needed to build it ahead of time or to clean it up.
+
+COMMANDS
+    build   Read the headers of every zip file in the study's 'zips' folder
+            that isn't already indexed (or has changed since it was).
+    prune   Remove entries for zip files that have been deleted or changed.
+"""
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import sys
+
+import datman.config
+import datman.header_index
+from datman.utils import get_allocated_cores
+
+logger = logging.getLogger(os.path.basename(__file__))
+
+
+def main():
+    args = read_args()
+    configure_logging(args.study, args)
+
+    config = datman.config.config(study=args.study)
+    index = datman.header_index.get_header_index(config, path=args.index)
+    if index is None:
+        logger.error(f"No 'meta' path defined for {args.study}, please "
+                     "provide the location of the index with --index")
+        return
+
+    if args.command == "prune":
+        removed = index.prune()
+        logger.info(f"Removed {removed} entries from {index.db_path}")
+        return
+
+    if args.archive:
+        archives = args.archive
+    else:
+        archives = find_archives(config.get_path("zips"))
+    updated = build_index(index, archives, jobs=args.jobs)
+    logger.info(f"Indexed {updated} of {len(archives)} archives in "
+                f"{index.db_path}")
+
+
+def read_args():
+    parser = ArgumentParser(
+        description="Builds or prunes a study's dicom header index.",
+        formatter_class=ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "command",
+        action="store",
+        choices=["build", "prune"],
+        help="The action to take",
+    )
+    parser.add_argument(
+        "study",
+        action="store",
+        help="Nickname of the study to process",
+    )
+    parser.add_argument(
+        "archive",
+        action="store",
+        nargs="*",
+        help="The archives to index. Defaults to every zip file in the "
+             "study's 'zips' folder. Ignored by 'prune'."
+    )
+    parser.add_argument(
+        "--index", action="store", metavar="FILE",
+        help="The index file to use, overrides the default location in the "
+             "study's 'meta' folder."
+    )
+    parser.add_argument(
+        "--jobs", action="store", type=int, metavar="N",
+        default=get_allocated_cores(),
+        help="The maximum number of archives to read at once. Defaults to "
+             "the number of cores allocated to this process."
+    )
+    parser.add_argument(
+        "-d", "--debug", action="store_true", default=False,
+        help="Show debug messages"
+    )
+    parser.add_argument(
+        "-q", "--quiet", action="store_true", default=False,
+        help="Minimal logging"
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", default=False,
+        help="Maximal logging"
+    )
+    return parser.parse_args()
+
+
+def configure_logging(study, args):
+    if args.quiet:
+        log_level = logging.ERROR
+    elif args.debug:
+        log_level = logging.DEBUG
+    elif args.verbose:
+        log_level = logging.INFO
+    else:
+        log_level = logging.WARNING
+
+    ch = logging.StreamHandler(sys.stdout)
+    logger.setLevel(log_level)
+    ch.setLevel(log_level)
+
+    formatter = logging.Formatter('%(asctime)s - %(name)s - {study} - '
+                                  '%(levelname)s - %(message)s'
+                                  .format(study=study))
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    logging.getLogger('datman.header_index').addHandler(ch)
+
+
+def find_archives(zips_path):
+    """Find all zip files in a folder.
+
+    Args:
+        zips_path (:obj:`str`): The full path to a study's 'zips' folder.
+
+    Returns:
+        list: A sorted list of full paths to each zip file.
+    """
+    try:
+        contents = os.listdir(zips_path)
+    except FileNotFoundError:
+        logger.error(f"Zips path {zips_path} doesn't exist")
+        return []
+    return sorted(os.path.join(zips_path, item) for item in contents
+                  if item.endswith(".zip"))
+
+
+def build_index(index, archives, jobs=1):
+    """Add any archives that are missing or out of date to a header index.
+
+    Args:
+        index (:obj:`datman.header_index.HeaderIndex`): The index to update.
+        archives (:obj:`list`): A list of full paths to archives to index.
+        jobs (int, optional): The number of archives to read at once.
+
+    Returns:
+        int: The number of archives that were read.
+    """
+    def update(archive):
+        try:
+            return index.update(archive)
+        except Exception as e:
+            logger.error(f"Failed to index {archive} - {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+        return sum(pool.map(update, archives))
+
+
+if __name__ == "__main__":
+    main()
@@ -80,6 +80,7 @@ from docopt import docopt
 import pandas as pd
 
 import datman.config
+import datman.header_index
 import datman.scanid
 import datman.utils
 
@@ -88,6 +89,7 @@ logger = logging.getLogger(os.path.basename(__file__))
 already_linked = {}
 lookup = None
 DRYRUN = None
+HEADER_INDEX = None
 
 
 def main():
@@ -95,6 +97,7 @@ def main():
     global already_linked
     global lookup
     global DRYRUN
+    global HEADER_INDEX
 
     arguments = docopt(__doc__)
     verbose = arguments["--verbose"]
@@ -129,6 +132,7 @@ def main():
 
     # setup the config object
     cfg = datman.config.config(study=study)
+    HEADER_INDEX = datman.header_index.get_header_index(cfg)
     if not lookup_path:
         lookup_path = os.path.join(cfg.get_path("meta"), "scans.csv")
 
@@ -261,8 +265,8 @@ def get_archive_headers(archive_path):
     # get some DICOM headers from the archive
     header = None
     try:
-        header = datman.utils.get_archive_headers(archive_path,
-                                                  stop_after_first=True)
+        header = datman.header_index.get_archive_headers(
+            archive_path, stop_after_first=True, index=HEADER_INDEX)
         header = list(header.values())[0]
     except Exception:
         logger.warning("Archive: {} contains no DICOMs".format(archive_path))
@@ -177,13 +177,13 @@ def link_files(tags, src_session, trg_session, src_data_dir, trg_data_dir):
                                                                    src_dir))
 
     for root, dirs, files in os.walk(src_dir):
-        for filename in files:
-            try:
-                ident, file_tag, series, description = \
-                    dm.scanid.parse_filename(filename)
-            except dm.scanid.ParseException:
+        parsed = dm.scanid.parse_filenames(files)
+        for filename, error, session, file_tag, series, description in zip(
+                files, parsed["error"], parsed["session"], parsed["tag"],
+                parsed["series"], parsed["description"]):
+            if error:
                 continue
-            if ident.session == src_session.session and file_tag in tags:
+            if session == src_session.session and file_tag in tags:
                 # If the file is from the same session we're supposed to link
                 # and the tag is in the list, make a link.
 
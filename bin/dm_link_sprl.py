@@ -113,7 +113,8 @@ def process_session(cfg, dir_nii, dir_res, session):
         # only gives the first, check with a default session number before
         # giving up.
         if not ident.session:
-            ident.session = '01'
+            ident = datman.scanid.parse(
+                ident.get_full_subjectid_with_timepoint() + '_01')
             session_res = os.path.join(dir_res, str(ident))
         if os.path.isdir(session_res):
             subject_res = session_res
@@ -22,13 +22,13 @@ Options:
 """
 
 import os
-import glob
 import logging
 from nilearn import plotting
 import numpy as np
 from docopt import docopt
 
 import datman.config
+import datman.inventory
 import datman.scan
 
 
@@ -37,11 +37,8 @@ logging.basicConfig(level=logging.WARN,
 logger = logging.getLogger(os.path.basename(__file__))
 
 
-def get_all_subjects(config):
-    nii_dir = config.get_path("nii")
-    subject_nii_dirs = glob.glob(os.path.join(nii_dir, "*"))
-    all_subs = [os.path.basename(path) for path in subject_nii_dirs]
-    return all_subs
+def get_all_subjects(inventory):
+    return inventory.subject_ids("nii")
 
 
 def main():
@@ -64,13 +61,15 @@ def main():
     if debug:
         logger.setLevel(logging.DEBUG)
 
+    inventory = datman.inventory.StudyInventory(config, folders=["nii"])
+
     if subs:
         logger.info(
             f"Creating pictures for subjects [ {', '.join(subs)} ] from "
             f"{study} project using {tag} scans."
         )
     else:
-        subs = get_all_subjects(config)
+        subs = get_all_subjects(inventory)
         logger.info(
             f"Creating pictures for all {len(subs)} subjects from {study} "
             f"project using {tag} scans."
@@ -87,7 +86,7 @@ def main():
 
     for subject in subs:
 
-        scan = datman.scan.Scan(subject, config)
+        scan = inventory.get_scan(subject)
         tagged_scan = scan.get_tagged_nii(tag)
         idx = np.argmax([ss.series_num for ss in tagged_scan])
 
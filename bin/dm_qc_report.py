@@ -20,6 +20,8 @@ Options:
     --log-to-server    If set, all log messages will also be sent to the
                        configured logging server. This is useful when the
                        script is run on the queue, since it swallows logging.
+    --bundle-size N    The number of subjects to process in each task of
+                       the submitted array job [default: 1]
     -q --quiet         Only report errors
     -v --verbose       Be chatty
     -d --debug         Be extra chatty
@@ -31,7 +33,6 @@ Requires:
 """
 
 import os
-import glob
 import time
 import logging
 import logging.handlers
@@ -42,6 +43,7 @@ from docopt import docopt
 import datman.config
 import datman.utils
 import datman.scan
+import datman.inventory
 import datman.dashboard
 import datman.metrics
 from datman.exceptions import InputException, ParseException, QCException
@@ -81,7 +83,8 @@ def main():
         logger.setLevel(logging.DEBUG)
 
     if not session:
-        return submit_subjects(config)
+        return submit_subjects(
+            config, bundle_size=int(arguments["--bundle-size"]))
 
     if not datman.dashboard.dash_found:
         logger.error("Dashboard database not found, can't run.")
@@ -131,11 +134,15 @@ def add_server_handler(config):
     logger.addHandler(server_handler)
 
 
-def submit_subjects(config):
+def submit_subjects(config, bundle_size=1):
     """Submit a job for each subject in the study that still needs metrics.
 
+    All subjects are submitted together as a single array job.
+
     Args:
         config (:obj:`datman.config.config`): A config object for the study.
+        bundle_size (int, optional): The number of subjects to process in
+            each task of the array job. Default 1.
     """
     missing_cmds = check_prerequisites()
     if missing_cmds:
@@ -145,20 +152,29 @@ def submit_subjects(config):
         )
         return
 
-    subs = get_subids(config)
+    inventory = datman.inventory.StudyInventory(config, folders=["nii"])
+    subs = get_subids(inventory)
 
+    commands = []
     for subject in subs:
-        if not (REMAKE or REFRESH or needs_qc(subject, config)):
+        if not (REMAKE or REFRESH or needs_qc(subject, config, inventory)):
             continue
+        logger.info(f"Adding QC job for {subject}.")
+        commands.append(make_command(subject))
 
-        command = make_command(subject)
-        job_name = f"qc-{subject}-{time.strftime('%Y%m%d')}"
+    if not commands:
+        return
 
-        logger.info(f"Submitting QC job for {subject}.")
-        datman.utils.submit_job(
-            command, job_name, "/tmp", system=config.system,
-            argslist="--mem=5G"
+    job_name = f"qc-{config.study_name}-{time.strftime('%Y%m%d')}"
+    try:
+        datman.utils.submit_jobs(
+            commands, job_name, "/tmp", queue=datman.utils.get_queue(config),
+            bundle_size=bundle_size,
+            argslist="--mem=5G",
+            script_dir=datman.utils.get_job_script_dir(config)
         )
+    except (RuntimeError, ValueError) as e:
+        logger.error(f"Failed to submit QC jobs. {e}")
 
 
 def check_prerequisites():
@@ -174,16 +190,14 @@ def check_prerequisites():
     return list(set(missing_requirements))
 
 
-def get_subids(config):
+def get_subids(inventory):
     """Find all subject IDs for a study.
 
     Args:
-        config (:obj:`datman.config.config`): A config object for the study.
+        inventory (:obj:`datman.inventory.StudyInventory`): An inventory
+            of the study's nii folder.
     """
-    nii_dir = config.get_path("nii")
-    subject_nii_dirs = glob.glob(os.path.join(nii_dir, "*"))
-    all_subs = [os.path.basename(path) for path in subject_nii_dirs]
-    return all_subs
+    return inventory.subject_ids("nii")
 
 
 def make_command(subject_id):
@@ -199,6 +213,10 @@ def make_command(subject_id):
         if not (arg.startswith("-") and arguments[arg]):
             continue
 
+        if arg == "--bundle-size":
+            # Only used when submitting
+            continue
+
         if isinstance(arguments[arg], bool):
             command.append(arg)
         else:
@@ -208,18 +226,21 @@ def make_command(subject_id):
 
 
 @datman.dashboard.release_db
-def needs_qc(subject_id, config):
+def needs_qc(subject_id, config, inventory=None):
     """Check if any QC metrics are missing for a subject.
 
     Args:
         subject_id (:obj:`str`): The ID of a subject belonging to the study.
         config (:obj:`datman.config.config`): A config object for the study.
+        inventory (:obj:`datman.inventory.StudyInventory`, optional): An
+            inventory of the study's files to find the subject's niftis in.
 
     Returns:
         bool: True if any metrics are missing, False otherwise.
     """
     try:
-        subject = datman.scan.Scan(subject_id, config)
+        subject = datman.scan.Scan(subject_id, config, inventory=inventory)
+        niftis = subject.niftis
     except ParseException:
         logger.error(f"{subject_id} does not conform to datman naming "
                      "convention. Ignoring.")
@@ -230,7 +251,7 @@ def needs_qc(subject_id, config):
 
     handlers = datman.metrics.get_handlers(subject)
 
-    for nii in subject.niftis:
+    for nii in niftis:
         scan = datman.dashboard.get_scan(nii.file_name)
 
         if not scan:
@@ -272,6 +293,8 @@ def prepare_scan(subject_id, config):
     """
     try:
         subject = datman.scan.Scan(subject_id, config)
+        # Misnamed niftis are only detected when the folder is first read
+        subject.niftis
     except ParseException as e:
         logger.error(e, exc_info=True)
         raise e
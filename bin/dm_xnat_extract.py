@@ -44,10 +44,10 @@ DEPENDENCIES
 
 """
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import logging
 import os
 import platform
-import shutil
 import sys
 
 import datman.config
@@ -57,7 +57,9 @@ import datman.scan
 import datman.scanid
 import datman.xnat
 from datman.utils import (validate_subject_id, define_folder,
-                          make_temp_directory, locate_metadata, read_blacklist)
+                          make_temp_directory, locate_metadata,
+                          get_metadata_store, get_allocated_cores,
+                          get_transfer_methods, materialize_file)
 
 logger = logging.getLogger(os.path.basename(__file__))
 
@@ -157,13 +159,15 @@ def main():
 
         if xnat_experiment.resource_files:
             export_resources(session.resource_path, xnat, xnat_experiment,
-                             dry_run=args.dry_run)
+                             dry_run=args.dry_run,
+                             transfer_methods=get_transfer_methods(config))
 
         if xnat_experiment.scans:
             export_scans(config, xnat, xnat_experiment, session,
                          bids_opts=bids_opts, dry_run=args.dry_run,
                          ignore_db=args.dont_update_dashboard,
-                         wanted_tags=args.tag)
+                         wanted_tags=args.tag,
+                         convert_jobs=args.convert_jobs)
 
 
 def read_args():
@@ -234,6 +238,12 @@ def read_args():
         "--use-dcm2bids", action="store_true", default=False,
         help="Pull xnat data and convert to bids using dcm2bids"
     )
+    g_main.add_argument(
+        "--convert-jobs", action="store", type=int, metavar="N",
+        default=get_allocated_cores(),
+        help="The maximum number of series to convert at once. Defaults to "
+             "the number of cores allocated to this process."
+    )
 
     g_dcm2bids = parser.add_argument_group(
         "Options for using dcm2bids"
@@ -445,7 +455,8 @@ def get_xnat_experiment(xnat, project, ident):
     return xnat_experiment
 
 
-def export_resources(resource_dir, xnat, xnat_experiment, dry_run=False):
+def export_resources(resource_dir, xnat, xnat_experiment, dry_run=False,
+                     transfer_methods=None):
     logger.info(f"Extracting {len(xnat_experiment.resource_files)} resources "
                 f"from {xnat_experiment.name}")
 
@@ -497,11 +508,13 @@ def export_resources(resource_dir, xnat, xnat_experiment, dry_run=False):
                                   xnat_resource_id,
                                   resource['URI'],
                                   resource_path,
-                                  dry_run=dry_run)
+                                  dry_run=dry_run,
+                                  transfer_methods=transfer_methods)
 
 
 def download_resource(xnat, xnat_experiment, xnat_resource_id,
-                      xnat_resource_uri, target_path, dry_run=False):
+                      xnat_resource_uri, target_path, dry_run=False,
+                      transfer_methods=None):
     """
     Download a single resource file from XNAT. Target path should be
     full path to store the file, including filename
@@ -532,15 +545,18 @@ def download_resource(xnat, xnat_experiment, xnat_resource_id,
             logger.error(f"Failed to create directory: {target_dir}")
             return
 
-    # copy the downloaded file to the target location
+    # move the downloaded file to the target location. It was made by
+    # mkstemp, so it must be given normal permissions if it's not copied
     try:
-        if not dry_run:
-            shutil.copyfile(source, target_path)
+        materialize_file(source, target_path, move=True,
+                         methods=transfer_methods, reset_mode=True)
     except (IOError, OSError):
         logger.error(f"Failed copying resource {source} to target "
                      f"{target_path}")
+    else:
+        return target_path
 
-    # finally delete the temporary archive
+    # the transfer failed, so clean up the temporary archive
     try:
         os.remove(source)
     except OSError:
@@ -550,7 +566,8 @@ def download_resource(xnat, xnat_experiment, xnat_resource_id,
 
 
 def export_scans(config, xnat, xnat_experiment, session, bids_opts=None,
-                 wanted_tags=None, ignore_db=False, dry_run=False):
+                 wanted_tags=None, ignore_db=False, dry_run=False,
+                 convert_jobs=1):
     """Export all XNAT data for a session to desired formats.
 
     Args:
@@ -571,6 +588,8 @@ def export_scans(config, xnat, xnat_experiment, session, bids_opts=None,
             be updated. Defaults to False.
         dry_run (bool, optional): If True, no outputs will be made. Defaults
             to False.
+        convert_jobs (int, optional): The maximum number of series exporters
+            to run at once. Defaults to 1.
     """
     logger.info(f"Processing scans in experiment {xnat_experiment.name}")
 
@@ -582,7 +601,7 @@ def export_scans(config, xnat, xnat_experiment, session, bids_opts=None,
 
     series_exporters = make_all_series_exporters(
         config, session, xnat_experiment, bids_opts=bids_opts,
-        wanted_tags=wanted_tags, dry_run=dry_run
+        wanted_tags=wanted_tags, dry_run=dry_run, convert_jobs=convert_jobs
     )
 
     if not needs_export(session_exporters) and not series_exporters:
@@ -594,8 +613,7 @@ def export_scans(config, xnat, xnat_experiment, session, bids_opts=None,
             if needs_download(scan, session_exporters, series_exporters):
                 scan.download(xnat, temp_dir)
 
-            for exporter in series_exporters.get(scan, []):
-                exporter.export(scan.download_dir)
+        run_series_exporters(series_exporters, jobs=convert_jobs)
 
         for exporter in session_exporters:
             try:
@@ -604,6 +622,70 @@ def export_scans(config, xnat, xnat_experiment, session, bids_opts=None,
                 logger.error(f"Exporter {exporter} failed - {e}")
 
 
+def run_series_exporters(series_exporters, jobs=1):
+    """Run the series exporters for a session, possibly in parallel.
+
+    Each exporter runs in its own worker process, so that several dcm2niix
+    conversions can happen at once. The allocated cores are split between
+    the workers, so that each dcm2niix uses no more than its share. Any
+    outputs or error logs are still written by the exporters themselves.
+
+    Args:
+        series_exporters (dict): A dictionary of :obj:`datman.xnat.XNATScan`
+            mapped to a list of the series exporters to run for that scan.
+        jobs (int, optional): The maximum number of exporters to run at
+            the same time. Defaults to 1, which runs each exporter in the
+            current process.
+    """
+    work = [
+        (exporter, scan.download_dir)
+        for scan in series_exporters
+        for exporter in series_exporters[scan]
+    ]
+
+    if not work:
+        return
+
+    if jobs is None or jobs < 2 or len(work) == 1:
+        for exporter, download_dir in work:
+            try:
+                _run_series_exporter(exporter, download_dir)
+            except Exception as e:
+                logger.error(f"Exporter {exporter} failed - {e}")
+        return
+
+    workers = min(jobs, len(work))
+    threads = max(1, get_allocated_cores() // workers)
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_limit_worker_threads,
+                             initargs=(threads,)) as pool:
+        futures = {
+            pool.submit(_run_series_exporter, exporter, download_dir):
+                exporter
+            for exporter, download_dir in work
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Exporter {futures[future]} failed - {e}")
+
+
+def _limit_worker_threads(threads):
+    """Limit the threads used by commands run in a series exporter worker.
+
+    dcm2niix builds that use OpenMP read OMP_NUM_THREADS. Compression
+    threads are limited by each exporter's 'Threads' setting instead.
+    """
+    os.environ["OMP_NUM_THREADS"] = str(threads)
+
+
+def _run_series_exporter(exporter, download_dir):
+    """Run a single series exporter. Must be picklable for worker pools.
+    """
+    exporter.export(download_dir)
+
+
 def make_session_exporters(config, session, experiment, bids_opts=None,
                            ignore_db=False, dry_run=False):
     """Creates exporters that take an entire session as input.
@@ -663,7 +745,7 @@ def get_session_formats(bids_opts=None, ignore_db=False):
 
 
 def make_all_series_exporters(config, session, experiment, bids_opts=None,
-                              wanted_tags=None, dry_run=False):
+                              wanted_tags=None, dry_run=False, convert_jobs=1):
     """Create series exporters for all scans in an experiment.
 
     Args:
@@ -680,6 +762,10 @@ def make_all_series_exporters(config, session, experiment, bids_opts=None,
             exporters created for them. Defaults to None.
         dry_run (bool, optional): If True, no outputs will be made. Defaults
             to False.
+        convert_jobs (int, optional): The number of series exporters that
+            will run at once. If more than 1, each exporter's compression
+            threads default to its share of the allocated cores.
+            Defaults to 1.
     """
     if bids_opts:
         return {}
@@ -695,7 +781,7 @@ def make_all_series_exporters(config, session, experiment, bids_opts=None,
 
         exporters = make_series_exporters(
             session, scan, tag_config, config, wanted_tags=wanted_tags,
-            dry_run=dry_run)
+            dry_run=dry_run, convert_jobs=convert_jobs)
 
         if exporters:
             series_exporters[scan] = exporters
@@ -713,7 +799,7 @@ def get_tag_settings(config, site):
 
 
 def make_series_exporters(session, scan, tag_config, config, wanted_tags=None,
-                          dry_run=False):
+                          dry_run=False, convert_jobs=1):
     """Create series exporters for a single scan.
 
     Args:
@@ -730,8 +816,13 @@ def make_series_exporters(session, scan, tag_config, config, wanted_tags=None,
             exporters created for them. Defaults to None.
         dry_run (bool, optional): If True, no outputs will be made. Defaults
             to False.
+        convert_jobs (int, optional): The number of series exporters that
+            will run at once. If more than 1, each exporter's compression
+            threads default to its share of the allocated cores.
+            Defaults to 1.
     """
     exporters = []
+    transfer_methods = get_transfer_methods(config)
     for idx, tag in enumerate(scan.tags):
         try:
             _ = datman.scanid.parse_filename(scan.names[idx])
@@ -750,6 +841,15 @@ def make_series_exporters(session, scan, tag_config, config, wanted_tags=None,
         if is_blacklisted(scan.names[idx], config):
             formats = []
 
+        compression = datman.exporters.get_nii_compression(
+            config, site=session.site,
+            tag_settings=tag_config.tags.get(tag))
+        if convert_jobs and convert_jobs > 1 and "Threads" not in compression:
+            # Each of the parallel exporters gets a share of the cores
+            compression = dict(compression)
+            compression["Threads"] = max(
+                1, get_allocated_cores() // convert_jobs)
+
         logger.debug(f"Found export formats {formats} for {scan}")
         for exp_format in formats:
             Exporter = datman.exporters.get_exporter(
@@ -762,7 +862,9 @@ def make_series_exporters(session, scan, tag_config, config, wanted_tags=None,
                 Exporter.get_output_dir(session),
                 scan.names[idx],
                 echo_dict=scan.echo_dict,
-                dry_run=dry_run
+                dry_run=dry_run,
+                compression=compression,
+                transfer_methods=transfer_methods
             )
 
             if not exporter.outputs_exist():
@@ -774,15 +876,7 @@ def make_series_exporters(session, scan, tag_config, config, wanted_tags=None,
 def is_blacklisted(scan_name, config):
     """Returns True if the given scan has been blacklisted.
     """
-    try:
-        blacklist_entry = read_blacklist(scan=scan_name, config=config)
-    except datman.scanid.ParseException:
-        logger.error(f"{scan_name} is not a datman ID, cannot check blacklist")
-        return False
-
-    if blacklist_entry:
-        return True
-    return False
+    return get_metadata_store(config=config).is_blacklisted(scan_name)
 
 
 def needs_raw(session_exporters):
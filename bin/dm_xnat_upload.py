@@ -32,6 +32,7 @@ import urllib.request
 from docopt import docopt
 
 import datman.config
+import datman.header_index
 import datman.utils
 import datman.scanid
 import datman.xnat
@@ -129,6 +130,13 @@ def process_archive(file_name, dicom_dir):
     # convention than file system uses.
     archive_file = os.path.join(dicom_dir, str(scanid) + ".zip")
 
+    try:
+        contents = read_archive_contents(archive_file)
+    except (OSError, zipfile.BadZipfile) as e:
+        logger.error("Failed reading archive {}. Reason - {}".format(
+            archive_file, e))
+        return
+
     xnat = datman.xnat.get_connection(CFG,
                                       site=scanid.site,
                                       url=SERVER_OVERRIDE,
@@ -148,9 +156,8 @@ def process_archive(file_name, dicom_dir):
         resource_exists = False
     else:
         try:
-            data_exists, resource_exists = check_files_exist(archive_file,
-                                                             xnat_experiment,
-                                                             xnat)
+            data_exists, resource_exists = check_files_exist(
+                archive_file, xnat_experiment, xnat, contents=contents)
         except Exception:
             logger.error("Failed checking xnat for experiment {}".format(
                 exper_id))
@@ -170,7 +177,7 @@ def process_archive(file_name, dicom_dir):
         logger.debug("Uploading resource from: {}".format(archive_file))
         try:
             upload_non_dicom_data(archive_file, xnat_subject.project, scanid,
-                                  xnat)
+                                  xnat, contents=contents)
         except Exception as e:
             logger.debug("An exception occurred: {}".format(e))
             pass
@@ -270,19 +277,31 @@ def get_scanid(archivefile):
     return ident
 
 
-def resource_data_exists(xnat_resources, archive):
+def read_archive_contents(archive):
+    """Classify the members of a zip file without extracting them.
+
+    See datman.utils.classify_zip_members for details.
+    """
     with zipfile.ZipFile(archive) as zf:
-        local_resources = datman.utils.get_resources(zf)
-        local_resources_mod = [item for item in local_resources
-                               if zf.read(item)]
-    empty_files = list(set(local_resources) - set(local_resources_mod))
+        return datman.utils.classify_zip_members(zf)
+
+
+def get_uploadable_resources(contents):
+    return contents["resource"] + contents["snapshot"]
+
+
+def resource_data_exists(xnat_resources, archive, contents=None):
+    if contents is None:
+        contents = read_archive_contents(archive)
+    local_resources = get_uploadable_resources(contents)
+    empty_files = contents["empty"]
     if empty_files:
         logger.warning("Cannot upload empty resource files {}, omitting."
                     "".format(", ".join(empty_files)))
     # paths in xnat are url encoded. Need to fix local paths to match
-    local_resources_mod = [urllib.request.pathname2url(p)
-                           for p in local_resources_mod]
-    if not set(local_resources_mod).issubset(set(xnat_resources)):
+    local_resources = [urllib.request.pathname2url(p)
+                       for p in local_resources]
+    if not set(local_resources).issubset(set(xnat_resources)):
         return False
     return True
 
@@ -308,14 +327,21 @@ def scan_data_exists(xnat_experiment, local_headers):
     return True
 
 
-def check_files_exist(archive, xnat_experiment, xnat):
+def check_files_exist(archive, xnat_experiment, xnat, contents=None):
     """Check to see if the dicom files in the local archive have
     been uploaded to xnat
     Returns True if all files exist, otherwise False
-    If the session UIDs don't match raises a warning"""
+    If the session UIDs don't match raises a warning
+
+    If the archive's contents have already been classified they can be given
+    to avoid reading it again."""
     logger.info("Checking {} contents on xnat".format(xnat_experiment.name))
     try:
-        local_headers = datman.utils.get_archive_headers(archive)
+        if contents is not None and not contents["dicom"]:
+            local_headers = {}
+        else:
+            local_headers = datman.header_index.get_archive_headers(
+                archive, config=CFG)
     except Exception:
         logger.error("Failed getting zip file headers for: {}".format(archive))
         return False, False
@@ -323,7 +349,8 @@ def check_files_exist(archive, xnat_experiment, xnat):
     xnat_resources = xnat_experiment.get_resources(xnat)
 
     if not local_headers:
-        resources_exist = resource_data_exists(xnat_resources, archive)
+        resources_exist = resource_data_exists(xnat_resources, archive,
+                                               contents=contents)
         return True, resources_exist
 
     if not xnat_experiment.scans:
@@ -336,14 +363,17 @@ def check_files_exist(archive, xnat_experiment, xnat):
         # Return true for both to prevent XNAT being modified
         return True, True
 
-    resources_exist = resource_data_exists(xnat_resources, archive)
+    resources_exist = resource_data_exists(xnat_resources, archive,
+                                           contents=contents)
 
     return scans_exist, resources_exist
 
 
-def upload_non_dicom_data(archive, xnat_project, scanid, xnat):
+def upload_non_dicom_data(archive, xnat_project, scanid, xnat, contents=None):
     with zipfile.ZipFile(archive) as zf:
-        resource_files = datman.utils.get_resources(zf)
+        if contents is None:
+            contents = datman.utils.classify_zip_members(zf)
+        resource_files = get_uploadable_resources(contents)
         logger.info("Uploading {} files of non-dicom data..."
                     .format(len(resource_files)))
         uploaded_files = []
@@ -399,34 +429,33 @@ def contains_niftis(archive):
 
 def strip_niftis(archive, temp):
     """
-    Extract the everything except niftis to temp folder, rezip, and then
+    Copy everything except niftis to a new zip in the temp folder, and then
     return the path to this temporary zip for upload
     """
-    unzip_dest = datman.utils.define_folder(os.path.join(temp, "extracted"))
     with zipfile.ZipFile(archive) as zf:
         archive_files = zf.namelist()
-        niftis = find_niftis(archive_files)
-        # Find and purge associated files too (e.g. .bvec and .bval), so they
-        # only appear in resources alongside their niftis
-        nifti_names = [datman.utils.splitext(os.path.basename(nii))[0]
-                       for nii in niftis]
-        deletable_files = [x for x in archive_files
-                           if datman.utils.splitext(os.path.basename(x))[0]
-                           in nifti_names]
-        non_niftis = [x for x in archive_files if x not in deletable_files]
-
-        # Check if any dicoms exist at all
-        non_niftis_or_paths = [i for i in non_niftis
-                               if not os.path.basename(i) == ""]
-
-        if not non_niftis_or_paths:
-            return []
-        else:
-            for item in non_niftis:
-                zf.extract(item, unzip_dest)
+    niftis = find_niftis(archive_files)
+    # Find and purge associated files too (e.g. .bvec and .bval), so they
+    # only appear in resources alongside their niftis
+    nifti_names = [datman.utils.splitext(os.path.basename(nii))[0]
+                   for nii in niftis]
+    deletable_files = {x for x in archive_files
+                       if datman.utils.splitext(os.path.basename(x))[0]
+                       in nifti_names}
+    non_niftis = [x for x in archive_files if x not in deletable_files]
+
+    # Check if any dicoms exist at all
+    non_niftis_or_paths = [i for i in non_niftis
+                           if not os.path.basename(i) == ""]
+
+    if not non_niftis_or_paths:
+        return []
 
     temp_zip = os.path.join(temp, os.path.basename(archive))
-    datman.utils.make_zip(unzip_dest, temp_zip)
+    datman.utils.filter_zip(
+        archive, temp_zip,
+        keep=lambda info: info.filename not in deletable_files
+    )
     return temp_zip
 
 
@@ -45,7 +45,6 @@ Options:
 """  # noqa: E501
 import os
 import sys
-import glob
 import shutil
 import logging
 import logging.handlers
@@ -54,6 +53,7 @@ from zipfile import ZipFile
 from docopt import docopt
 
 import datman.config
+import datman.header_index
 import datman.xnat
 import datman.utils
 
@@ -105,10 +105,10 @@ def main():
             continue
         username, password = get_credentials(credentials_file)
         with datman.xnat.xnat(server, username, password) as xnat:
-            download_subjects(xnat, project, destination)
+            download_subjects(xnat, project, destination, config=config)
 
 
-def download_subjects(xnat, xnat_project, destination):
+def download_subjects(xnat, xnat_project, destination, config=None):
     try:
         current_zips = os.listdir(destination)
     except FileNotFoundError:
@@ -143,7 +143,7 @@ def download_subjects(xnat, xnat_project, destination):
         zip_name = subject.name.upper() + ".zip"
         zip_path = os.path.join(destination, zip_name)
         if zip_name in current_zips and not update_needed(
-                zip_path, experiment, xnat):
+                zip_path, experiment, xnat, config=config):
             logger.debug("All data downloaded for {}. Passing.".format(
                 experiment.name))
             continue
@@ -165,14 +165,18 @@ def download_subjects(xnat, xnat_project, destination):
             restructure_zip(temp_zip, zip_path)
 
 
-def update_needed(zip_file, experiment, xnat):
+def update_needed(zip_file, experiment, xnat, config=None):
     """
     This checks if an update is needed the same way dm_xnat_upload does. The
     logic is not great. A single file being deleted / truncated / corrupted
     does not get noticed. Both of them need an update at some later date,
     preferably to use XNAT's metadata on num of files and file size.
+
+    If a config is given the study's dicom header index is used to avoid
+    re-reading unchanged zip files.
     """
-    zip_headers = datman.utils.get_archive_headers(zip_file)
+    zip_headers = datman.header_index.get_archive_headers(zip_file,
+                                                          config=config)
     zip_experiment_ids = get_experiment_ids(zip_headers)
     if len(set(zip_experiment_ids)) > 1:
         logger.error("Zip file contains more than one experiment: "
@@ -286,27 +290,32 @@ def restructure_zip(temp_zip, output_zip):
     Folder structure is apparently meaningful for the resources of some
     studies, but download from another XNAT server can leave the resources
     nested inside unneeded folders.
+
+    Members are copied into the new zip without being decompressed. Those
+    inside the unneeded folders are moved to the top level, and snapshots
+    and anything else in the 'resources' folder are dropped.
     """
     # Only one found so far
     bad_prefix = 'resources/MISC/'
 
-    temp_path, _ = os.path.split(temp_zip)
-    extract_dir = datman.utils.define_folder(os.path.join(temp_path,
-                                                          "extracted"))
-
     with ZipFile(temp_zip, 'r') as zip_handle:
         if not bad_folders_exist(zip_handle, bad_prefix):
             # No work to do, move downloaded zip and return
             move(temp_zip, output_zip)
             return
-        zip_handle.extractall(extract_dir)
 
-    for item in glob.glob(os.path.join(extract_dir, bad_prefix, "*")):
-        move(item, extract_dir)
+    def keep(info):
+        if info.is_dir() or is_snapshot(info.filename):
+            return False
+        return (info.filename.startswith(bad_prefix) or
+                not info.filename.startswith('resources/'))
+
+    def rename(name):
+        if name.startswith(bad_prefix):
+            return name[len(bad_prefix):]
+        return name
 
-    remove_snapshots(extract_dir)
-    remove_empty_dirs(extract_dir)
-    datman.utils.make_zip(extract_dir, output_zip)
+    datman.utils.filter_zip(temp_zip, output_zip, keep=keep, rename=rename)
 
 
 def bad_folders_exist(zip_handle, prefix):
@@ -316,22 +325,12 @@ def bad_folders_exist(zip_handle, prefix):
     return False
 
 
-def remove_snapshots(base_dir):
+def is_snapshot(name):
     """
     Snapshots arent needed for anything but get pulled down for every series
     when they exist.
     """
-    for cur_path, folders, files in os.walk(base_dir):
-        if folders and 'SNAPSHOTS' in folders:
-            shutil.rmtree(os.path.join(cur_path, 'SNAPSHOTS'))
-
-
-def remove_empty_dirs(base_dir):
-    empty_dir = os.path.join(base_dir, 'resources')
-    try:
-        shutil.rmtree(empty_dir)
-    except OSError as e:
-        logger.info("Cant delete {}. Reason: {}".format(empty_dir, e))
+    return 'SNAPSHOTS' in name.split('/')[:-1]
 
 
 def move(source, dest):
@@ -10,8 +10,11 @@ These can both be overridden at ``__init__.py``
 """
 
 import inspect
+import json
 import logging
 import os
+import re
+from stat import S_ISREG
 
 import wrapt
 import yaml
@@ -23,6 +26,99 @@ from datman.exceptions import (ConfigException, UndefinedSetting,
 
 logger = logging.getLogger(__name__)
 
+# Use the much faster libyaml parser when PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parsed yaml files shared by every config instance in this process. Maps a
+# file's full path to its (mtime, size) and contents.
+_yaml_cache = {}
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(
+        f"{type(self).__name__} is read only. Copy it before modifying it."
+    )
+
+
+class FrozenDict(dict):
+    """A dict that can't be modified.
+
+    Parsed configuration files are shared between config instances, so
+    they are handed out read only. ``copy()`` returns a normal dict.
+    """
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+    __ior__ = _read_only
+
+    def copy(self):
+        return dict(self)
+
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+
+
+class FrozenList(list):
+    """A list that can't be modified. ``copy()`` returns a normal list.
+    """
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = clear = extend = insert = pop = remove = _read_only
+    reverse = sort = _read_only
+
+    def copy(self):
+        return list(self)
+
+    def __reduce__(self):
+        return (type(self), (list(self),))
+
+
+def _freeze(value):
+    """Recursively convert parsed yaml contents to read only containers.
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, _freeze(val)) for key, val in value.items())
+    if isinstance(value, list):
+        return FrozenList(_freeze(item) for item in value)
+    return value
+
+
+def load_yaml(filename):
+    """Read a yaml file, reusing the parsed contents if it hasn't changed.
+
+    Files are parsed once per process and then only re-read if their
+    modification time or size changes.
+
+    Args:
+        filename (:obj:`str`): The full path to a yaml file.
+
+    Raises:
+        ConfigException: If the file does not exist.
+
+    Returns:
+        The file's contents. Any dictionaries and lists will be read only.
+    """
+    path = os.path.abspath(filename)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        stat = None
+    if stat is None or not S_ISREG(stat.st_mode):
+        raise ConfigException(
+            f"configuration file {filename} not found. Try again."
+        )
+
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _yaml_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with open(path, "r") as stream:
+        contents = _freeze(yaml.load(stream, Loader=YamlLoader))
+
+    _yaml_cache[path] = (key, contents)
+    return contents
+
 
 @wrapt.decorator
 def study_required(func, instance, args, kwargs):
@@ -43,6 +139,13 @@ class config(object):
     install_config = None
     study_name = None
     study_config_file = None
+    config_file = None
+    _key_cache = None
+    _key_cache_owner = None
+    _resolved = None
+    _tag_info = None
+    # Increase this whenever the layout of the saved study index changes
+    study_index_version = 1
 
     def __init__(self, filename=None, system=None, study=None):
         """
@@ -68,6 +171,9 @@ class config(object):
                 raise ConfigException("Failed to find main config file")
 
         self.system_config = self.load_yaml(filename)
+        self.config_file = os.path.abspath(filename)
+        self._study_index = None
+        self._archive_index = None
 
         if not system:
             try:
@@ -88,14 +194,7 @@ class config(object):
             self.set_study(study)
 
     def load_yaml(self, filename):
-        if not os.path.isfile(filename):
-            raise ConfigException(
-                f"configuration file {filename} not found. Try again."
-            )
-        with open(filename, "r") as stream:
-            config_yaml = yaml.load(stream, Loader=yaml.SafeLoader)
-
-        return config_yaml
+        return load_yaml(filename)
 
     def set_study(self, study_name):
         """
@@ -164,6 +263,11 @@ class config(object):
             # The exception may be because a study tag was given instead of a
             # full ID. Check for this case, exit if it's just a bad ID
             parts = filename.split("_")
+            archive_match = self.find_archive_study(filename)
+            if len(parts) > 1 and archive_match:
+                # XNAT archive names may contain underscores
+                self.set_study(archive_match[0])
+                return archive_match[0]
             if len(parts) > 1:
                 raise ConfigException("Can't determine study from malformed "
                                       f"ID: {filename}")
@@ -197,42 +301,224 @@ class config(object):
             self.set_study(tag)
             return tag
 
-        for project in projects.keys():
-            # search each project for a match to the study tag,
-            # this loop exits as soon as a match is found.
-            logger.debug(f"Searching project: {project}")
+        project = self._find_project(tag, site=site)
+        if not project:
+            logger.warning(
+                f"Failed to find a valid project for xnat id: {tag}")
+            raise ConfigException(f"Can't locate study {filename}")
 
-            self.set_study(project)
-            site_tags = []
+        self.set_study(project)
+        return project
 
-            if "Sites" not in self.study_config.keys():
-                logger.debug(f"No sites defined for {project}")
-                continue
+    def _find_project(self, tag, site=None):
+        """Use the study index to find the project for a study or site tag.
+
+        If the tag is not a study or site tag, it is checked against
+        the configured XNAT archives instead.
+
+        Args:
+            tag (:obj:`str`): A study tag, site tag or XNAT archive name.
+            site (:obj:`str`, optional): A site code to help pick between
+                projects that share a tag. Defaults to None.
+
+        Returns:
+            str: The name of the matching project, or None if not found.
+        """
+        index = self.get_study_index()
+        candidates = index["tags"].get(tag.lower(), [])
+
+        if not candidates:
+            match = self.find_archive_study(tag, site=site)
+            return match[0] if match else None
+
+        if site:
+            at_site = [project for project in candidates
+                       if site in index["sites"].get(project, {})]
+            candidates = at_site or candidates
+        project = candidates[0]
+
+        # Hack to deal with DTI not being a unique tag :(
+        if project.upper() == "DTI15T" or project.upper() == "DTI3T":
+            if site == "TGH":
+                project = "DTI15T"
+            else:
+                project = "DTI3T"
+        return project
+
+    def find_archive_study(self, archive, site=None):
+        """Find the study (and site) that an XNAT archive belongs to.
+
+        Args:
+            archive (:obj:`str`): The name of an XNAT archive (project).
+            site (:obj:`str`, optional): The site to search for. If not
+                given, the first study and site using the archive is
+                returned. Defaults to None.
 
-            for key, site_config in self.get_key("Sites").items():
+        Returns:
+            tuple: A tuple of the project name and site code, or None if
+                no configured site uses the archive.
+        """
+        self.get_study_index()
+        matches = self._archive_index.get(archive.lower(), {})
+        if site:
+            return matches.get(site)
+        return next(iter(matches.values()), None)
+
+    def get_study_index(self):
+        """Get the index of every study's tags, sites and XNAT archives.
+
+        The index is built once per config instance. It is also saved next
+        to the main config file so that other processes can reuse it, until
+        the main config file or any study config file is modified.
+
+        Returns:
+            :obj:`dict`: A dictionary where 'tags' maps each (lower case)
+                study or site tag to the projects that use it, in the order
+                the projects are defined, and 'sites' maps each project to
+                a dictionary of its sites and their 'XnatArchive' (or None
+                if undefined).
+        """
+        if self._study_index is not None:
+            return self._study_index
+
+        index = self._read_study_index()
+        if index is None:
+            index = self._build_study_index()
+            self._write_study_index(index)
+
+        archive_index = {}
+        for project, sites in index["sites"].items():
+            for site, archive in sites.items():
+                if not archive:
+                    continue
+                archive_index.setdefault(archive.lower(), {}).setdefault(
+                    site, (project, site))
+
+        self._study_index = index
+        self._archive_index = archive_index
+        return index
+
+    def _get_study_index_path(self):
+        config_dir, fname = os.path.split(self.config_file)
+        return os.path.join(
+            config_dir, f".{fname}.{self.system}.study_index.json")
+
+    def _get_study_files(self):
+        """Get the full path to every study's config file.
+        """
+        config_dir = self.get_key("ConfigDir", defaults_only=True)
+        projects = self.get_key("Projects", defaults_only=True)
+        return {
+            project: os.path.abspath(os.path.join(config_dir, study_yaml))
+            for project, study_yaml in projects.items()
+        }
+
+    def _read_study_index(self):
+        """Read the saved study index, if it exists and is up to date.
+
+        Returns:
+            :obj:`dict`: The study index or None if it must be rebuilt.
+        """
+        try:
+            with open(self._get_study_index_path(), "r") as fh:
+                index = json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+        if (index.get("version") != self.study_index_version or
+                index.get("system") != self.system):
+            return None
+
+        expected = set(self._get_study_files().values())
+        expected.add(self.config_file)
+        mtimes = index.get("mtimes", {})
+        if set(mtimes) != expected:
+            return None
+
+        for path, mtime in mtimes.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return None
+            except OSError:
+                if mtime is not None:
+                    return None
+        return index
+
+    def _write_study_index(self, index):
+        """Save the study index next to the main config file.
+
+        Failing to save (e.g. because the config folder is read only) is
+        not an error, the index will just be rebuilt next time.
+        """
+        dest = self._get_study_index_path()
+        tmp_dest = f"{dest}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_dest, "w") as fh:
+                json.dump(index, fh)
+            os.replace(tmp_dest, dest)
+        except OSError as e:
+            logger.debug(f"Can't save study index {dest} - {e}")
+            try:
+                os.remove(tmp_dest)
+            except OSError:
+                pass
+
+    def _build_study_index(self):
+        """Read every study's config file to build the study index.
+        """
+        index = {
+            "version": self.study_index_version,
+            "system": self.system,
+            "mtimes": {self.config_file: os.stat(self.config_file).st_mtime},
+            "tags": {},
+            "sites": {}
+        }
+
+        current = (self.study_name, self.study_config,
+                   getattr(self, "study_config_path", None))
+        try:
+            for project, study_file in self._get_study_files().items():
                 try:
-                    add_tags = [t.lower() for t in site_config["SiteTags"]]
-                except KeyError:
-                    add_tags = []
-                site_tags.extend(add_tags)
-
-            site_tags.append(self.study_config["StudyTag"].lower())
-
-            if tag.lower() in site_tags:
-                # Hack to deal with DTI not being a unique tag :(
-                if project.upper() == "DTI15T" or project.upper() == "DTI3T":
-                    if parts.site == "TGH":
-                        project = "DTI15T"
-                    else:
-                        project = "DTI3T"
-                # Needs to be set here in addition to at the top of the loop in
-                # case the wrong DTI study settings were encountered
-                # for the last set_study call. Ugh.
-                self.set_study(project)
-                return project
-        # didn't find a match throw a warning
-        logger.warning(f"Failed to find a valid project for xnat id: {tag}")
-        raise ConfigException(f"Can't locate study {filename}")
+                    index["mtimes"][study_file] = os.stat(
+                        study_file).st_mtime
+                    self.study_config = self.load_yaml(study_file)
+                except (OSError, ConfigException) as e:
+                    logger.debug(f"Can't read config for {project} - {e}")
+                    index["mtimes"][study_file] = None
+                    continue
+                self.study_name = project
+                self._index_study(index, project)
+        finally:
+            (self.study_name, self.study_config,
+             self.study_config_path) = current
+        return index
+
+    def _index_study(self, index, project):
+        """Add the currently set study's tags and sites to the index.
+        """
+        if not self.study_config or "Sites" not in self.study_config:
+            logger.debug(f"No sites defined for {project}")
+            return
+
+        tags = []
+        if self.study_config.get("StudyTag"):
+            tags.append(self.study_config["StudyTag"])
+
+        sites = {}
+        for site, site_config in self.study_config["Sites"].items():
+            site_tags = (site_config or {}).get("SiteTags", [])
+            if isinstance(site_tags, str):
+                site_tags = [site_tags]
+            tags.extend(site_tags)
+
+            try:
+                sites[site] = self.get_key("XnatArchive", site=site)
+            except (UndefinedSetting, ConfigException):
+                sites[site] = None
+
+        for tag in dict.fromkeys(tag.lower() for tag in tags):
+            index["tags"].setdefault(tag, []).append(project)
+        index["sites"][project] = sites
 
     def _search_site_conf(self, site, key):
         """
@@ -368,9 +654,89 @@ class config(object):
         If 'ignore_defaults' is set the search is restricted to only site (if
         site was given) or only the current study (if site was not).
 
+        Results are cached until the study changes, so any dictionaries or
+        lists returned are read only. Copy them before modifying them.
+
         Raises UndefinedSetting if no value is found
         """
+        cache = self._get_key_cache()
+        cache_key = (key, site, ignore_defaults, defaults_only)
+        try:
+            value, error = cache[cache_key]
+        except KeyError:
+            try:
+                value = _freeze(self._find_key(
+                    key, site, ignore_defaults, defaults_only))
+                error = None
+            except (ConfigException, UndefinedSetting) as e:
+                value = None
+                error = (type(e), e.args)
+            cache[cache_key] = (value, error)
+
+        if error:
+            raise error[0](*error[1])
+        return value
+
+    def _get_key_cache(self):
+        """Get the cache of get_key results for the current study.
+
+        The cache is emptied whenever the study config changes, which
+        happens when set_study switches to a different study (or the study's
+        config file is modified).
+        """
+        if (self._key_cache is None or
+                self._key_cache_owner is not self.study_config):
+            self._key_cache_owner = self.study_config
+            self._key_cache = {}
+            self._resolved = {}
+            self._tag_info = {}
+        return self._key_cache
+
+    def resolve_all(self, site=None):
+        """Get the effective value of every setting for a site or study.
+
+        This is useful in loops that read many settings, since the result
+        is a plain dictionary lookup instead of a search through every
+        config file.
+
+        Args:
+            site (:obj:`str`, optional): The site to resolve settings for. If
+                not given, only study and system settings are used.
+
+        Returns:
+            :obj:`dict`: A dictionary of every defined setting name mapped
+                to the value get_key would return for it.
+        """
+        self._get_key_cache()
+        if site in self._resolved:
+            return self._resolved[site]
+
+        keys = dict.fromkeys(self.system_config or {})
+        keys.update(dict.fromkeys(self.install_config or {}))
+        keys.update(dict.fromkeys(self.study_config or {}))
+        if site:
+            try:
+                site_config = self._search_study_conf("Sites")[site]
+            except (ConfigException, UndefinedSetting, KeyError, TypeError):
+                site_config = {}
+            keys.update(dict.fromkeys(site_config or {}))
+
+        settings = {}
+        for key in keys:
+            try:
+                settings[key] = self.get_key(key, site=site)
+            except (ConfigException, UndefinedSetting):
+                continue
+
+        settings = FrozenDict(settings)
+        self._resolved[site] = settings
+        return settings
+
+    def _find_key(self, key, site, ignore_defaults, defaults_only):
+        """Search each level of the configuration for a key.
 
+        See get_key for details.
+        """
         value = None
         if site and not defaults_only:
             value = self._get_setting(
@@ -424,6 +790,10 @@ class config(object):
         'ExportSettings' (system config) the values in 'ExportInfo' will
         override the values in 'ExportSettings'.
         """
+        self._get_key_cache()
+        if site in self._tag_info:
+            return self._tag_info[site]
+
         if site:
             export_info = self.get_key("ExportInfo", site=site)
         else:
@@ -437,10 +807,22 @@ class config(object):
                 "defined in main configuration file."
             )
 
-        return TagInfo(export_settings, export_info)
+        # Cached so the compiled tag patterns are reused until the study
+        # changes
+        self._tag_info[site] = TagInfo(export_settings, export_info)
+        return self._tag_info[site]
 
     @study_required
     def get_xnat_projects(self, study=None):
+        sites = self.get_study_index()["sites"].get(self.study_name)
+        if sites is not None:
+            for site, archive in sites.items():
+                if not archive:
+                    logger.info(
+                        f"'XnatArchive' undefined for site {site}. Ignoring."
+                    )
+            return list({archive for archive in sites.values() if archive})
+
         xnat_projects = set()
         for site in self.get_sites():
             try:
@@ -505,6 +887,9 @@ class config(object):
 
 
 class TagInfo(object):
+    _series_map = None
+    _matcher = None
+
     def __init__(self, export_settings, site_settings=None):
         if not site_settings:
             self.tags = export_settings
@@ -534,6 +919,19 @@ class TagInfo(object):
         Maps the 'pattern' fields onto the expected tags. If multiple patterns
         exist, they're joined with '|'.
         """
+        if self._series_map is None:
+            self._series_map = self._make_series_map()
+        return self._series_map
+
+    @property
+    def matcher(self):
+        """A :obj:`TagMatcher` for this site's tag patterns.
+        """
+        if self._matcher is None:
+            self._matcher = TagMatcher(self.series_map)
+        return self._matcher
+
+    def _make_series_map(self):
         series_map = {}
         for tag in self:
             try:
@@ -571,3 +969,121 @@ class TagInfo(object):
 
     def __repr__(self):
         return str(self.tags)
+
+
+# Matches unescaped numbered back references, named back references and
+# conditional groups within a regex
+GROUP_REFERENCE = re.compile(r"(?<!\\)(?:\\\\)*\\[1-9]|\(\?P=|\(\?\(")
+
+
+class TagMatcher(object):
+    """Finds the tags whose export patterns match a scan.
+
+    All patterns are compiled once, so a single matcher can be reused for
+    every scan (and every experiment) from the same site. The
+    'SeriesDescription' and 'XnatType' patterns are each combined into a
+    single regex with one named group per tag, so all matching tags are
+    found with one search.
+
+    Args:
+        series_map (:obj:`dict`): A dictionary mapping each tag to its
+            'Pattern' settings (e.g. from :obj:`TagInfo.series_map`)
+
+    Raises:
+        KeyError: If a tag's pattern has neither a 'SeriesDescription' nor
+            an 'XnatType'.
+    """
+
+    fields = ("SeriesDescription", "XnatType")
+
+    def __init__(self, series_map):
+        self.patterns = series_map
+        field_patterns = {field: {} for field in self.fields}
+        for tag, pattern in series_map.items():
+            field = next((f for f in self.fields if f in pattern), None)
+            if not field:
+                raise KeyError(
+                    "Missing keys 'SeriesDescription' or 'XnatType'"
+                    " for Pattern!")
+            field_patterns[field][tag] = self._join(pattern[field])
+
+        self._matchers = {
+            field: self._compile(tag_patterns)
+            for field, tag_patterns in field_patterns.items() if tag_patterns
+        }
+        self._image_types = {}
+
+    def _join(self, regex):
+        if isinstance(regex, list):
+            return "|".join(regex)
+        return regex
+
+    def _compile(self, tag_patterns):
+        """Compile a set of tag patterns into a single regex.
+
+        Each tag's pattern is placed in an optional lookahead that searches
+        the whole string, so the named group for every matching tag is set.
+        Patterns that refer to their own groups (back references or
+        conditionals) are compiled separately, because every group in the
+        combined regex is numbered and those references would point at
+        another tag's group. If the rest can't be combined either, they're
+        all compiled separately.
+
+        Returns:
+            tuple: The combined regex (or None), a dict mapping its group
+                names to tags, and a dict mapping the remaining tags to
+                their own compiled regexes.
+        """
+        separate = {tag: regex for tag, regex in tag_patterns.items()
+                    if GROUP_REFERENCE.search(regex)}
+        groups = {f"tag{num}": tag for num, tag in enumerate(tag_patterns)
+                  if tag not in separate}
+        combined = "".join(
+            rf"(?:(?=[\s\S]*?(?P<{group}>{tag_patterns[tag]}))|)"
+            for group, tag in groups.items()
+        )
+        try:
+            combined = re.compile(combined, re.IGNORECASE) if groups \
+                else None
+        except re.error:
+            combined, groups, separate = None, {}, tag_patterns
+        return combined, groups, {
+            tag: re.compile(regex, re.IGNORECASE)
+            for tag, regex in separate.items()
+        }
+
+    def search(self, description=None, xnat_type=None):
+        """Find every tag that matches a scan.
+
+        Args:
+            description (:obj:`str`, optional): The scan's series
+                description.
+            xnat_type (:obj:`str`, optional): The scan's XNAT type.
+
+        Returns:
+            list: The matching tags, in the order they're configured.
+        """
+        targets = {"SeriesDescription": description, "XnatType": xnat_type}
+        found = set()
+        for field, (regex, groups, separate) in self._matchers.items():
+            target = targets[field]
+            found.update(tag for tag, tag_regex in separate.items()
+                         if tag_regex.search(target))
+            if regex is None:
+                continue
+            match = regex.match(target)
+            found.update(groups[group]
+                         for group, value in match.groupdict().items()
+                         if value is not None)
+        return [tag for tag in self.patterns if tag in found]
+
+    def image_type_matches(self, tag, image_type):
+        """Check if a scan's image type matches a tag's 'ImageType' pattern.
+
+        Raises:
+            KeyError: If the tag has no 'ImageType' pattern.
+        """
+        if tag not in self._image_types:
+            self._image_types[tag] = re.compile(
+                self.patterns[tag]["ImageType"])
+        return self._image_types[tag].search(image_type) is not None
@@ -11,12 +11,15 @@ unique key that can be referenced in config files (e.g. 'nii').
 """
 from abc import ABC, abstractmethod
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from glob import glob
 from json import JSONDecodeError
+import gzip
 import logging
 import os
 import re
+import shutil
 
 import pydicom as dicom
 
@@ -28,8 +31,10 @@ from datman.exceptions import (UndefinedSetting, DashboardException,
 from datman.scanid import (parse_bids_filename, ParseException,
                            make_filename, KCNIIdentifier)
 from datman.utils import (run, make_temp_directory, get_extension,
-                          filter_niftis, find_tech_notes, read_blacklist,
-                          get_relative_source, read_json, write_json)
+                          filter_niftis, find_tech_notes, get_metadata_store,
+                          get_relative_source, read_json, write_json,
+                          get_allocated_cores, materialize_file, is_dicom,
+                          has_dicom_magic, read_dicom_header)
 
 try:
     from dcm2bids import dcm2bids, Dcm2bids
@@ -69,6 +74,36 @@ def get_exporter(key, scope="series"):
     return exporter
 
 
+def get_nii_compression(config, site=None, tag_settings=None):
+    """Find the nifti compression settings for a series.
+
+    The 'NiiCompression' setting is searched for with the usual config
+    hierarchy (site, study, then system settings) and any value set in the
+    series' tag settings (from ExportSettings / ExportInfo) takes priority.
+
+    Args:
+        config (:obj:`datman.config.config`): A datman config object for
+            the study the series belongs to.
+        site (:obj:`str`, optional): The site the series was collected at.
+        tag_settings (:obj:`dict`, optional): The configuration for the
+            series' tag.
+
+    Returns:
+        dict: The compression settings to use. An empty dictionary means
+            the defaults should be used.
+    """
+    try:
+        compression = config.get_key("NiiCompression", site=site)
+    except UndefinedSetting:
+        compression = {}
+
+    if tag_settings and "NiiCompression" in tag_settings:
+        compression = dict(compression or {})
+        compression.update(tag_settings["NiiCompression"])
+
+    return compression or {}
+
+
 class Exporter(ABC):
     """An abstract base class for all Exporters.
     """
@@ -157,11 +192,38 @@ class SeriesExporter(Exporter):
     ext = None
 
     def __init__(self, output_dir, fname_root, echo_dict=None, dry_run=False,
-                 **kwargs):
+                 transfer_methods=None, **kwargs):
         self.output_dir = output_dir
         self.fname_root = fname_root
         self.echo_dict = echo_dict
         self.dry_run = dry_run
+        self.transfer_methods = transfer_methods
+
+    def transfer_file(self, source, dest, move=False):
+        """Place a file in the output directory, without copying if possible.
+
+        Args:
+            source (:obj:`str`): The full path to the file to transfer.
+            dest (:obj:`str`): The full path to the output file.
+            move (bool, optional): Whether the source file may be consumed.
+                Defaults to False.
+
+        Returns:
+            bool: True if the file was transferred, False otherwise.
+        """
+        if self.dry_run:
+            logger.info(f"Dry run: Skipping transfer of {source} to {dest}")
+            return True
+
+        try:
+            method = materialize_file(
+                source, dest, move=move, methods=self.transfer_methods)
+        except OSError as exc:
+            logger.debug(f"Failed to transfer {source} to {dest}. "
+                         f"Reason - {exc}")
+            return False
+        logger.debug(f"Transferred {source} to {dest} with '{method}'")
+        return True
 
     def outputs_exist(self):
         return os.path.exists(
@@ -971,19 +1033,31 @@ class NiiLinkExporter(SessionExporter):
         return os.path.join(self.output_dir, dm_file + ".err")
 
     def outputs_exist(self):
+        return not self.find_pending()
+
+    def find_pending(self):
+        """Find the datman names that still need a link or an error file.
+
+        Returns:
+            :obj:`list`: A list of datman style names (minus extension) that
+                have neither a link in the nii folder nor an error file
+                reporting why one couldn't be made.
+        """
+        metadata = get_metadata_store(config=self.config)
+        pending = []
         for dm_name in self.name_map:
-            if read_blacklist(scan=dm_name, config=self.config):
+            if metadata.is_blacklisted(dm_name):
                 continue
 
             if self.name_map[dm_name] == "missing":
                 if not os.path.exists(self.get_error_file(dm_name)):
-                    return False
+                    pending.append(dm_name)
                 continue
 
             full_path = os.path.join(self.output_dir, dm_name + self.ext)
             if not os.path.exists(full_path):
-                return False
-        return True
+                pending.append(dm_name)
+        return pending
 
     def needs_raw_data(self):
         return False
@@ -1050,7 +1124,7 @@ class NiiLinkExporter(SessionExporter):
                 extension.)
         """
         base_target = os.path.join(self.output_dir, dm_file)
-        if read_blacklist(scan=base_target, config=self.config):
+        if get_metadata_store(config=self.config).is_blacklisted(base_target):
             logger.debug(f"Ignoring blacklisted scan {dm_file}")
             return
 
@@ -1446,12 +1520,86 @@ class DBExporter(SessionExporter):
 
 class NiiExporter(SeriesExporter):
     """Export a series to nifti format with datman-style names.
+
+    How the nifti files are compressed can be changed with the
+    'NiiCompression' setting (see :py:func:`get_nii_compression`).
     """
 
     ext = ".nii.gz"
 
     type = "nii"
 
+    # Maps each compression method to dcm2niix's '-z' option. 'pigz' lets
+    # dcm2niix use an external pigz (if it's on the path), 'internal'
+    # forces dcm2niix's own single-threaded zlib and 'post' writes
+    # uncompressed files that are then compressed by datman in parallel.
+    # dcm2niix always runs pigz with every core, so 'pigz' with a 'Threads'
+    # limit is handled like 'post' (see post_compress).
+    compression_methods = {"pigz": "y", "internal": "i", "post": "n"}
+
+    def __init__(self, output_dir, fname_root, compression=None, **kwargs):
+        super().__init__(output_dir, fname_root, **kwargs)
+        self.compression = self._check_compression(compression or {})
+
+    def _check_compression(self, compression):
+        """Validate the 'NiiCompression' settings for this series.
+
+        Args:
+            compression (:obj:`dict`): The compression settings. May contain
+                the keys 'Method', 'Level' and 'Threads'.
+
+        Returns:
+            dict: The settings, with any invalid values removed.
+        """
+        settings = dict(compression)
+        method = settings.get("Method", "pigz")
+        if method not in self.compression_methods:
+            logger.error(f"Unrecognized NiiCompression method '{method}' "
+                         f"for {self.fname_root}. Using 'pigz' instead.")
+            method = "pigz"
+        settings["Method"] = method
+
+        for key, limits in [("Level", (1, 9)), ("Threads", (1, None))]:
+            if key not in settings:
+                continue
+            try:
+                value = int(settings[key])
+            except (TypeError, ValueError):
+                value = None
+            if (value is None or value < limits[0] or
+                    (limits[1] and value > limits[1])):
+                logger.error(f"Invalid NiiCompression {key} "
+                             f"'{settings[key]}' for {self.fname_root}. "
+                             "Ignoring.")
+                del settings[key]
+                continue
+            settings[key] = value
+        return settings
+
+    @property
+    def post_compress(self):
+        """Whether datman (rather than dcm2niix) compresses the outputs.
+        """
+        method = self.compression["Method"]
+        return method == "post" or (
+            method == "pigz" and "Threads" in self.compression)
+
+    def get_niix_cmd(self, output_dir, raw_data_dir):
+        """Construct the dcm2niix command for the configured compression.
+
+        Args:
+            output_dir (:obj:`str`): The directory dcm2niix will write to.
+            raw_data_dir (:obj:`str`): The directory holding the raw dicoms.
+
+        Returns:
+            str: The dcm2niix command to run.
+        """
+        method = "post" if self.post_compress else self.compression["Method"]
+        cmd = f"dcm2niix -z {self.compression_methods[method]}"
+        if method != "post" and "Level" in self.compression:
+            cmd += f" -{self.compression['Level']}"
+        return cmd + f" -b y -o {output_dir} {raw_data_dir}"
+
     def export(self, raw_data_dir, **kwargs):
         if self.dry_run:
             logger.info(f"Dry run: Skipping export of {self.fname_root}")
@@ -1464,13 +1612,54 @@ class NiiExporter(SeriesExporter):
         self.make_output_dir()
 
         with make_temp_directory(prefix="export_nifti_") as tmp:
-            _, log_msgs = run(f'dcm2niix -z y -b y -o {tmp} {raw_data_dir}',
+            _, log_msgs = run(self.get_niix_cmd(tmp, raw_data_dir),
                               self.dry_run)
+            if self.post_compress:
+                self.compress_niftis(glob(f"{tmp}/*.nii"))
             for tmp_file in glob(f"{tmp}/*"):
                 self.move_file(tmp_file)
                 stem = self._get_fname(tmp_file)
                 self.report_issues(stem, str(log_msgs))
 
+    def compress_niftis(self, niftis):
+        """Gzip uncompressed dcm2niix outputs in place.
+
+        pigz is used if it's installed, otherwise the files are compressed
+        in parallel threads (zlib releases the GIL while compressing).
+
+        Args:
+            niftis (:obj:`list`): A list of full paths to '.nii' files.
+        """
+        if not niftis:
+            return
+
+        threads = self.compression.get("Threads", get_allocated_cores())
+        level = self.compression.get("Level", 6)
+
+        if shutil.which("pigz"):
+            return_code, _ = run(
+                f"pigz -p {threads} -{level} " + " ".join(niftis),
+                self.dry_run
+            )
+            if not return_code:
+                return
+            logger.debug("pigz failed, falling back to python's gzip.")
+
+        def _gzip(path):
+            with open(path, "rb") as src, gzip.open(
+                    path + ".gz", "wb", compresslevel=level) as dest:
+                shutil.copyfileobj(src, dest, 1024 * 1024)
+            os.remove(path)
+
+        remaining = [item for item in niftis if os.path.exists(item)]
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            futures = {pool.submit(_gzip, path): path for path in remaining}
+
+        for future, path in futures.items():
+            if future.exception():
+                logger.error(f"Failed to compress {path}. Reason - "
+                             f"{future.exception()}")
+
     def move_file(self, gen_file):
         """Move the temp outputs of dcm2niix to the intended output directory.
 
@@ -1488,8 +1677,7 @@ class NiiExporter(SeriesExporter):
             logger.info(f"Output {out_file} already exists. Skipping.")
             return
 
-        return_code, _ = run(f"mv {gen_file} {out_file}", self.dry_run)
-        if return_code:
+        if not self.transfer_file(gen_file, out_file, move=True):
             logger.debug(f"Moving dcm2niix output {gen_file} to {out_file} "
                          "has failed.")
 
@@ -1599,7 +1787,7 @@ class DcmExporter(SeriesExporter):
         logger.debug(f"Exporting a dcm file from {raw_data_dir} to "
                      f"{self.output_dir}")
         output = os.path.join(self.output_dir, self.fname_root + self.ext)
-        run(f"cp {dcm_file} {output}", self.dry_run)
+        self.transfer_file(dcm_file, output)
 
     def _find_dcm(self, raw_data_dir):
         """Find the path to a valid dicom in the given directory.
@@ -1612,11 +1800,7 @@ class DcmExporter(SeriesExporter):
             str: the full path to the first readable dicom found.
         """
         for path in glob(f"{raw_data_dir}/*"):
-            try:
-                dicom.read_file(path)
-            except dicom.filereader.InvalidDicomError:
-                pass
-            else:
+            if is_dicom(path):
                 return path
         return ""
 
@@ -1629,8 +1813,11 @@ class DcmExporter(SeriesExporter):
         """
         dcm_dict = {}
         for path in glob(f"{raw_data_dir}/*"):
+            if not has_dicom_magic(path):
+                continue
             try:
-                dcm_file = dicom.read_file(path)
+                dcm_file = read_dicom_header(
+                    path, specific_tags=["EchoNumbers"])
             except dicom.filereader.InvalidDicomError:
                 continue
             dcm_echo_num = dcm_file.EchoNumbers
@@ -1645,8 +1832,7 @@ class DcmExporter(SeriesExporter):
                                        self.echo_dict[echo_num] + self.ext)
             logger.debug(f"Exporting a dcm file from {raw_data_dir} to "
                          f"{output_file}")
-            cmd = f"cp {dcm_dict[dcm_echo_num]} {output_file}"
-            run(cmd, self.dry_run)
+            self.transfer_file(dcm_dict[dcm_echo_num], output_file)
 
 
 SESSION_EXPORTERS = {
@@ -0,0 +1,334 @@
+"""A persistent index of the dicom headers found in scan archives.
+
+Reading headers from a large zip or tar archive means reading most of the
+archive, and the same unchanged archives get read again by dm_link,
+dm_xnat_upload, xnat_fetch_sessions and others every time they run. A
+HeaderIndex stores the headers found in each archive in an sqlite database,
+keyed by the archive's path, size and modification time, so that they're
+only read again when the archive changes.
+
+By default, each study's index is kept in its 'meta' folder. Use
+dm_header_index.py to build the index ahead of time or to prune entries for
+archives that have been removed.
+
+Example:
+
+headers = datman.header_index.get_archive_headers(zip_path, config=config)
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+
+import pydicom
+
+import datman.config
+import datman.utils
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "dicom_headers.sqlite"
+# Increase this if the stored format changes, to discard old entries.
+INDEX_VERSION = 2
+ARCHIVE_EXTENSIONS = (".zip", ".tar.gz")
+
+
+class HeaderIndex:
+    """An on-disk cache of datman.utils.get_archive_headers() results.
+
+    Only zip and tar archives are indexed. Folders are always read directly,
+    because their modification time doesn't change when files inside their
+    subfolders do.
+
+    Headers are stored in the DICOM JSON format rather than as pickled
+    python objects, so that reading an index can't run code and entries
+    don't depend on pydicom's internals. Headers returned by the index are
+    plain datasets (with their file_meta, if any) and don't include pixel
+    data.
+
+    Args:
+        db_path (:obj:`str`): The full path to the sqlite database. It will be
+            created if it doesn't exist.
+        timeout (:obj:`float`, optional): How long to wait (in seconds) if
+            another job is writing to the index. Default 60.
+    """
+    def __init__(self, db_path, timeout=60):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def _connect(self):
+        # Connections can't be shared with forked processes
+        if self._conn is not None and self._pid == os.getpid():
+            return self._conn
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout,
+                               check_same_thread=False)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        with conn:
+            if version != INDEX_VERSION:
+                conn.execute("DROP TABLE IF EXISTS headers")
+                conn.execute("DROP TABLE IF EXISTS archives")
+                conn.execute(f"PRAGMA user_version = {INDEX_VERSION}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS archives ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "mtime_ns INTEGER NOT NULL, complete INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS headers ("
+                "path TEXT NOT NULL, position INTEGER NOT NULL, "
+                "member TEXT NOT NULL, header BLOB NOT NULL, "
+                "PRIMARY KEY (path, position))"
+            )
+        self._conn = conn
+        self._pid = os.getpid()
+        return conn
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+
+    def get_archive_headers(self, path, stop_after_first=False):
+        """Get dicom headers from a scan archive, using the index if possible.
+
+        Args:
+            path (:obj:`str`): The path to a zip file, tarball or folder.
+            stop_after_first (bool, optional): Whether to return only the
+                headers for the first series found. Default False.
+
+        Returns:
+            dict: A dictionary of paths within the archive mapped to the
+                dicom headers found there, the same as
+                datman.utils.get_archive_headers().
+        """
+        if not is_indexable(path):
+            return datman.utils.get_archive_headers(path, stop_after_first)
+
+        real_path = os.path.realpath(path)
+        archive_stat = os.stat(real_path)
+        try:
+            headers = self._lookup(real_path, archive_stat, stop_after_first)
+        except sqlite3.Error as e:
+            logger.warning(f"Can't read header index {self.db_path} - {e}")
+            return datman.utils.get_archive_headers(path, stop_after_first)
+
+        if headers is not None:
+            return headers
+
+        headers = datman.utils.get_archive_headers(path, stop_after_first)
+        try:
+            self._store(real_path, archive_stat, headers,
+                        complete=not stop_after_first)
+        except sqlite3.Error as e:
+            logger.warning(f"Can't update header index {self.db_path} - {e}")
+        return headers
+
+    def is_current(self, path):
+        """Check whether all headers for an archive are already indexed.
+        """
+        real_path = os.path.realpath(path)
+        archive_stat = os.stat(real_path)
+        with self._lock:
+            row = self._get_row(self._connect(), real_path)
+        return _row_matches(row, archive_stat, stop_after_first=False)
+
+    def update(self, path):
+        """Index an archive if it's not already in the index.
+
+        Args:
+            path (:obj:`str`): The path to a zip file or tarball.
+
+        Returns:
+            bool: True if the archive was read, False if the index was
+                already up to date.
+        """
+        if self.is_current(path):
+            return False
+        self.get_archive_headers(path)
+        return True
+
+    def prune(self):
+        """Remove entries for archives that are missing or have changed.
+
+        Returns:
+            int: The number of entries removed.
+        """
+        with self._lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT path, size, mtime_ns, complete FROM archives"
+            ).fetchall()
+            stale = []
+            for path, *row in rows:
+                try:
+                    archive_stat = os.stat(path)
+                except OSError:
+                    stale.append(path)
+                    continue
+                if not _row_matches(row, archive_stat, stop_after_first=True):
+                    stale.append(path)
+
+            with conn:
+                conn.executemany("DELETE FROM headers WHERE path = ?",
+                                 [(path,) for path in stale])
+                conn.executemany("DELETE FROM archives WHERE path = ?",
+                                 [(path,) for path in stale])
+            if stale:
+                conn.execute("VACUUM")
+        return len(stale)
+
+    def _get_row(self, conn, path):
+        return conn.execute(
+            "SELECT size, mtime_ns, complete FROM archives WHERE path = ?",
+            (path,)
+        ).fetchone()
+
+    def _lookup(self, path, archive_stat, stop_after_first):
+        with self._lock:
+            conn = self._connect()
+            row = self._get_row(conn, path)
+            if not _row_matches(row, archive_stat, stop_after_first):
+                return None
+            query = ("SELECT member, header FROM headers WHERE path = ? "
+                     "ORDER BY position")
+            if stop_after_first:
+                query += " LIMIT 1"
+            rows = conn.execute(query, (path,)).fetchall()
+
+        headers = {}
+        for member, blob in rows:
+            try:
+                headers[member] = _load_dataset(blob)
+            except Exception as e:
+                logger.debug(f"Can't load indexed headers for {path} - {e}")
+                return None
+        return headers
+
+    def _store(self, path, archive_stat, headers, complete=True):
+        rows = []
+        for position, (member, dataset) in enumerate(headers.items()):
+            try:
+                blob = _dump_dataset(dataset)
+            except Exception as e:
+                logger.debug(f"Can't index headers for {path} - {e}")
+                return
+            rows.append((path, position, member, blob))
+
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("DELETE FROM headers WHERE path = ?", (path,))
+                conn.execute(
+                    "INSERT OR REPLACE INTO archives "
+                    "(path, size, mtime_ns, complete) VALUES (?, ?, ?, ?)",
+                    (path, archive_stat.st_size, archive_stat.st_mtime_ns,
+                     int(complete))
+                )
+                conn.executemany(
+                    "INSERT INTO headers (path, position, member, header) "
+                    "VALUES (?, ?, ?, ?)", rows
+                )
+
+
+def _row_matches(row, archive_stat, stop_after_first):
+    if row is None:
+        return False
+    size, mtime_ns, complete = row
+    if (size, mtime_ns) != (archive_stat.st_size, archive_stat.st_mtime_ns):
+        return False
+    return bool(complete) or stop_after_first
+
+
+def _dump_dataset(dataset):
+    """Serialize a dataset (without pixel data) for storage in the index.
+    """
+    contents = {
+        "dataset": dataset.to_json_dict(),
+        "file_meta": None
+    }
+    contents["dataset"].pop("7FE00010", None)
+    file_meta = getattr(dataset, "file_meta", None)
+    if file_meta is not None:
+        contents["file_meta"] = file_meta.to_json_dict()
+    return zlib.compress(json.dumps(contents).encode("utf-8"))
+
+
+def _load_dataset(blob):
+    """Rebuild a dataset stored by _dump_dataset.
+    """
+    contents = json.loads(zlib.decompress(blob).decode("utf-8"))
+    dataset = pydicom.Dataset.from_json(contents["dataset"])
+    if contents["file_meta"] is not None:
+        dataset.file_meta = pydicom.dataset.FileMetaDataset(
+            pydicom.Dataset.from_json(contents["file_meta"]))
+    return dataset
+
+
+def is_indexable(path):
+    """Check whether a path is an archive that can be indexed.
+    """
+    return path.endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+_indexes = {}
+
+
+def get_header_index(config=None, path=None):
+    """Get the header index for a study, shared by everything in a process.
+
+    Args:
+        config (:obj:`datman.config.config`, optional): A config object with
+            the study set. The index will be kept in the study's 'meta'
+            folder.
+        path (:obj:`str`, optional): The full path to an index database to
+            use instead.
+
+    Returns:
+        :obj:`HeaderIndex`: The header index, or None if no location for
+            it could be found.
+    """
+    if not path:
+        if config is None:
+            return None
+        try:
+            path = os.path.join(config.get_path("meta"), INDEX_NAME)
+        except datman.config.UndefinedSetting:
+            return None
+    try:
+        return _indexes[path]
+    except KeyError:
+        pass
+    index = HeaderIndex(path)
+    _indexes[path] = index
+    return index
+
+
+def get_archive_headers(path, stop_after_first=False, config=None,
+                        index=None):
+    """Get dicom headers from a scan archive, using a header index if found.
+
+    Args:
+        path (:obj:`str`): The path to a zip file, tarball or folder.
+        stop_after_first (bool, optional): Whether to return only the
+            headers for the first series found. Default False.
+        config (:obj:`datman.config.config`, optional): A config object for
+            the study the archive belongs to. Used to locate the study's
+            header index.
+        index (:obj:`HeaderIndex`, optional): A header index to use. If
+            neither this nor config are given, the archive is read directly.
+
+    Returns:
+        dict: A dictionary of paths within the archive mapped to the dicom
+            headers found there, the same as datman.utils.get_archive_headers.
+    """
+    if index is None:
+        index = get_header_index(config=config)
+    if index is None:
+        return datman.utils.get_archive_headers(path, stop_after_first)
+    return index.get_archive_headers(path, stop_after_first)
@@ -0,0 +1,226 @@
+"""Index the contents of a study's session folders in a single pass.
+
+Scripts that work on every session in a study would otherwise have each
+datman.scan.Scan glob and walk its own folders, which is very slow on
+network file systems. A StudyInventory lists each configured folder once,
+using a pool of threads, and can then seed Scan objects so that they don't
+need to read the file system themselves.
+
+Example:
+
+inventory = datman.inventory.StudyInventory(config)
+for subject_id in inventory.subject_ids("nii"):
+    session = inventory.get_scan(subject_id)
+    ...
+"""
+import bisect
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import datman.config
+import datman.scan
+
+logger = logging.getLogger(__name__)
+
+SESSION_FOLDERS = ["nii", "dcm", "qc", "resources", "bids"]
+
+
+class StudyInventory:
+    """A snapshot of the files in a study's session folders.
+
+    Args:
+        config (:obj:`datman.config.config`): A config object for the study.
+        folders (:obj:`list`, optional): The path types to index. Defaults
+            to nii, dcm, qc, resources and bids. Path types that aren't
+            configured for the study are skipped.
+        bids_root (:obj:`str`, optional): The bids folder to index. If not
+            given, the configured 'bids' path is used.
+        max_workers (:obj:`int`, optional): The number of threads to read
+            folders with. Default 8.
+
+    The contents are read once, when the inventory is created. Build a new
+    inventory (or call refresh() on seeded Scans) if the folders may have
+    changed since then.
+    """
+    def __init__(self, config, folders=None, bids_root=None, max_workers=8):
+        self.config = config
+        self.roots = self._get_roots(folders or SESSION_FOLDERS, bids_root)
+        self.bids_root = self.roots.pop("bids", None)
+        self._folders = {key: {} for key in self.roots}
+        self._resources = ([], [])
+        self._bids = {}
+        self._build(max_workers)
+
+    def _get_roots(self, folders, bids_root):
+        roots = {}
+        for key in folders:
+            if key == "bids" and bids_root:
+                roots[key] = bids_root
+                continue
+            try:
+                roots[key] = self.config.get_path(key)
+            except datman.config.UndefinedSetting:
+                logger.debug(f"Path '{key}' not defined, won't be indexed.")
+        return roots
+
+    def _build(self, max_workers):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            top_level = {
+                key: pool.submit(_list_dir, root)
+                for key, root in self.roots.items()
+            }
+            if self.bids_root:
+                top_level["bids"] = pool.submit(_list_dir, self.bids_root)
+
+            pending = {}
+            for key, future in top_level.items():
+                entries = [entry for entry in future.result() if entry[2]]
+                if key == "resources":
+                    entries.sort()
+                    self._resources = (
+                        [name for name, _, _ in entries],
+                        [path for _, path, _ in entries]
+                    )
+                    continue
+                for name, path, _ in entries:
+                    if key == "bids":
+                        if name.startswith("sub-"):
+                            pending[(key, name)] = pool.submit(
+                                _walk_bids_subject, path)
+                    else:
+                        pending[(key, name)] = pool.submit(_list_dir, path)
+
+            for (key, name), future in pending.items():
+                if key == "bids":
+                    self._bids[name] = future.result()
+                else:
+                    self._folders[key][name] = [
+                        path for _, path, _ in future.result()
+                    ]
+
+    def has_folder(self, key):
+        """Check whether a path type was indexed.
+
+        Args:
+            key (:obj:`str`): A configured path type (e.g. 'nii').
+
+        Returns:
+            bool: True if the inventory holds the contents of this folder.
+        """
+        if key == "bids":
+            return self.bids_root is not None
+        return key in self.roots
+
+    def subject_ids(self, key="nii"):
+        """List the session folders found for a path type.
+
+        Args:
+            key (:obj:`str`, optional): The path type to list session
+                folders for. Default 'nii'.
+
+        Returns:
+            list: A sorted list of folder names. These are not validated,
+                so any folder that doesn't match the naming convention is
+                also included.
+        """
+        if key == "resources":
+            return list(self._resources[0])
+        return sorted(self._folders.get(key, {}))
+
+    def get_files(self, key, full_id):
+        """Get the files found for a session.
+
+        Args:
+            key (:obj:`str`): The path type to search (e.g. 'nii').
+            full_id (:obj:`str`): A datman ID with timepoint, but no session.
+
+        Returns:
+            list: Full paths to the contents of the session's folder. For
+                'resources' this is instead a list of all resource folders
+                for the timepoint (one per repeat), matching the folders
+                found by datman.scan.Scan.
+        """
+        if key == "resources":
+            names, paths = self._resources
+            start = bisect.bisect_left(names, full_id)
+            end = start
+            while end < len(names) and names[end].startswith(full_id):
+                end += 1
+            return paths[start:end]
+        return list(self._folders.get(key, {}).get(full_id, []))
+
+    def get_bids_listing(self, bids_sub, bids_ses):
+        """Get the contents of a bids session folder.
+
+        Args:
+            bids_sub (:obj:`str`): The bids subject folder name
+                (e.g. 'sub-CMH0001').
+            bids_ses (:obj:`str`): The bids session folder name
+                (e.g. 'ses-01').
+
+        Returns:
+            dict: A dictionary mapping each folder found inside the session
+                folder (including the session folder itself) to a list of
+                the names of the files it contains.
+        """
+        return self._bids.get(bids_sub, {}).get(bids_ses, {})
+
+    def get_scan(self, subject_id):
+        """Make a Scan that reads its folder contents from the inventory.
+
+        Args:
+            subject_id (:obj:`str` or :obj:`datman.scanid.Identifier`): A
+                valid datman subject ID.
+
+        Returns:
+            :obj:`datman.scan.Scan`: A scan object for the session.
+
+        Raises:
+            datman.scanid.ParseException: If the ID is invalid.
+        """
+        return datman.scan.Scan(subject_id, self.config,
+                                bids_root=self.bids_root, inventory=self)
+
+
+def _list_dir(path):
+    """List a folder's contents, skipping hidden entries as glob does.
+
+    Returns:
+        list: A list of (name, full path, is_dir) tuples. An empty list is
+            returned if the folder doesn't exist.
+    """
+    try:
+        with os.scandir(path) as entries:
+            return [
+                (entry.name, entry.path, entry.is_dir())
+                for entry in entries if not entry.name.startswith(".")
+            ]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def _walk_bids_subject(sub_path):
+    """Walk every session folder in a bids subject folder.
+
+    Returns:
+        dict: A dictionary mapping each session folder name to a dictionary
+            of folder paths and the names of the files they contain.
+    """
+    sessions = {}
+    for name, path, is_dir in _list_dir(sub_path):
+        if not is_dir or not name.startswith("ses-"):
+            continue
+        listing = {}
+        to_search = [path]
+        while to_search:
+            current = to_search.pop()
+            files = []
+            for entry_name, entry_path, entry_is_dir in _list_dir(current):
+                if entry_is_dir:
+                    to_search.append(entry_path)
+                else:
+                    files.append(entry_name)
+            listing[current] = files
+        sessions[name] = listing
+    return sessions
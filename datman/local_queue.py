@@ -0,0 +1,196 @@
+"""Run queued jobs on the local machine instead of a cluster.
+
+When the 'Queue' system setting is 'local', datman.utils.submit_jobs hands
+jobs to a LocalScheduler. Jobs get the same array job script they would on
+slurm, and each task runs as a separate process with its own log file,
+while the number of tasks running at once is bounded. Dependencies between
+jobs behave like slurm's 'afterok': a task only runs once every task of the
+jobs it depends on has succeeded.
+
+Jobs run in the background of the submitting process, which waits for any
+that are still running before it exits.
+"""
+import itertools
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import datman.runner
+import datman.utils
+
+logger = logging.getLogger(__name__)
+
+# The environment variable that holds each task's (zero-based) array index
+TASK_VAR = "DM_ARRAY_TASK_ID"
+
+
+class LocalScheduler:
+    """A bounded pool that runs array jobs as local processes.
+
+    Args:
+        max_workers (int, optional): The most tasks to run at once. Defaults
+            to the number of cores allocated to this process.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or datman.utils.get_allocated_cores()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers,
+                                        thread_name_prefix="local-queue")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def submit(self, bundles, job_name, log_dir, depends_on=None,
+               walltime=None, workdir=None, script_dir=None,
+               max_running=None):
+        """Queue an array job with one task per bundle of commands.
+
+        Args:
+            bundles (:obj:`list`): A list of lists of shell commands. Each
+                inner list is run, in order, by one task.
+            job_name (:obj:`str`): The name for the job.
+            log_dir (:obj:`str`): The folder to write each task's log to.
+            depends_on (:obj:`list`, optional): IDs of jobs from this
+                scheduler that must succeed before this job's tasks run.
+            walltime (:obj:`str`, optional): A slurm style time limit
+                (e.g. '2:00:00') after which a task is killed.
+            workdir (:obj:`str`, optional): The folder to run tasks in.
+            script_dir (:obj:`str`, optional): The folder to write the job
+                script to.
+            max_running (int, optional): The most of this job's tasks to
+                run at once.
+
+        Raises:
+            ValueError: If a dependency isn't a job from this scheduler.
+
+        Returns:
+            str: The new job's ID.
+        """
+        with self._lock:
+            try:
+                dependencies = [future for job_id in depends_on or []
+                                for future in self._jobs[str(job_id)]]
+            except KeyError as e:
+                raise ValueError(f"Unknown local job ID {e}")
+            job_id = f"local-{os.getpid()}-{next(self._ids)}"
+
+        contents = datman.utils.make_array_script(bundles, task_var=TASK_VAR)
+        script = datman.utils.write_job_script(job_name, contents,
+                                               script_dir=script_dir)
+        os.makedirs(log_dir, exist_ok=True)
+        timeout = parse_walltime(walltime)
+        limit = threading.BoundedSemaphore(max_running) if max_running \
+            else None
+
+        # Tasks start in submission order, so anything a task waits on was
+        # started first and can't be stuck behind it.
+        futures = [
+            self._pool.submit(self._run_task, job_name, job_id, task, script,
+                              log_dir, dependencies, timeout, workdir, limit)
+            for task in range(len(bundles))
+        ]
+        with self._lock:
+            self._jobs[job_id] = futures
+        logger.info(f"Queued {len(bundles)} local tasks for {job_name} "
+                    f"({job_id})")
+        return job_id
+
+    def _run_task(self, job_name, job_id, task, script, log_dir,
+                  dependencies, timeout, workdir, limit):
+        for future in dependencies:
+            try:
+                succeeded = future.result()
+            except Exception:
+                succeeded = False
+            if not succeeded:
+                logger.error(f"Skipping {job_name} ({job_id}) task {task}, "
+                             "a job it depends on failed.")
+                return False
+
+        log_file = os.path.join(log_dir, f"{job_name}_{job_id}_{task}")
+        env = dict(os.environ)
+        env[TASK_VAR] = str(task)
+        if limit:
+            limit.acquire()
+        try:
+            result = datman.runner.run_command(
+                ["bash", script], timeout=timeout, log_file=log_file,
+                cwd=workdir, env=env
+            )
+        except OSError as e:
+            logger.error(f"Can't run {job_name} ({job_id}) task {task} - {e}")
+            return False
+        finally:
+            if limit:
+                limit.release()
+
+        if not result.succeeded:
+            logger.error(f"{job_name} ({job_id}) task {task} failed with "
+                         f"returncode {result.returncode}. See {log_file}")
+        return result.succeeded
+
+    def wait(self, job_ids=None):
+        """Wait for jobs to finish.
+
+        Args:
+            job_ids (:obj:`list`, optional): The jobs to wait for. Defaults
+                to every job submitted so far.
+
+        Returns:
+            bool: True if every task of the jobs succeeded.
+        """
+        with self._lock:
+            if job_ids is None:
+                job_ids = list(self._jobs)
+            futures = [future for job_id in job_ids
+                       for future in self._jobs[str(job_id)]]
+        wait(futures)
+        return all(not future.exception() and future.result()
+                   for future in futures)
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def parse_walltime(walltime):
+    """Convert a slurm style time limit to seconds.
+
+    Accepts 'MM', 'MM:SS', 'HH:MM:SS', 'D-HH', 'D-HH:MM' and 'D-HH:MM:SS'.
+
+    Args:
+        walltime (:obj:`str`): A time limit. May be None.
+
+    Raises:
+        ValueError: If the time limit can't be parsed.
+
+    Returns:
+        int: The number of seconds, or None if no time limit was given.
+    """
+    if not walltime:
+        return None
+    match = re.fullmatch(r"(?:(\d+)-)?(\d+)(?::(\d+))?(?::(\d+))?",
+                         str(walltime).strip())
+    if not match:
+        raise ValueError(f"Can't parse walltime '{walltime}'")
+    days, first, second, third = match.groups()
+    if days is None and third is None:
+        hours, minutes, seconds = None, first, second
+    else:
+        hours, minutes, seconds = first, second, third
+    return (int(days or 0) * 86400 + int(hours or 0) * 3600 +
+            int(minutes or 0) * 60 + int(seconds or 0))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Get the local scheduler shared by everything in this process.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LocalScheduler()
+        return _scheduler
@@ -0,0 +1,323 @@
+"""Run external commands with resource accounting and controlled parallelism.
+
+Every command run through this module is timed, and its CPU time and peak
+memory use are recorded from the operating system's accounting for that
+process. All commands in a process share a single limit on how many may run
+at once (by default, the number of cores allocated to the process), so that
+several subsystems can run commands in parallel without overloading a
+machine.
+
+Example:
+
+with datman.runner.CommandRunner() as runner:
+    futures = [runner.submit(["dcm2niix", "-o", out_dir, series])
+               for series in series_dirs]
+results = [future.result() for future in futures]
+logger.info(runner.summary())
+"""
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import datman.utils
+
+logger = logging.getLogger(__name__)
+
+_slots = None
+_max_concurrency = None
+_slots_lock = threading.Lock()
+
+
+def set_max_concurrency(limit):
+    """Set how many commands this process may run at once.
+
+    Commands that are already running are not affected.
+
+    Args:
+        limit (int): The maximum number of commands to run at once.
+    """
+    global _slots, _max_concurrency
+    with _slots_lock:
+        _max_concurrency = max(int(limit), 1)
+        _slots = threading.BoundedSemaphore(_max_concurrency)
+
+
+def get_max_concurrency():
+    """Get how many commands this process may run at once.
+    """
+    return _max_concurrency or datman.utils.get_allocated_cores()
+
+
+def _get_slots():
+    if _slots is None:
+        set_max_concurrency(get_max_concurrency())
+    return _slots
+
+
+class CommandResult:
+    """The outcome of running an external command.
+
+    Attributes:
+        cmd (:obj:`list` or :obj:`str`): The command that was run.
+        returncode (int): The command's exit code. Negative if it was killed
+            by a signal.
+        stdout (bytes): The command's output, or None if it was written to a
+            log file.
+        stderr (bytes): The command's error output, or None if it was
+            written to a log file.
+        wall_time (float): Elapsed time, in seconds.
+        cpu_time (float): User and system CPU time used, in seconds.
+        max_rss (int): Peak resident memory use, in kilobytes. On Linux
+            this can't be less than the memory this python process was
+            using when the command was started.
+        timed_out (bool): Whether the command was killed for running past
+            its timeout.
+    """
+    def __init__(self, cmd, returncode, stdout=None, stderr=None,
+                 wall_time=0.0, cpu_time=0.0, max_rss=0, timed_out=False):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall_time = wall_time
+        self.cpu_time = cpu_time
+        self.max_rss = max_rss
+        self.timed_out = timed_out
+
+    @property
+    def succeeded(self):
+        return self.returncode == 0
+
+    def __repr__(self):
+        return (f"<CommandResult {_describe(self.cmd)} - "
+                f"returncode {self.returncode}>")
+
+
+def run_command(cmd, timeout=None, log_file=None, shell=False, cwd=None,
+                env=None):
+    """Run an external command and wait for it to finish.
+
+    The call blocks until one of this process' command slots (see
+    set_max_concurrency) is free.
+
+    Args:
+        cmd (:obj:`list` or :obj:`str`): The command to run, as a list of
+            arguments. Strings are split into arguments with shell syntax
+            unless shell is set.
+        timeout (float, optional): Kill the command (and anything it
+            started) if it runs longer than this many seconds.
+        log_file (:obj:`str`, optional): Append the command's output and
+            error output to this file as they're written instead of
+            collecting them in memory.
+        shell (bool, optional): Run the command with the shell. Default
+            False.
+        cwd (:obj:`str`, optional): The folder to run the command in.
+        env (:obj:`dict`, optional): The environment to run the command with.
+            Defaults to this process' environment.
+
+    Raises:
+        OSError: If the command can't be started (e.g. it doesn't exist).
+
+    Returns:
+        :obj:`CommandResult`: The command's exit code, output and resource
+            use.
+    """
+    if shell and not isinstance(cmd, str):
+        cmd = " ".join(cmd)
+    elif not shell and isinstance(cmd, str):
+        cmd = shlex.split(cmd)
+
+    with _get_slots():
+        result = _execute(cmd, timeout, log_file, shell, cwd, env)
+
+    logger.debug(
+        f"{_describe(cmd)} finished with returncode {result.returncode} in "
+        f"{result.wall_time:.2f}s (CPU {result.cpu_time:.2f}s, peak RSS "
+        f"{result.max_rss} KB)"
+    )
+    if result.timed_out:
+        logger.error(f"{_describe(cmd)} killed after {timeout}s timeout")
+    return result
+
+
+def _execute(cmd, timeout, log_file, shell, cwd, env):
+    if log_file:
+        log_handle = open(log_file, "ab")
+        outputs = {"stdout": log_handle, "stderr": subprocess.STDOUT}
+    else:
+        log_handle = None
+        outputs = {"stdout": subprocess.PIPE, "stderr": subprocess.PIPE}
+
+    start = time.monotonic()
+    try:
+        # A new session lets a timeout kill everything the command started
+        process = subprocess.Popen(cmd, shell=shell, cwd=cwd, env=env,
+                                   start_new_session=timeout is not None,
+                                   **outputs)
+    except Exception:
+        if log_handle:
+            log_handle.close()
+        raise
+
+    captured = {}
+    readers = []
+    for name in ["stdout", "stderr"]:
+        stream = getattr(process, name)
+        if stream is None:
+            continue
+        reader = threading.Thread(target=_read_stream,
+                                  args=(stream, captured, name),
+                                  daemon=True)
+        reader.start()
+        readers.append(reader)
+
+    timed_out = threading.Event()
+    timer = None
+    if timeout is not None:
+        timer = threading.Timer(timeout, _kill, args=(process, timed_out))
+        timer.daemon = True
+        timer.start()
+
+    try:
+        # wait4 reports the resource use of this one child, even when other
+        # threads are running commands at the same time
+        _, status, usage = os.wait4(process.pid, 0)
+    finally:
+        if timer:
+            timer.cancel()
+    process.returncode = _exit_code(status)
+    wall_time = time.monotonic() - start
+
+    for reader in readers:
+        reader.join()
+    if log_handle:
+        log_handle.close()
+
+    return CommandResult(
+        cmd,
+        process.returncode,
+        stdout=captured.get("stdout"),
+        stderr=captured.get("stderr"),
+        wall_time=wall_time,
+        cpu_time=usage.ru_utime + usage.ru_stime,
+        max_rss=usage.ru_maxrss,
+        timed_out=timed_out.is_set()
+    )
+
+
+def _exit_code(status):
+    """Convert a wait status to a returncode, the same way subprocess does.
+
+    os.waitstatus_to_exitcode() does this, but needs python 3.9 or later.
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _read_stream(stream, captured, name):
+    with stream:
+        captured[name] = stream.read()
+
+
+def _kill(process, timed_out):
+    if process.returncode is not None:
+        return
+    timed_out.set()
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _describe(cmd):
+    if isinstance(cmd, str):
+        return cmd
+    return " ".join(shlex.quote(str(arg)) for arg in cmd)
+
+
+class CommandRunner:
+    """Run external commands in parallel and keep track of what they cost.
+
+    Commands are still subject to the process-wide limit set with
+    set_max_concurrency, so a runner never runs more commands than that
+    even if max_workers is larger.
+
+    Args:
+        max_workers (int, optional): The most commands this runner will run
+            at once. Defaults to the process-wide limit.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or get_max_concurrency()
+        self.results = []
+        self._results_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def submit(self, cmd, **kwargs):
+        """Start running a command.
+
+        Args:
+            cmd (:obj:`list` or :obj:`str`): The command to run.
+            **kwargs: Any other arguments accepted by run_command.
+
+        Returns:
+            :obj:`concurrent.futures.Future`: A future for the command's
+                :obj:`CommandResult`.
+        """
+        future = self._pool.submit(run_command, cmd, **kwargs)
+        future.add_done_callback(self._record)
+        return future
+
+    def map(self, cmds, **kwargs):
+        """Run several commands and wait for all of them to finish.
+
+        Args:
+            cmds (:obj:`list`): The commands to run.
+            **kwargs: Any other arguments accepted by run_command. These
+                are used for every command.
+
+        Returns:
+            list: A :obj:`CommandResult` for each command, in the same order
+                as cmds.
+        """
+        futures = [self.submit(cmd, **kwargs) for cmd in cmds]
+        return [future.result() for future in futures]
+
+    def _record(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._results_lock:
+            self.results.append(future.result())
+
+    def summary(self):
+        """Total the cost of every command this runner has finished.
+
+        Returns:
+            dict: The number of commands run and failed, the sum of their
+                wall and CPU times (in seconds) and the largest peak RSS
+                (in kilobytes) of any one command.
+        """
+        with self._results_lock:
+            results = list(self.results)
+        return {
+            "commands": len(results),
+            "failed": sum(1 for item in results if not item.succeeded),
+            "wall_time": sum(item.wall_time for item in results),
+            "cpu_time": sum(item.cpu_time for item in results),
+            "max_rss": max((item.max_rss for item in results), default=0)
+        }
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        return False
@@ -2,19 +2,20 @@
 A class to make access to all information about a single scan easy
 and uniform.
 
-WARNING: This class currently assumes the contents of the directories
-does not change after the object is created. Certain attribute values may
-become out of date if this is not true.
+Paths and folder contents are only read the first time they're accessed
+and are then cached. Call Scan.refresh() if the contents of the directories
+may have changed since they were first read.
 
 """
 import glob
 import os
+from functools import cached_property
 
 import datman.scanid as scanid
 import datman.utils
 
 
-class DatmanNamed(object):
+class DatmanNamed(scanid.Immutable):
     """
     A parent class for all classes that will obey the datman naming scheme
 
@@ -22,6 +23,9 @@ class DatmanNamed(object):
         ident: A datman.scanid.Identifier instance
 
     """
+    __slots__ = ("_ident", "full_id", "id_plus_session", "study", "site",
+                 "subject", "timepoint", "session", "bids_sub", "bids_ses")
+
     def __init__(self, ident):
         self._ident = ident
         self.full_id = ident.get_full_subjectid_with_timepoint()
@@ -42,12 +46,17 @@ class Series(DatmanNamed):
 
     Args:
         path: The absolute path to a single file.
+        frozen: If True, the instance's attributes can't be modified after
+            it's created. Defaults to False.
 
     May raise a ParseException if the given file name does not match the
     datman naming convention.
 
     """
-    def __init__(self, path):
+    __slots__ = ("path", "ext", "file_name", "tag", "series_num",
+                 "description")
+
+    def __init__(self, path, frozen=False):
         self.path = path
         self.ext = datman.utils.get_extension(path)
         self.file_name = os.path.basename(self.path)
@@ -66,6 +75,8 @@ class Series(DatmanNamed):
         self.tag = tag
         self.series_num = series
         self.description = description
+        if frozen:
+            self._freeze()
 
     def __str__(self):
         return self.file_name
@@ -86,12 +97,21 @@ class Scan(DatmanNamed):
         bids_root (:obj:`str`, optional): The root path where bids data
             is stored. If given, overrides any values from the configuration
             files.
+        inventory (:obj:`datman.inventory.StudyInventory`, optional): A
+            study inventory to read folder contents from, instead of
+            searching the file system.
 
     May raise a ParseException if the given subject_id does not match the
     datman naming convention
 
     """
-    def __init__(self, subject_id, config, bids_root=None):
+    # Attributes computed on first access. Cleared by refresh()
+    _lazy_attrs = ("project", "nii_path", "nrrd_path", "mnc_path",
+                   "dcm_path", "qc_path", "bids_root", "bids_path",
+                   "_bids_inventory", "resources", "resource_path", "niftis",
+                   "_nii_dict", "nii_tags")
+
+    def __init__(self, subject_id, config, bids_root=None, inventory=None):
         self.is_phantom = datman.scanid.is_phantom(subject_id)
 
         if isinstance(subject_id, datman.scanid.Identifier):
@@ -102,43 +122,110 @@ class Scan(DatmanNamed):
         else:
             ident = self._get_ident(subject_id)
 
+        DatmanNamed.__init__(self, ident)
+
+        self._subject_id = subject_id
+        self._config = config
+        self._bids_root = bids_root
+        self._inventory = inventory
+
+    def refresh(self):
+        """Discard cached values so they're recomputed on next access.
+
+        Paths, file lists and the bids inventory are only read from disk
+        the first time they're needed. Call this if the session's folders
+        may have changed since then. Any study inventory the scan was
+        seeded from is also dropped, since it may now be out of date.
+        """
+        self._inventory = None
+        for attr in self._lazy_attrs:
+            self.__dict__.pop(attr, None)
+
+    @cached_property
+    def project(self):
         try:
-            self.project = config.map_xnat_archive_to_project(subject_id)
+            return self._config.map_xnat_archive_to_project(self._subject_id)
         except Exception as e:
             message = f"Failed getting project from config: {str(e)}"
             raise Exception(message)
 
-        DatmanNamed.__init__(self, ident)
+    @property
+    def _study_config(self):
+        """The config, set to the study this session belongs to.
 
-        for dir in ["nii", "nrrd", "mnc", "dcm", "qc"]:
-            setattr(self, f"{dir}_path", self.__get_path(dir, config))
+        Every path must be read through this, so that the config can't
+        still be set to another study (e.g. one set by a Scan from a
+        different study that shares the config object).
+        """
+        project = self.project
+        if self._config.study_name != project:
+            self._config.set_study(project)
+        return self._config
+
+    @cached_property
+    def nii_path(self):
+        return self.__get_path("nii")
+
+    @cached_property
+    def nrrd_path(self):
+        return self.__get_path("nrrd")
+
+    @cached_property
+    def mnc_path(self):
+        return self.__get_path("mnc")
+
+    @cached_property
+    def dcm_path(self):
+        return self.__get_path("dcm")
+
+    @cached_property
+    def qc_path(self):
+        return self.__get_path("qc")
+
+    @cached_property
+    def bids_root(self):
+        if self._bids_root:
+            return self._bids_root
+        try:
+            return self._study_config.get_path("bids")
+        except datman.config.UndefinedSetting:
+            return ""
 
-        if bids_root:
-            self.bids_root = bids_root
-        else:
-            try:
-                bids_root = config.get_path("bids")
-            except datman.config.UndefinedSetting:
-                bids_root = ""
+    @cached_property
+    def bids_path(self):
+        return self.__get_bids()
 
-        self.bids_root = bids_root
-        self.bids_path = self.__get_bids()
-        self._bids_inventory = self._make_bids_inventory()
+    @cached_property
+    def _bids_inventory(self):
+        return self._make_bids_inventory()
 
-        # This one lists all existing resource folders for the timepoint.
-        self.resources = self._get_resources(config)
-        # This one lists the intended location of the sessions' resource dir
-        # The session num will be assumed to be 01 if one wasnt provided.
-        self.resource_path = self.__get_path(
-            "resources", config, session=True)
+    @cached_property
+    def resources(self):
+        """All existing resource folders for the timepoint."""
+        return self._get_resources(self._study_config)
 
-        self.__nii_dict = self.__make_dict(self.niftis)
+    @cached_property
+    def resource_path(self):
+        """The intended location of the session's resource folder.
 
-        self.nii_tags = list(self.__nii_dict.keys())
+        The session number is assumed to be 01 if one wasn't provided.
+        """
+        return self.__get_path("resources", session=True)
 
-    @property
+    @cached_property
     def niftis(self):
-        return self.__get_series(self.nii_path, ['nii', '.nii.gz'])
+        found = self._from_inventory("nii")
+        if found is None:
+            found = glob.glob(os.path.join(self.nii_path, "*"))
+        return self.__get_series(found, ['nii', '.nii.gz'])
+
+    @cached_property
+    def _nii_dict(self):
+        return self.__make_dict(self.niftis)
+
+    @cached_property
+    def nii_tags(self):
+        return list(self._nii_dict.keys())
 
     def _get_ident(self, subid):
         subject_id = self.__check_session(subid)
@@ -149,6 +236,16 @@ class Scan(DatmanNamed):
                 f"{subject_id} does not match datman convention")
         return ident
 
+    def _from_inventory(self, key):
+        """Get the session's files for a path type from the inventory.
+
+        Returns None if the scan has no inventory or the inventory didn't
+        index the path type, in which case the file system must be searched.
+        """
+        if self._inventory is None or not self._inventory.has_folder(key):
+            return None
+        return self._inventory.get_files(key, self.full_id)
+
     def find_files(self, file_stem, format="nii"):
         """Find files belonging to the session matching a given file name.
 
@@ -174,6 +271,11 @@ class Scan(DatmanNamed):
         except AttributeError:
             return []
 
+        found = self._from_inventory(format)
+        if found is not None and os.path.basename(file_stem) == file_stem:
+            return [path for path in found
+                    if os.path.basename(path).startswith(file_stem)]
+
         if not os.path.exists(base_path):
             return []
 
@@ -191,8 +293,17 @@ class Scan(DatmanNamed):
         if not self.bids_path:
             return {}
 
+        if (self._inventory is not None and
+                self._inventory.bids_root == self.bids_root):
+            listing = self._inventory.get_bids_listing(
+                self.bids_sub, self.bids_ses)
+        else:
+            listing = {
+                path: files for path, _, files in os.walk(self.bids_path)
+            }
+
         inventory = {}
-        for path, _, files in os.walk(self.bids_path):
+        for path, files in listing.items():
             if path.endswith("blacklisted"):
                 continue
 
@@ -212,17 +323,18 @@ class Scan(DatmanNamed):
                 except KeyError:
                     # Ignore sidecars missing a series number field.
                     continue
-                base_fname = os.path.splitext(json_path)[0]
+                base_fname = os.path.splitext(item)[0]
 
                 inventory.setdefault(series, []).extend(
-                    glob.glob(base_fname + "*")
+                    os.path.join(path, fname) for fname in files
+                    if fname.startswith(base_fname)
                 )
 
         return inventory
 
     def get_tagged_nii(self, tag):
         try:
-            matched_niftis = self.__nii_dict[tag]
+            matched_niftis = self._nii_dict[tag]
         except KeyError:
             matched_niftis = []
         return matched_niftis
@@ -237,10 +349,12 @@ class Scan(DatmanNamed):
         return
 
     def _get_resources(self, config):
-        search_path = os.path.join(config.get_path("resources"),
-                                   self.full_id + "*")
+        found = self._from_inventory("resources")
+        if found is None:
+            found = glob.glob(os.path.join(config.get_path("resources"),
+                                           self.full_id + "*"))
         valid_paths = []
-        for found_path in glob.glob(search_path):
+        for found_path in found:
             try:
                 ident = datman.scanid.parse(os.path.basename(found_path))
             except datman.scanid.ParseException:
@@ -261,10 +375,11 @@ class Scan(DatmanNamed):
             id_str = id_str + "_01"
         return id_str
 
-    def __get_path(self, key, config, session=False):
+    def __get_path(self, key, session=False):
         folder_name = self.full_id
         if session:
             folder_name = self.id_plus_session
+        config = self._study_config
         try:
             path = os.path.join(config.get_path(key), folder_name)
         except datman.config.UndefinedSetting:
@@ -276,15 +391,14 @@ class Scan(DatmanNamed):
             return ""
         return os.path.join(self.bids_root, self.bids_sub, self.bids_ses)
 
-    def __get_series(self, path, ext_list):
+    def __get_series(self, found, ext_list):
         """
         This method will generate a ParseException if any files are not named
         according to the datman naming convention.
         """
-        glob_path = os.path.join(path, "*")
         series_list = []
         badly_named = []
-        for item in glob.glob(glob_path):
+        for item in found:
             if datman.utils.get_extension(item) in ext_list:
                 try:
                     series = Series(item)
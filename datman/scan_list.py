@@ -25,18 +25,24 @@ class ExampleScanEntry(datman.scan_list.ScanEntryABC):
 datman.scan_list.generate_scan_list(ExampleScanEntry,
                                     my_zip_list,
                                     metadata_path)
+
+The dicom headers read from each zip file are kept in the header index in
+the destination directory (see datman.header_index), so zip files that
+haven't changed aren't read again.
 """
 import logging
 import os
 from abc import ABCMeta, abstractmethod
 from collections import defaultdict
 
-from datman.utils import get_archive_headers
+from datman.header_index import INDEX_NAME, get_archive_headers, \
+    get_header_index
 
 logger = logging.getLogger(os.path.basename(__file__))
 
 
-def generate_scan_list(scan_entry_class, zip_files, dest_dir):
+def generate_scan_list(scan_entry_class, zip_files, dest_dir,
+                       header_index=None):
     """
     Use this function to generate a scans.csv file of the expected format.
 
@@ -46,6 +52,11 @@ def generate_scan_list(scan_entry_class, zip_files, dest_dir):
     zip_files:              A list of zip files to manage
 
     dest_dir:               The directory where scans.csv will be saved
+
+    header_index:           The datman.header_index.HeaderIndex to read
+                            headers with. Defaults to the index in dest_dir
+                            (i.e. the study's index, when dest_dir is the
+                            study's 'meta' folder)
     """
 
     output = os.path.join(dest_dir, "scans.csv")
@@ -60,7 +71,12 @@ def generate_scan_list(scan_entry_class, zip_files, dest_dir):
             f"Can't read scan entries from existing scans.csv file. Reason: {e}"
         )
 
-    new_entries = make_new_entries(processed_scans, zip_files, scan_entry_class)
+    if header_index is None:
+        header_index = get_header_index(
+            path=os.path.join(dest_dir, INDEX_NAME))
+
+    new_entries = make_new_entries(processed_scans, zip_files,
+                                   scan_entry_class, header_index)
 
     logger.debug(f"Writing {len(new_entries)} new entries to scans file")
     if new_entries:
@@ -93,7 +109,14 @@ def get_scan_list_contents(scans_csv):
     return processed_files
 
 
-def make_new_entries(processed_scans, zip_files, EntryClass):
+def make_new_entries(processed_scans, zip_files, EntryClass,
+                     header_index=None):
+    if header_index is not None and EntryClass.header_index is None:
+        # Subclass rather than set the attribute, so the caller's class is
+        # left unchanged
+        EntryClass = type(EntryClass.__name__, (EntryClass,),
+                          {"header_index": header_index})
+
     new_entries = []
     for zip_file in zip_files:
         if not zip_file.endswith(".zip"):
@@ -120,11 +143,17 @@ def update_scans_csv(output, new_entries):
 
 
 class ScanEntryABC(object, metaclass=ABCMeta):
+    # The datman.header_index.HeaderIndex used to read zip files. Set by
+    # make_new_entries() unless a subclass sets its own.
+    header_index = None
+
     def __init__(self, scan_path):
         self.source_name = os.path.basename(scan_path).replace(".zip", "")
         try:
             header = list(
-                get_archive_headers(scan_path, stop_after_first=True).values()
+                get_archive_headers(
+                    scan_path, stop_after_first=True, index=self.header_index
+                ).values()
             )[0]
         except IndexError:
             logger.debug(
@@ -9,14 +9,122 @@ Manages name conventions and functions to ensure that IDs conform to them.
     in its native convention can always be retrieved from 'orig_id'.
 
 """
+import functools
 import os.path
 import re
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 
 from datman.exceptions import ParseException
 
+# The maximum number of results remembered by each of the parse functions
+PARSE_CACHE_SIZE = 4096
+
+
+class Immutable(object):
+    """Prevents an object's attributes from changing once it's frozen.
+
+    Instances are mutable unless _freeze() is called, which subclasses
+    should only do at the end of __init__. The parse functions return
+    frozen instances because their results are cached and shared.
+
+    Subclasses may define __slots__ to avoid a per-instance __dict__, which
+    greatly reduces memory use when many instances are kept.
+    """
+    __slots__ = ("_frozen",)
+
+    def _freeze(self):
+        object.__setattr__(self, "_frozen", True)
+
+    def _is_frozen(self):
+        return getattr(self, "_frozen", False)
+
+    def __setattr__(self, name, value):
+        if self._is_frozen():
+            raise AttributeError(
+                f"Can't set '{name}', {type(self).__name__} is immutable")
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if self._is_frozen():
+            raise AttributeError(
+                f"Can't delete '{name}', {type(self).__name__} is immutable")
+        super().__delattr__(name)
+
+    def __getstate__(self):
+        state = dict(getattr(self, "__dict__", {}))
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get("__slots__", ()):
+                if hasattr(self, name):
+                    state[name] = object.__getattribute__(self, name)
+        return state
+
+    def __setstate__(self, state):
+        # Needed so that copies and unpickled objects can be restored
+        # without tripping the immutability check.
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+
+def _hashable(value):
+    """Convert a (possibly nested) settings dictionary into a hashable key.
+    """
+    if isinstance(value, dict):
+        return ("dict",) + tuple(
+            (key, _hashable(val)) for key, val in value.items())
+    if isinstance(value, (list, tuple)):
+        return ("list",) + tuple(_hashable(item) for item in value)
+    return value
+
+
+def _cache_results(key_func):
+    """Remember the results (and ParseExceptions) of a parse function.
+
+    Args:
+        key_func (function): Takes the same arguments as the decorated
+            function and returns a hashable cache key.
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            try:
+                key = key_func(*args, **kwargs)
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+
+            with lock:
+                result = cache.get(key)
+                if result is not None:
+                    cache.move_to_end(key)
+
+            if result is None:
+                try:
+                    result = (func(*args, **kwargs), None)
+                except ParseException as e:
+                    result = (None, e.args)
+                with lock:
+                    cache[key] = result
+                    if len(cache) > PARSE_CACHE_SIZE:
+                        cache.popitem(last=False)
+
+            value, error = result
+            if error is not None:
+                raise ParseException(*error)
+            return value
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
+
+
+class Identifier(Immutable, ABC):
+    __slots__ = ()
 
-class Identifier(ABC):
     def match(self, identifier):
         if not isinstance(identifier, str):
             raise ParseException("Must be given a string to verify ID matches")
@@ -86,7 +194,10 @@ class DatmanIdentifier(Identifier):
     scan_pattern = re.compile("^" + scan_re + "$")
     pha_pattern = re.compile("^" + pha_re + "$")
 
-    def __init__(self, identifier, settings=None):
+    __slots__ = ("_match_groups", "orig_id", "study", "site", "subject",
+                 "timepoint", "modality", "_session")
+
+    def __init__(self, identifier, settings=None, frozen=False):
         match = self.match(identifier)
 
         if not match:
@@ -106,6 +217,8 @@ class DatmanIdentifier(Identifier):
         # Bug fix: spaces were being left after the session number leading to
         # broken file name
         self._session = match.group("session").strip()
+        if frozen:
+            self._freeze()
 
     @property
     def session(self):
@@ -157,7 +270,10 @@ class KCNIIdentifier(Identifier):
     scan_pattern = re.compile("^" + scan_re + "$")
     pha_pattern = re.compile("^" + pha_re + "$")
 
-    def __init__(self, identifier, settings=None):
+    __slots__ = ("_match_groups", "orig_id", "study", "site", "subject",
+                 "pha_type", "timepoint", "session", "modality")
+
+    def __init__(self, identifier, settings=None, frozen=False):
         match = self.match(identifier)
         if not match:
             raise ParseException(f"Invalid KCNI ID {identifier}")
@@ -179,6 +295,8 @@ class KCNIIdentifier(Identifier):
         self.timepoint = match.group("timepoint")
         self.session = match.group("session")
         self.modality = match.group("modality")
+        if frozen:
+            self._freeze()
 
     def get_xnat_subject_id(self):
         study = self._match_groups.group("study")
@@ -197,7 +315,10 @@ class KCNIIdentifier(Identifier):
         return f"<datman.scanid.KCNIIdentifier {self.__str__()}>"
 
 
-class BIDSFile(object):
+class BIDSFile(Immutable):
+    __slots__ = ("subject", "session", "run", "suffix", "task", "acq", "ce",
+                 "dir", "rec", "echo", "mod")
+
     def __init__(
         self,
         subject,
@@ -211,6 +332,7 @@ class BIDSFile(object):
         run=None,
         echo=None,
         mod=None,
+        frozen=False,
     ):
         self.subject = subject
         self.session = session
@@ -239,6 +361,8 @@ class BIDSFile(object):
         self.rec = rec
         self.echo = echo
         self.mod = mod
+        if frozen:
+            self._freeze()
 
     def __eq__(self, bids_file):
         if not isinstance(bids_file, BIDSFile):
@@ -317,6 +441,7 @@ BIDS_SCAN_RE = (
 FILENAME_PATTERN = re.compile("^" + FILENAME_RE)
 FILENAME_PHA_PATTERN = re.compile("^" + FILENAME_PHA_RE)
 BIDS_SCAN_PATTERN = re.compile(BIDS_SCAN_RE)
+DESCRIPTION_MANGLE_PATTERN = re.compile(r"[^a-zA-Z0-9.+]+")
 
 
 def parse(identifier, settings=None):
@@ -373,6 +498,12 @@ def parse(identifier, settings=None):
         # ID may need to be reparsed based on settings
         identifier = identifier.orig_id
 
+    return _parse(identifier, settings)
+
+
+@_cache_results(lambda identifier, settings=None: (
+    identifier, _hashable(settings)))
+def _parse(identifier, settings=None):
     if settings and "IdType" in settings:
         id_type = settings["IdType"]
     else:
@@ -380,13 +511,14 @@ def parse(identifier, settings=None):
 
     if id_type in ("DATMAN", "DETECT"):
         try:
-            return DatmanIdentifier(identifier)
+            return DatmanIdentifier(identifier, frozen=True)
         except ParseException:
             pass
 
     if id_type in ("KCNI", "DETECT"):
         try:
-            return KCNIIdentifier(identifier, settings=settings)
+            return KCNIIdentifier(identifier, settings=settings,
+                                  frozen=True)
         except ParseException:
             pass
 
@@ -397,6 +529,8 @@ def parse_filename(path):
     """
     Parse a datman style file name.
 
+    Results are cached, so repeated calls for the same file name are cheap.
+
     Args:
         path (:obj:`str`): A file name or full path to parse
 
@@ -415,14 +549,18 @@ def parse_filename(path):
                 (aside from some mangling to non-alphanumeric characters).
 
     """
-    fname = os.path.basename(path)
+    return _parse_filename(os.path.basename(path))
+
+
+@_cache_results(lambda fname: fname)
+def _parse_filename(fname):
     match = FILENAME_PHA_PATTERN.match(fname)  # check PHA first
     if not match:
         match = FILENAME_PATTERN.match(fname)
     if not match:
         raise ParseException()
 
-    ident = DatmanIdentifier(match.group("id"))
+    ident = DatmanIdentifier(match.group("id"), frozen=True)
 
     tag = match.group("tag")
     series = match.group("series")
@@ -430,6 +568,7 @@ def parse_filename(path):
     return ident, tag, series, description
 
 
+@_cache_results(lambda path: path)
 def parse_bids_filename(path):
     fname = os.path.basename(path)
     match = BIDS_SCAN_PATTERN.match(fname)
@@ -448,15 +587,87 @@ def parse_bids_filename(path):
             rec=match.group("rec"),
             echo=match.group("echo"),
             mod=match.group("mod"),
+            frozen=True,
         )
     except ParseException as e:
         raise ParseException(f"Invalid BIDS file name {path} - {e}")
     return ident
 
 
+FILENAME_FIELDS = ("study", "site", "subject", "timepoint", "session",
+                   "tag", "series", "description", "ext")
+
+
+def parse_filenames(paths):
+    """
+    Parse many datman style file names in a single pass.
+
+    Unlike parse_filename() no identifier objects are made and names that
+    don't match the convention are reported instead of raising an exception,
+    so this is much faster for long lists of names (e.g. a folder listing or
+    a blacklist).
+
+    Args:
+        paths (:obj:`list`): A list of file names or full paths to parse.
+
+    Returns:
+        dict: A dictionary of equal length lists (columns), with one entry
+            per input name. The columns are 'name' (the input name), 'id'
+            (the datman ID with session), each field in FILENAME_FIELDS and
+            'error'. 'error' is None for names that were parsed and a reason
+            for names that weren't, which have None for all other fields.
+            This can be passed directly to pandas.DataFrame.
+    """
+    keys = ("id",) + FILENAME_FIELDS
+    columns = {"name": list(paths)}
+    columns.update({key: [] for key in keys})
+    errors = columns["error"] = []
+
+    field_columns = [columns[key] for key in keys]
+    match_pha = FILENAME_PHA_PATTERN.match
+    match_scan = FILENAME_PATTERN.match
+    basename = os.path.basename
+    empty = (None,) * len(keys)
+
+    for path in columns["name"]:
+        if not isinstance(path, str):
+            values = empty
+            errors.append("Not a string")
+        else:
+            fname = basename(path)
+            # check PHA first
+            match = match_pha(fname) or match_scan(fname)
+            if match:
+                values = match.group(*keys)
+                errors.append(None)
+            else:
+                values = empty
+                errors.append("Doesn't match datman file name convention")
+        for column, value in zip(field_columns, values):
+            column.append(value)
+
+    return columns
+
+
+def parse_filenames_df(paths):
+    """
+    Parse many datman style file names into a pandas DataFrame.
+
+    Args:
+        paths (:obj:`list`): A list of file names or full paths to parse.
+
+    Returns:
+        :obj:`pandas.DataFrame`: A data frame with one row per input name
+            and the columns described in parse_filenames().
+    """
+    # Imported here so that pandas isn't loaded by everything that uses IDs
+    import pandas as pd
+    return pd.DataFrame(parse_filenames(paths))
+
+
 def make_filename(ident, tag, series, description, ext=None):
     series = str(series).zfill(2)
-    description = re.sub(r"[^a-zA-Z0-9.+]+", "-", description)
+    description = DESCRIPTION_MANGLE_PATTERN.sub("-", description)
     filename = "_".join([str(ident), tag, series, description])
     if ext:
         filename += ext
@@ -543,16 +754,23 @@ def get_subid(current_subid, settings=None):
     if not settings or "Subject" not in settings:
         return current_subid
 
-    mapping = settings["Subject"]
+    for regex, replacement in _compile_subject_map(
+            tuple(settings["Subject"])):
+        if regex.match(current_subid):
+            return regex.sub(replacement, current_subid)
 
+    return current_subid
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_subject_map(mapping):
+    """Compile each 'regex->replacement' pair of a 'Subject' ID mapping.
+    """
+    compiled = []
     for pair in mapping:
         regex_str, replacement = pair.split("->")
-        regex = re.compile(regex_str)
-        match = regex.match(current_subid)
-        if match:
-            return re.sub(regex_str, replacement, current_subid)
-
-    return current_subid
+        compiled.append((re.compile(regex_str), replacement))
+    return tuple(compiled)
 
 
 def get_kcni_identifier(identifier, settings=None):
@@ -2,25 +2,30 @@
 A collection of utilities for generally munging imaging data.
 """
 import contextlib
+import copy
+import errno
+import fcntl
 import io
 import json
 import logging
 import os
-import random
 import re
 import shutil
-import subprocess as proc
+import stat
+import struct
 import sys
 import tarfile
 import tempfile
-import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 
 import pydicom as dcm
 import pyxnat
 
 import datman.config
 import datman.dashboard as dashboard
+import datman.local_queue as local_queue
+import datman.runner as runner
 import datman.scanid as scanid
 from datman.exceptions import (
     DashboardException,
@@ -303,15 +308,15 @@ def update_checklist(entries, study=None, config=None, path=None):
 
     if dashboard.dash_found and not path:
         _update_qc_reviewers(entries)
+        _refresh_metadata_stores()
         return
 
     # No dashboard, or path was given, so update file system.
     checklist_path = locate_metadata(
         "checklist.csv", study=study, config=config, path=path
     )
-    old_entries = read_checklist(path=checklist_path)
 
-    # Merge with existing list
+    new_entries = {}
     for subject in entries:
         try:
             i = scanid.parse(subject)
@@ -319,12 +324,19 @@ def update_checklist(entries, study=None, config=None, path=None):
             raise MetadataException(
                 f"Attempt to add invalid subject ID {subject} to QC checklist"
             )
-        old_entries[i.get_full_subjectid_with_timepoint()] = entries[subject]
-
-    # Reformat to expected checklist line format
-    lines = [f"qc_{sub}.html {old_entries[sub]}\n" for sub in old_entries]
+        new_entries[i.get_full_subjectid_with_timepoint()] = entries[subject]
+
+    def merge_entries():
+        # Merge with existing list
+        old_entries = read_checklist(path=checklist_path)
+        old_entries.update(new_entries)
+        # Reformat to expected checklist line format
+        return sorted(
+            f"qc_{sub}.html {old_entries[sub]}\n" for sub in old_entries
+        )
 
-    write_metadata(sorted(lines), checklist_path)
+    write_metadata(merge_entries, checklist_path)
+    _refresh_metadata_stores()
 
 
 def _update_qc_reviewers(entries):
@@ -510,17 +522,16 @@ def _parse_blacklist(blacklist, scan=None, subject=None):
     # This will mangle any commas in comments, but is the most reliable way
     # to split the lines
     regex = ",|\s"  # noqa: W605
-    for line in blacklist:
-        fields = re.split(regex, line.strip())
-        try:
-            scan_name = fields[0]
-            scanid.parse_filename(scan_name)
-            comment = fields[1:]
-        except (IndexError, scanid.ParseException):
+    lines = [(line, re.split(regex, line.strip())) for line in blacklist]
+    parsed = scanid.parse_filenames([fields[0] for _, fields in lines])
+
+    for (line, fields), error in zip(lines, parsed["error"]):
+        if error:
             logger.info(f"Ignoring malformed line: {line}")
             continue
 
-        comment = " ".join(comment).strip()
+        scan_name = fields[0]
+        comment = " ".join(fields[1:]).strip()
 
         if scan_name == "series":
             continue
@@ -554,13 +565,14 @@ def update_blacklist(entries, study=None, config=None, path=None):
 
     if dashboard.dash_found and not path:
         _update_scan_checklist(entries)
+        _refresh_metadata_stores()
         return
 
     blacklist_path = locate_metadata(
         "blacklist.csv", study=study, config=config, path=path
     )
-    old_entries = read_blacklist(path=blacklist_path)
 
+    new_entries = {}
     for scan_name in entries:
         try:
             scanid.parse_filename(scan_name)
@@ -574,12 +586,18 @@ def update_blacklist(entries, study=None, config=None, path=None):
                 f"Skipping {scan_name}"
             )
             continue
-        old_entries[scan_name] = entries[scan_name]
+        new_entries[scan_name] = entries[scan_name]
+
+    def merge_entries():
+        old_entries = read_blacklist(path=blacklist_path)
+        old_entries.update(new_entries)
+        lines = [f"{sub} {old_entries[sub]}\n" for sub in old_entries]
+        new_list = ["series\treason\n"]
+        new_list.extend(sorted(lines))
+        return new_list
 
-    lines = [f"{sub} {old_entries[sub]}\n" for sub in old_entries]
-    new_list = ["series\treason\n"]
-    new_list.extend(sorted(lines))
-    write_metadata(new_list, blacklist_path)
+    write_metadata(merge_entries, blacklist_path)
+    _refresh_metadata_stores()
 
 
 def _update_scan_checklist(entries):
@@ -607,25 +625,101 @@ def _update_scan_checklist(entries):
         )
 
 
-def write_metadata(lines, path, retry=3):
+def write_metadata(lines, path):
+    """Replace the contents of a metadata file.
+
+    The file is locked while it's updated, so that parallel jobs can safely
+    update the same file, and is replaced in one step so that readers never
+    see a partially written file. Any contents you wish to preserve should
+    be contained within the list.
+
+    Args:
+        lines (:obj:`list` or callable): The lines to write. To update the
+            file based on its current contents, pass a function instead.
+            It will be called with the lock held and must return the
+            lines to write, so that no other job's changes are lost.
+        path (:obj:`str`): The full path to the metadata file. It will be
+            created if it doesn't exist.
+
+    Raises:
+        MetadataException: If the file can't be updated.
     """
-    Repeatedly attempts to write lines to <path>. The destination file
-    will be overwritten with <lines> so any contents you wish to preserve
-    should be contained within the list.
+    try:
+        with _lock_metadata(path) as locked_file:
+            if callable(lines):
+                lines = lines()
+            _replace_metadata(path, lines, locked_file)
+    except OSError as e:
+        raise MetadataException(f"Failed to update {path}. Reason - {e}")
+
+
+@contextlib.contextmanager
+def _lock_metadata(path):
+    """Hold an exclusive advisory lock on a metadata file.
+
+    The file is created if it doesn't exist. Files are updated by
+    replacing them, so a job that was waiting may end up holding the lock on
+    a file that has since been replaced. The lock is taken again until it's
+    held on the file that is currently at 'path'.
     """
-    if not retry:
-        raise MetadataException(f"Failed to update {path}")
+    while True:
+        locked_file = open(path, "a")
+        try:
+            fcntl.flock(locked_file, fcntl.LOCK_EX)
+            locked = os.fstat(locked_file.fileno())
+            current = os.stat(path)
+        except FileNotFoundError:
+            locked_file.close()
+            continue
+        except BaseException:
+            locked_file.close()
+            raise
+        if (locked.st_dev, locked.st_ino) == (current.st_dev, current.st_ino):
+            break
+        locked_file.close()
 
     try:
-        with open(path, "w") as meta_file:
-            meta_file.writelines(lines)
-    except Exception:
-        logger.error(
-            f"Failed to write metadata file {path}. Tries remaining - {retry}"
-        )
-        wait_time = random.uniform(0, 10)
-        time.sleep(wait_time)
-        write_metadata(lines, path, retry=retry - 1)
+        yield locked_file
+    finally:
+        # Closing the file releases the lock
+        locked_file.close()
+
+
+def _replace_metadata(path, lines, locked_file):
+    """Write the new contents to a temp file and rename it over 'path'.
+    """
+    dir_name = os.path.dirname(path) or "."
+    try:
+        fd, temp_path = tempfile.mkstemp(
+            dir=dir_name, prefix=f".{os.path.basename(path)}.",
+            suffix=".tmp")
+    except PermissionError:
+        # Can't create files in the folder, so rewrite the locked file in
+        # place. Other jobs are still kept out by the lock.
+        logger.debug(f"Can't create temp file in {dir_name}, updating "
+                     f"{path} in place.")
+        locked_file.truncate(0)
+        locked_file.writelines(lines)
+        locked_file.flush()
+        os.fsync(locked_file.fileno())
+        return
+
+    try:
+        with os.fdopen(fd, "w") as temp_file:
+            temp_file.writelines(lines)
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        orig = os.fstat(locked_file.fileno())
+        os.chmod(temp_path, stat.S_IMODE(orig.st_mode))
+        try:
+            os.chown(temp_path, -1, orig.st_gid)
+        except PermissionError:
+            pass
+        os.replace(temp_path, path)
+    except BaseException:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(temp_path)
+        raise
 
 
 def get_subject_metadata(config=None, study=None, allow_partial=False):
@@ -690,6 +784,330 @@ def get_subject_metadata(config=None, study=None, allow_partial=False):
     return all_qc
 
 
+class MetadataStore:
+    """Cached, indexed access to a study's blacklist and checklist.
+
+    read_blacklist() and read_checklist() re-read the metadata on every call,
+    which gets slow when checking every series in a study. A MetadataStore
+    reads each file once and only re-reads it when its modification time or
+    size changes. When the dashboard is in use, blacklist entries are fetched
+    for a whole subject (or the whole study, see prefetch()) at a time
+    instead of once per scan, and kept until refresh() is called.
+
+    Scan names are matched on their session, tag and series number. The
+    series description and any path or extension are ignored, the same way
+    scans are matched in the dashboard database.
+
+    Args:
+        study (:obj:`str`, optional): The name of a study.
+        config (:obj:`datman.config.config`, optional): A config object with
+            the study set.
+        blacklist_path (:obj:`str`, optional): The full path to a blacklist
+            file. If given (or if checklist_path is given), the metadata
+            files will be read even if the dashboard is installed.
+        checklist_path (:obj:`str`, optional): The full path to a checklist
+            file.
+
+    Raises:
+        MetadataException: If the metadata can't be located.
+    """
+
+    def __init__(self, study=None, config=None, blacklist_path=None,
+                 checklist_path=None):
+        self.use_dashboard = dashboard.dash_found and not (
+            blacklist_path or checklist_path)
+
+        if config and not study:
+            study = config.study_name
+        self.study = study
+
+        if self.use_dashboard:
+            if not study:
+                raise MetadataException(
+                    "A study name or config object must be given to read "
+                    "metadata from the dashboard."
+                )
+            self.blacklist_path = self.checklist_path = None
+        else:
+            if not (blacklist_path and checklist_path) and not config:
+                config = datman.config.config(study=study)
+            self.blacklist_path = blacklist_path or locate_metadata(
+                "blacklist.csv", config=config)
+            self.checklist_path = checklist_path or locate_metadata(
+                "checklist.csv", config=config)
+
+        self.refresh()
+
+    def refresh(self):
+        """Discard all cached metadata so it's read again when next needed.
+        """
+        self._files = {}
+        self._blacklist = {}
+        self._bl_index = {}
+        self._checklist = {}
+        self._fetched = set()
+        self._study_fetched = False
+
+    def prefetch(self, subject=None):
+        """Read all blacklist and checklist entries for a subject or study.
+
+        This only has an effect when the dashboard is used. Entries are
+        normally fetched for each subject the first time it's needed, use
+        this to fetch a whole study in one query instead.
+
+        Args:
+            subject (:obj:`str`, optional): A datman subject ID. If not given,
+                entries for the entire study are fetched.
+        """
+        if not self.use_dashboard:
+            self._read_blacklist_file()
+            self._read_checklist_file()
+            return
+
+        if subject:
+            self._fetch_subject(subject)
+            return
+
+        if self._study_fetched:
+            return
+
+        try:
+            self._set_blacklist(_fetch_blacklist(study=self.study))
+            self._checklist = _fetch_checklist(study=self.study)
+        except Exception as e:
+            raise MetadataException(
+                f"Can't retrieve metadata for {self.study} from dashboard "
+                f"database. Reason - {str(e)}"
+            )
+        self._study_fetched = True
+
+    def get_blacklist(self, subject=None):
+        """Get blacklisted scans and the reason they were blacklisted.
+
+        Args:
+            subject (:obj:`str`, optional): A datman subject ID, with or
+                without a session number, to restrict the results to.
+
+        Returns:
+            dict: A dictionary of scan names mapped to their blacklist
+                comments.
+        """
+        if subject:
+            ident = scanid.parse(subject)
+            self._load_blacklist(ident)
+            if ident.session:
+                sessions = [ident.get_full_subjectid_with_timepoint_session()]
+            else:
+                # Phantoms have no session, so their key is just the ID
+                timepoint = ident.get_full_subjectid_with_timepoint()
+                sessions = [sess for sess in self._bl_index
+                            if sess == timepoint or
+                            sess.startswith(timepoint + "_")]
+            return {
+                name: self._blacklist[name]
+                for sess in sessions
+                for name in self._bl_index.get(sess, {}).values()
+            }
+
+        if self.use_dashboard:
+            self.prefetch()
+        else:
+            self._read_blacklist_file()
+        return dict(self._blacklist)
+
+    def get_blacklist_comment(self, scan_name):
+        """Get the comment given when a scan was blacklisted.
+
+        Args:
+            scan_name (:obj:`str`): A datman style scan name. It may include
+                a path and an extension.
+
+        Returns:
+            str: The blacklist comment, or None if the scan is not
+                blacklisted (or the name is not a valid scan name).
+        """
+        try:
+            ident, tag, series, _ = scanid.parse_filename(scan_name)
+        except scanid.ParseException:
+            logger.error(f"Invalid scan name: {scan_name}")
+            return None
+
+        self._load_blacklist(ident)
+        session = ident.get_full_subjectid_with_timepoint_session()
+        name = self._bl_index.get(session, {}).get((tag, int(series)))
+        if name is None:
+            return None
+        return self._blacklist[name]
+
+    def is_blacklisted(self, scan_name):
+        """Check whether a scan has been blacklisted.
+
+        Args:
+            scan_name (:obj:`str`): A datman style scan name. It may include
+                a path and an extension.
+
+        Returns:
+            bool: True if the scan is blacklisted.
+        """
+        return bool(self.get_blacklist_comment(scan_name))
+
+    def get_checklist(self):
+        """Get all QC checklist entries for the study.
+
+        Returns:
+            dict: A dictionary of subject IDs (minus the session number)
+                mapped to their QC comments (or an empty string for
+                subjects that haven't been reviewed).
+        """
+        if self.use_dashboard:
+            self.prefetch()
+        else:
+            self._read_checklist_file()
+        return dict(self._checklist)
+
+    def get_checklist_comment(self, subject):
+        """Get the QC checklist entry for a subject.
+
+        Args:
+            subject (:obj:`str`): A datman subject ID.
+
+        Returns:
+            str: The QC comment, an empty string if the subject hasn't been
+                reviewed, or None if the subject has no checklist entry. As
+                with checklist.csv files, the entry for a timepoint's first
+                session is reported for all of its sessions.
+        """
+        ident = scanid.parse(subject)
+        if self.use_dashboard:
+            if not self._study_fetched:
+                self._fetch_subject(ident)
+        else:
+            self._read_checklist_file()
+        return self._checklist.get(ident.get_full_subjectid_with_timepoint())
+
+    def _load_blacklist(self, ident):
+        if not self.use_dashboard:
+            self._read_blacklist_file()
+        elif not self._study_fetched:
+            self._fetch_subject(ident)
+
+    def _fetch_subject(self, subject):
+        if isinstance(subject, str):
+            subject = scanid.parse(subject)
+        timepoint = subject.get_full_subjectid_with_timepoint()
+        if timepoint in self._fetched:
+            return
+
+        try:
+            db_subject = dashboard.get_subject(timepoint)
+        except Exception as e:
+            raise MetadataException(
+                f"Can't retrieve metadata for {timepoint} from dashboard "
+                f"database. Reason - {str(e)}"
+            )
+        self._fetched.add(timepoint)
+        if not db_subject:
+            return
+
+        entries = {}
+        for entry in db_subject.get_blacklist_entries():
+            scan_name = str(entry.scan) + "_" + entry.scan.description
+            entries[scan_name] = entry.comment
+        self._set_blacklist(entries, update=True)
+
+        if db_subject.is_phantom or not len(db_subject.sessions):
+            return
+        # Like checklist.csv, only the first session is reported
+        session = list(db_subject.sessions.values())[0]
+        self._checklist[timepoint] = (
+            str(session.reviewer) if session.signed_off else "")
+
+    def _read_blacklist_file(self):
+        entries = self._read_file(self.blacklist_path, _parse_blacklist)
+        if entries is not None:
+            self._set_blacklist(entries)
+
+    def _read_checklist_file(self):
+        entries = self._read_file(self.checklist_path, _parse_checklist)
+        if entries is not None:
+            self._checklist = entries
+
+    def _read_file(self, path, parser):
+        """Parse a metadata file if it's new or has changed since last read.
+
+        Returns:
+            dict: The parsed entries, or None if the file is unchanged.
+        """
+        try:
+            file_stat = os.stat(path)
+            key = (file_stat.st_mtime_ns, file_stat.st_size)
+            if self._files.get(path) == key:
+                return None
+            with open(path, "r") as metadata:
+                entries = parser(metadata)
+        except Exception as e:
+            raise MetadataException(
+                f"Failed to read metadata file {path}. Reason - {str(e)}"
+            )
+        self._files[path] = key
+        return entries
+
+    def _set_blacklist(self, entries, update=False):
+        if not update:
+            self._blacklist = {}
+            self._bl_index = {}
+        names = list(entries)
+        parsed = scanid.parse_filenames(names)
+        for name, error, ident, tag, series in zip(
+                names, parsed["error"], parsed["id"], parsed["tag"],
+                parsed["series"]):
+            if error:
+                continue
+            self._blacklist[name] = entries[name]
+            self._bl_index.setdefault(ident, {})[(tag, int(series))] = name
+
+
+_metadata_stores = {}
+
+
+def get_metadata_store(study=None, config=None):
+    """Get a MetadataStore shared by everything in this process.
+
+    Args:
+        study (:obj:`str`, optional): The name of a study.
+        config (:obj:`datman.config.config`, optional): A config object with
+            the study set.
+
+    Returns:
+        :obj:`MetadataStore`: The metadata store for the study.
+    """
+    if not (study or config):
+        raise MetadataException(
+            "A study name or config object must be given to locate study "
+            "metadata."
+        )
+    if not config:
+        config = datman.config.config(study=study)
+
+    if dashboard.dash_found:
+        key = study or config.study_name
+    else:
+        key = config.get_path("meta")
+
+    try:
+        return _metadata_stores[key]
+    except KeyError:
+        pass
+    store = MetadataStore(study=study, config=config)
+    _metadata_stores[key] = store
+    return store
+
+
+def _refresh_metadata_stores():
+    for store in _metadata_stores.values():
+        store.refresh()
+
+
 def get_extension(path):
     """
     Get the filename extension on this path.
@@ -734,49 +1152,209 @@ def get_archive_headers(path, stop_after_first=False):
 def get_tarfile_headers(path, stop_after_first=False):
     """
     Get headers for dicom files within a tarball
-    """
-    tar = tarfile.open(path)
-    members = tar.getmembers()
 
+    The tarball is read in a single streaming pass, so compressed archives are
+    only decompressed once and reading stops as soon as stop_after_first is
+    satisfied. Only enough of each candidate file to hold its headers is
+    parsed, the rest is skipped over.
+
+    Args:
+        path (:obj:`str`): The full path to a tarball. Any compression
+            supported by tarfile may be used.
+        stop_after_first (bool, optional): Return only the headers from the
+            first dicom found. Default False.
+
+    Returns:
+        dict: A dictionary mapping each folder in the tarball to the headers
+            of the first dicom found in it. The headers do not include pixel
+            data.
+    """
     manifest = {}
-    # for each dir, we want to inspect files inside of it until we find a dicom
-    # file that has header information
-    for f in [x for x in members if x.isfile()]:
-        dirname = os.path.dirname(f.name)
-        if dirname in manifest:
-            continue
-        try:
-            manifest[dirname] = dcm.read_file(tar.extractfile(f))
+    with tarfile.open(path, mode="r|*") as tar:
+        # for each dir, we want to inspect files inside of it until we find a
+        # dicom file that has header information
+        for member in tar:
+            if not member.isfile():
+                continue
+            dirname = os.path.dirname(member.name)
+            if dirname in manifest or not is_dicom_candidate(member.name,
+                                                             member.size):
+                continue
+            header = read_streamed_header(tar.extractfile(member))
+            if header is None:
+                continue
+            manifest[dirname] = header
             if stop_after_first:
                 break
-        except dcm.filereader.InvalidDicomError:
-            continue
     return manifest
 
 
-def get_zipfile_headers(path, stop_after_first=False):
-    """
-    Get headers for a dicom file within a zipfile
+# The tag that starts pixel data, for little and big endian dicoms
+PIXEL_DATA_TAGS = (b"\xe0\x7f\x10\x00", b"\x7f\xe0\x00\x10")
+HEADER_CHUNK_SIZE = 64 * 1024
+
+
+def read_streamed_header(stream):
+    """Read dicom headers from a stream that can't seek.
+
+    The stream is read in chunks until the start of the pixel data (or the
+    end of the file) is reached and only the data read so far is parsed.
+
+    Args:
+        stream (file-like): An open binary file, positioned at the start of
+            a possible dicom.
+
+    Returns:
+        :obj:`pydicom.dataset.FileDataset`: The file's headers (without
+            pixel data), or None if it isn't a dicom.
     """
-    zf = zipfile.ZipFile(path)
+    prefix = stream.read(DICOM_PREAMBLE_LEN + len(DICOM_MAGIC))
+    if prefix[DICOM_PREAMBLE_LEN:] != DICOM_MAGIC:
+        return None
 
-    manifest = {}
-    for f in zf.namelist():
-        dirname = os.path.dirname(f)
-        if dirname in manifest:
+    buffer = bytearray(prefix)
+    chunk_size = HEADER_CHUNK_SIZE
+    finished = False
+    while True:
+        chunk = stream.read(chunk_size)
+        finished = len(chunk) < chunk_size
+        buffer += chunk
+        if not finished and not any(tag in buffer
+                                    for tag in PIXEL_DATA_TAGS):
+            chunk_size *= 2
             continue
         try:
-            manifest[dirname] = dcm.read_file(io.BytesIO(zf.read(f)))
-            if stop_after_first:
-                break
+            return read_dicom_header(io.BytesIO(buffer))
         except dcm.filereader.InvalidDicomError:
-            continue
+            return None
+        except Exception:
+            # Headers were cut off (e.g. pixel data tag bytes were found
+            # inside another value), so read further and try again
+            if finished:
+                return None
+            chunk_size *= 2
+
+
+def get_zipfile_headers(path, stop_after_first=False, max_workers=1):
+    """
+    Get headers for a dicom file within a zipfile
+
+    Members are grouped into series folders using the zip's central directory,
+    and any that are too small to hold a dicom preamble or that have a known
+    non-dicom extension are skipped without being read. Candidates are then
+    streamed from the archive only until their headers have been parsed, so
+    pixel data is never decompressed.
+
+    Args:
+        path (:obj:`str`): The full path to a zip file.
+        stop_after_first (bool, optional): Return only the headers from the
+            first dicom found. Default False.
+        max_workers (int, optional): The number of series folders to read
+            at once. Ignored if stop_after_first is set. Default 1.
+
+    Returns:
+        dict: A dictionary mapping each folder in the zip file to the headers
+            of the first dicom found in it. The headers do not include pixel
+            data.
+    """
+    manifest = {}
+    with zipfile.ZipFile(path) as zf:
+        series = group_archive_members(
+            (info.filename, info.file_size) for info in zf.infolist()
+            if not info.is_dir()
+        )
+
+        def read_series(members):
+            return read_first_header(members, lambda name: zf.open(name))
+
+        try:
+            if stop_after_first or max_workers <= 1:
+                for dirname, members in series.items():
+                    header = read_series(members)
+                    if header is None:
+                        continue
+                    manifest[dirname] = header
+                    if stop_after_first:
+                        break
+            else:
+                with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                    found = pool.map(read_series, series.values())
+                    for dirname, header in zip(series, found):
+                        if header is not None:
+                            manifest[dirname] = header
         except zipfile.BadZipfile:
             logger.warning(f"Error in zipfile:{path}")
-            break
     return manifest
 
 
+# Files with these extensions are never dicoms, so archives can skip them
+NON_DICOM_EXTENSIONS = (
+    ".nii", ".nii.gz", ".json", ".bval", ".bvec", ".txt", ".log", ".csv",
+    ".xml", ".pdf", ".html", ".png", ".jpg", ".gif", ".zip", ".tar.gz"
+)
+
+
+def group_archive_members(members):
+    """Group the files in an archive by folder, dropping any non-dicoms.
+
+    Args:
+        members (iterable): (name, size) tuples for each file in an archive.
+
+    Returns:
+        dict: A dictionary mapping each folder name to a list of the names of
+            the files in it that may be dicoms, in archive order.
+    """
+    series = {}
+    for name, size in members:
+        if not is_dicom_candidate(name, size):
+            continue
+        series.setdefault(os.path.dirname(name), []).append(name)
+    return series
+
+
+def is_dicom_candidate(name, size):
+    """Check whether an archive member might be a dicom, without reading it.
+
+    Args:
+        name (:obj:`str`): The member's name.
+        size (int): The member's uncompressed size in bytes.
+
+    Returns:
+        bool: False if the member is too small to hold a dicom preamble or
+            has an extension that dicoms never use.
+    """
+    if size < DICOM_PREAMBLE_LEN + len(DICOM_MAGIC):
+        return False
+    return not name.lower().endswith(NON_DICOM_EXTENSIONS)
+
+
+def read_first_header(members, open_member):
+    """Read the headers from the first dicom in a list of archive members.
+
+    Args:
+        members (:obj:`list`): The names of archive members to try.
+        open_member (callable): A function that takes a member name and
+            returns an open binary file object for it.
+
+    Raises:
+        zipfile.BadZipfile: If a member is corrupted.
+
+    Returns:
+        :obj:`pydicom.dataset.FileDataset`: The headers of the first dicom
+            found (without pixel data), or None if none of the members were
+            dicoms.
+    """
+    for name in members:
+        with open_member(name) as stream:
+            if not has_dicom_magic(stream):
+                continue
+            try:
+                return read_dicom_header(stream)
+            except dcm.filereader.InvalidDicomError:
+                continue
+    return None
+
+
 def get_folder_headers(path, stop_after_first=False):
     """
     Generate a dictionary of subfolders and dicom headers.
@@ -874,11 +1452,16 @@ def run_dummy_q(list_of_names):
     logger.info("... Done.")
 
 
-def run(cmd, dryrun=False, specialquote=True, verbose=True):
+def run(cmd, dryrun=False, specialquote=True, verbose=True, timeout=None):
     """
     Runs the command in default shell, returning STDOUT and a return code.
     The return code uses the python convention of 0 for success, non-zero for
     failure
+
+    The command is run with datman.runner.run_command, so it counts towards
+    the process-wide limit on concurrent commands and its resource use is
+    logged at the debug level. If timeout (in seconds) is given, the command
+    is killed if it runs for longer.
     """
     # Popen needs a string command.
     if isinstance(cmd, list):
@@ -894,15 +1477,15 @@ def run(cmd, dryrun=False, specialquote=True, verbose=True):
 
     logger.debug(f"Executing command: {cmd}")
 
-    p = proc.Popen(cmd, shell=True, stdout=proc.PIPE, stderr=proc.PIPE)
-    out, err = p.communicate()
+    result = runner.run_command(cmd, shell=True, timeout=timeout)
 
-    if p.returncode and verbose:
+    if result.returncode and verbose:
         logger.error(
-            f"run({cmd}) failed with returncode {p.returncode}. STDERR: {err}"
+            f"run({cmd}) failed with returncode {result.returncode}. "
+            f"STDERR: {result.stderr}"
         )
 
-    return p.returncode, out
+    return result.returncode, result.stdout
 
 
 def _escape_shell_chars(arg):
@@ -956,6 +1539,27 @@ def check_returncode(returncode):
         raise ValueError
 
 
+def get_allocated_cores():
+    """Find the number of CPU cores this process is allowed to use.
+
+    The SLURM_CPUS_PER_TASK environment variable is checked first, so that
+    jobs running on a cluster node don't try to use every core on the machine.
+    Otherwise, the process' CPU affinity is used (falling back to the total
+    core count on systems that don't support it).
+
+    Returns:
+        int: The number of cores available. Always at least 1.
+    """
+    try:
+        cores = int(os.environ["SLURM_CPUS_PER_TASK"])
+    except (KeyError, ValueError):
+        try:
+            cores = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cores = os.cpu_count()
+    return max(cores or 1, 1)
+
+
 def get_loaded_modules():
     """Returns a space separated list of loaded modules
 
@@ -985,6 +1589,170 @@ def make_temp_directory(suffix="", prefix="tmp", path=None):
         shutil.rmtree(temp_dir)
 
 
+# The Linux ioctl request number used to clone (reflink) a file's extents.
+FICLONE = 0x40049409
+
+TRANSFER_METHODS = ("rename", "link", "reflink", "copy")
+
+
+def get_transfer_methods(config=None):
+    """Get the configured order of methods to use when transferring files.
+
+    This reads the 'TransferMethods' setting, which should be a list
+    containing any of 'rename', 'link', 'reflink' and 'copy'. Methods are
+    always tried in the order given by TRANSFER_METHODS, the setting only
+    controls which of them are allowed.
+
+    Args:
+        config (:obj:`datman.config.config`, optional): A datman config
+            object. If not given, all methods are allowed.
+
+    Returns:
+        tuple: The allowed transfer methods.
+    """
+    if not config:
+        return TRANSFER_METHODS
+
+    try:
+        allowed = config.get_key("TransferMethods")
+    except datman.config.UndefinedSetting:
+        return TRANSFER_METHODS
+
+    if isinstance(allowed, str):
+        allowed = [allowed]
+
+    unknown = [item for item in allowed if item not in TRANSFER_METHODS]
+    if unknown:
+        logger.error(f"Ignoring unrecognized TransferMethods {unknown}")
+
+    methods = tuple(item for item in TRANSFER_METHODS if item in allowed)
+    if not methods:
+        logger.error("No valid TransferMethods configured, using 'copy'.")
+        return ("copy",)
+    return methods
+
+
+def materialize_file(source, dest, move=False, methods=None,
+                     reset_mode=False):
+    """Make 'dest' hold the contents of 'source' as cheaply as possible.
+
+    Each allowed method is tried in turn until one succeeds:
+        1. 'rename': Move the file (only if move=True).
+        2. 'link': Make a hard link to the source.
+        3. 'reflink': Clone the file's data blocks on copy-on-write file
+           systems (Btrfs, XFS) or ask the kernel to copy it (which may be
+           handled server side on NFS).
+        4. 'copy': A regular copy of the file contents.
+
+    The destination is replaced atomically if it already exists.
+
+    Args:
+        source (:obj:`str`): The full path to the file to transfer.
+        dest (:obj:`str`): The full path of the file to create.
+        move (bool, optional): Whether the source file may be consumed.
+            If True, the source is removed once dest exists. Defaults to False.
+        methods (:obj:`list`, optional): The transfer methods that are
+            allowed. Defaults to all of TRANSFER_METHODS.
+        reset_mode (bool, optional): If dest ends up sharing the source's
+            inode ('rename' or 'link'), give it the permissions of a newly
+            created file (0o666 minus the umask), the same as a copy would
+            have. Use this for sources with restricted permissions, like
+            files made by tempfile.mkstemp(). Note that a linked source gets
+            the new permissions too. Defaults to False.
+
+    Raises:
+        OSError: If the file could not be transferred by any method.
+
+    Returns:
+        str: The name of the method that was used.
+    """
+    if methods is None:
+        methods = TRANSFER_METHODS
+
+    tmp_dest = os.path.join(
+        os.path.dirname(dest),
+        f".{os.path.basename(dest)}.{os.getpid()}.tmp"
+    )
+
+    error = OSError(errno.EINVAL, "No transfer method allowed", source)
+    for method in TRANSFER_METHODS:
+        if method not in methods:
+            continue
+        if method == "rename":
+            if not move:
+                continue
+            try:
+                os.replace(source, dest)
+            except OSError as exc:
+                error = exc
+                continue
+            if reset_mode:
+                os.chmod(dest, 0o666 & ~get_umask())
+            return method
+
+        try:
+            if method == "link":
+                os.link(source, tmp_dest)
+            elif method == "reflink":
+                _reflink(source, tmp_dest)
+            else:
+                shutil.copyfile(source, tmp_dest)
+            os.replace(tmp_dest, dest)
+        except OSError as exc:
+            error = exc
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_dest)
+            continue
+
+        if reset_mode and method == "link":
+            os.chmod(dest, 0o666 & ~get_umask())
+        if move:
+            os.remove(source)
+        return method
+
+    raise error
+
+
+def get_umask():
+    """Find the current process' umask without changing it.
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError, IndexError):
+        pass
+    # os.umask can only be read by setting it, which isn't thread safe
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def _reflink(source, dest):
+    """Clone a file with FICLONE, falling back to copy_file_range.
+    """
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+
+        if not hasattr(os, "copy_file_range"):
+            raise OSError(errno.ENOTSUP, "Reflinks not supported", source)
+
+        remaining = os.fstat(src.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+            if not copied:
+                break
+            remaining -= copied
+
+    if remaining:
+        raise OSError(errno.EIO, "Incomplete copy_file_range", source)
+
+
 def remove_empty_files(path):
     for root, dirs, files in os.walk(path):
         for f in files:
@@ -1214,6 +1982,8 @@ def submit_job(
     partition=None,
     argslist="",
     workdir="/tmp",
+    script_dir=None,
+    queue=None,
 ):
     """
     submits a job or joblist the queue depending on the system
@@ -1235,18 +2005,31 @@ def submit_job(
                                     --mem X --verbose ...) [default=None]
         workdir                     Location for slurm to use as the work
                                     dir [default='/tmp']
+        script_dir                  Folder to write the job script to. A
+                                    unique file name is always used
+                                    [default=the system temp folder]
+        queue                       Set to 'local' to run the job on this
+                                    machine instead (see get_queue)
+                                    [default=None]
     """
     if dryrun:
         return
 
+    if queue == "local":
+        try:
+            submit_jobs([cmd], job_name, log_dir, queue=queue,
+                        cpu_cores=cpu_cores, walltime=walltime,
+                        workdir=workdir, script_dir=script_dir)
+        except ValueError as e:
+            logger.error(f"Job submission failed. {e}")
+            sys.exit(1)
+        return
+
     # Bit of an ugly hack to allow job submission on the scc. Should be
     # replaced with drmaa or some other queue interface later
     if system == "kimel":
-        job_file = f"/tmp/{job_name}"
-
-        with open(job_file, "w") as fid:
-            fid.write("#!/bin/bash\n")
-            fid.write(cmd)
+        job_file = write_job_script(job_name, "#!/bin/bash\n" + cmd,
+                                    script_dir=script_dir)
 
         arg_list = (
             "-c {cores} -t {walltime} {args} --job-name {jobname} "
@@ -1282,23 +2065,327 @@ def submit_job(
         sys.exit(1)
 
 
-def get_resources(open_zipfile):
-    # filter dirs
-    files = open_zipfile.namelist()
-    files = [f for f in files if not f.endswith("/")]
+QUEUE_TYPES = ("slurm", "sge", "qbatch", "local")
 
-    # filter files named like dicoms
-    files = [f for f in files if not is_named_like_a_dicom(f)]
 
-    # filter actual dicoms :D.
-    resource_files = []
-    for f in files:
+def get_queue(config):
+    """Find the type of job queue to submit to.
+
+    Args:
+        config (:obj:`datman.config.config`): A datman config object.
+
+    Returns:
+        str: The configured 'Queue' setting. If it isn't set, 'slurm' for
+            the 'kimel' system (matching submit_job) and 'qbatch' otherwise.
+    """
+    try:
+        queue = config.get_key("Queue", defaults_only=True).lower()
+    except datman.config.UndefinedSetting:
+        return "slurm" if config.system == "kimel" else "qbatch"
+    if queue not in QUEUE_TYPES:
+        raise ValueError(f"Unsupported queue type '{queue}'. Must be one of "
+                         f"{', '.join(QUEUE_TYPES)}")
+    return queue
+
+
+def get_job_script_dir(config):
+    """Get the configured folder for job scripts, if any.
+
+    Args:
+        config (:obj:`datman.config.config`): A datman config object.
+
+    Returns:
+        str: The 'JobScriptDir' setting, or None if it isn't set.
+    """
+    try:
+        return config.get_key("JobScriptDir", defaults_only=True)
+    except datman.config.UndefinedSetting:
+        return None
+
+
+def write_job_script(job_name, contents, script_dir=None):
+    """Write a job script to a new file that no other job will use.
+
+    Args:
+        job_name (:obj:`str`): The job's name. Used as the file name prefix.
+        contents (:obj:`str`): The script's contents.
+        script_dir (:obj:`str`, optional): The folder to write the script to.
+            Defaults to the system temp folder.
+
+    Returns:
+        str: The full path to the script.
+    """
+    if script_dir:
+        os.makedirs(script_dir, exist_ok=True)
+    handle, job_file = tempfile.mkstemp(
+        prefix=f"{job_name}_", suffix=".sh", dir=script_dir)
+    with os.fdopen(handle, "w") as fid:
+        fid.write(contents)
+    os.chmod(job_file, 0o750)
+    return job_file
+
+
+def make_array_script(bundles, task_var="SLURM_ARRAY_TASK_ID"):
+    """Make a bash script that runs one bundle of commands per array task.
+
+    Commands in a bundle run one after another, even if one fails. The task
+    exits with a non-zero status if any of its commands failed.
+
+    Args:
+        bundles (:obj:`list`): A list of lists of commands.
+        task_var (:obj:`str`, optional): The environment variable that holds
+            the (zero-based) array task ID.
+
+    Returns:
+        str: The contents of the script.
+    """
+    lines = ["#!/bin/bash", "status=0", f'case "${{{task_var}}}" in']
+    for task_id, bundle in enumerate(bundles):
+        lines.append(f"{task_id})")
+        for cmd in bundle:
+            lines.append(f"    {{ {cmd}\n    }} || status=$?")
+        lines.append("    ;;")
+    lines.extend([
+        "*)",
+        f'    echo "No commands for task ${{{task_var}}}" >&2',
+        "    exit 1",
+        "    ;;",
+        "esac",
+        "exit $status",
+        ""
+    ])
+    return "\n".join(lines)
+
+
+def bundle_commands(cmds, bundle_size=1):
+    """Split a list of commands into groups to run in one task each.
+    """
+    bundle_size = max(int(bundle_size), 1)
+    return [cmds[i:i + bundle_size] for i in range(0, len(cmds), bundle_size)]
+
+
+def submit_jobs(
+    cmds,
+    job_name,
+    log_dir,
+    queue="slurm",
+    bundle_size=1,
+    max_running=None,
+    depends_on=None,
+    cpu_cores=1,
+    walltime="2:00:00",
+    dryrun=False,
+    partition=None,
+    argslist="",
+    workdir="/tmp",
+    script_dir=None,
+):
+    """Submit many commands to the queue as a single array job.
+
+    Each array task runs a bundle of up to bundle_size commands one after
+    another, so the queue sees one submission instead of one per command and
+    the startup cost of each task is shared by its bundle.
+
+    Args:
+        cmds (:obj:`list`): The shell commands to run.
+        job_name (:obj:`str`): The name for the job.
+        log_dir (:obj:`str`): The folder to write job logs to.
+        queue (:obj:`str`, optional): The type of queue to submit to (see
+            get_queue). 'sge' and 'qbatch' both submit with qbatch, 'local'
+            runs the tasks on this machine (see datman.local_queue).
+            Default 'slurm'.
+        bundle_size (int, optional): The number of commands to run in each
+            array task. Default 1.
+        max_running (int, optional): The most array tasks to run at once.
+            Not used for qbatch. Default no limit.
+        depends_on (:obj:`list`, optional): The IDs of jobs that must finish
+            successfully before this one starts.
+        cpu_cores (int, optional): The number of cores for each task.
+        walltime (:obj:`str`, optional): The time limit for each task.
+        dryrun (bool, optional): Log the submission without submitting.
+        partition (:obj:`str`, optional): The slurm partition to use.
+        argslist (:obj:`str`, optional): Additional sbatch arguments.
+        workdir (:obj:`str`, optional): The work dir for slurm to use.
+        script_dir (:obj:`str`, optional): The folder to write the job script
+            to. A unique file name is always used. Defaults to the system temp
+            folder.
+
+    Raises:
+        ValueError: If the queue type isn't supported.
+        RuntimeError: If submission fails.
+
+    Returns:
+        str: The ID of the submitted job, to use as a dependency of later
+            jobs. None if no jobs were submitted.
+    """
+    if not cmds:
+        return None
+    bundles = bundle_commands(list(cmds), bundle_size)
+
+    if queue == "local":
+        if dryrun:
+            logger.info(f"DRYRUN - Would run {len(cmds)} commands in "
+                        f"{len(bundles)} local {job_name} tasks")
+            return None
+        return local_queue.get_scheduler().submit(
+            bundles, job_name, log_dir, depends_on=depends_on,
+            walltime=walltime, workdir=workdir, script_dir=script_dir,
+            max_running=max_running
+        )
+
+    if queue == "slurm":
+        job = _get_sbatch_array_command(
+            bundles, job_name, log_dir, max_running, depends_on, cpu_cores,
+            walltime, partition, argslist, workdir, script_dir, dryrun
+        )
+        specialquote = True
+    elif queue in ("sge", "qbatch"):
+        job = _get_qbatch_array_command(
+            bundles, job_name, log_dir, depends_on, cpu_cores, walltime,
+            script_dir, dryrun
+        )
+        specialquote = False
+    else:
+        raise ValueError(f"Unsupported queue type '{queue}'")
+
+    if dryrun:
+        logger.info(f"DRYRUN - Would submit {len(cmds)} commands in "
+                    f"{len(bundles)} tasks with: {job}")
+        return None
+
+    rtn, out = run(job, specialquote=specialquote)
+    if isinstance(out, bytes):
+        out = out.decode("utf-8", errors="replace")
+    if rtn:
+        raise RuntimeError(f"Job submission failed for {job_name}: {out}")
+    logger.info(f"Submitted {len(cmds)} commands as {len(bundles)} "
+                f"{job_name} tasks")
+    return _parse_job_id(out)
+
+
+def _get_sbatch_array_command(bundles, job_name, log_dir, max_running,
+                              depends_on, cpu_cores, walltime, partition,
+                              argslist, workdir, script_dir, dryrun):
+    if dryrun:
+        job_file = os.path.join(script_dir or tempfile.gettempdir(),
+                                f"{job_name}_XXXXXX.sh")
+    else:
+        job_file = write_job_script(job_name, make_array_script(bundles),
+                                    script_dir=script_dir)
+    array = f"0-{len(bundles) - 1}"
+    if max_running:
+        array += f"%{max_running}"
+    args = [
+        "sbatch", "--parsable", f"--array={array}", f"-c {cpu_cores}",
+        f"-t {walltime}", argslist, f"--job-name {job_name}",
+        f"-o {log_dir}/{job_name}_%A_%a", f"-D {workdir}"
+    ]
+    if partition:
+        args.append(f"-p {partition}")
+    if depends_on:
+        args.append("--dependency=afterok:" +
+                    ":".join(str(item) for item in depends_on))
+    args.append(job_file)
+    return " ".join(arg for arg in args if arg)
+
+
+def _get_qbatch_array_command(bundles, job_name, log_dir, depends_on,
+                              cpu_cores, walltime, script_dir, dryrun):
+    # qbatch builds the array job itself from a file with one command per
+    # line, running 'chunksize' lines in each task
+    cmds = [cmd for bundle in bundles for cmd in bundle]
+    if dryrun:
+        cmd_file = os.path.join(script_dir or tempfile.gettempdir(),
+                                f"{job_name}_XXXXXX.sh")
+    else:
+        cmd_file = write_job_script(job_name, "\n".join(cmds) + "\n",
+                                    script_dir=script_dir)
+    args = [
+        "qbatch", f"-N {job_name}", f"--logdir {log_dir}",
+        f"--ppj {cpu_cores}", f"-c {len(bundles[0])}", "-j 1",
+        f"--walltime {walltime}"
+    ]
+    for item in depends_on or []:
+        args.append(f"--depend {item}")
+    args.append(cmd_file)
+    return " ".join(args)
+
+
+def _parse_job_id(output):
+    """Find the job ID in a queue's submission output.
+    """
+    if not output:
+        return None
+    # sbatch --parsable prints 'id' or 'id;cluster'
+    last_line = output.strip().splitlines()[-1]
+    match = re.search(r"(\d+)", last_line.split(";")[0])
+    return match.group(1) if match else last_line
+
+
+ZIP_MEMBER_TYPES = ("dicom", "resource", "empty", "snapshot")
+
+
+def classify_zip_members(open_zipfile):
+    """Label every file in a zip as a dicom, resource, empty file or snapshot.
+
+    Only the zip's central directory and, for files not named like dicoms,
+    the first 132 bytes of each member are read.
+
+    Args:
+        open_zipfile (:obj:`zipfile.ZipFile`): An open zip file.
+
+    Returns:
+        dict: A dictionary mapping each of 'dicom', 'resource', 'empty' and
+            'snapshot' (files inside a 'SNAPSHOTS' folder) to a list of the
+            members of that type, in archive order. Members that can't be
+            read are left out.
+    """
+    contents = {key: [] for key in ZIP_MEMBER_TYPES}
+    for info in open_zipfile.infolist():
+        if info.is_dir():
+            continue
         try:
-            if not is_dicom(io.BytesIO(open_zipfile.read(f))):
-                resource_files.append(f)
+            member_type = _classify_zip_member(open_zipfile, info)
         except zipfile.BadZipfile:
-            logger.error(f"Error in zipfile:{f}")
-    return resource_files
+            logger.error(f"Error in zipfile:{info.filename}")
+            continue
+        contents[member_type].append(info.filename)
+    return contents
+
+
+def _classify_zip_member(open_zipfile, info):
+    if info.file_size == 0:
+        return "empty"
+    if "SNAPSHOTS" in info.filename.split("/")[:-1]:
+        return "snapshot"
+    if is_named_like_a_dicom(info.filename):
+        return "dicom"
+    if info.file_size < DICOM_PREAMBLE_LEN + len(DICOM_MAGIC):
+        return "resource"
+    with open_zipfile.open(info) as member:
+        if has_dicom_magic(member):
+            return "dicom"
+    return "resource"
+
+
+def get_resources(open_zipfile, contents=None):
+    """Get the names of all non-dicom files in a zip.
+
+    Args:
+        open_zipfile (:obj:`zipfile.ZipFile`): An open zip file.
+        contents (:obj:`dict`, optional): The result of
+            classify_zip_members() for this zip, if already known.
+
+    Returns:
+        list: The names of all resources, empty files and snapshots in the
+            zip, in archive order.
+    """
+    if contents is None:
+        contents = classify_zip_members(open_zipfile)
+    non_dicoms = set(
+        contents["resource"] + contents["empty"] + contents["snapshot"]
+    )
+    return [item for item in open_zipfile.namelist() if item in non_dicoms]
 
 
 def is_named_like_a_dicom(path):
@@ -1306,9 +2393,69 @@ def is_named_like_a_dicom(path):
     return any([path.lower().endswith(x) for x in dcm_exts])
 
 
+# Dicom files begin with a 128 byte preamble followed by this magic number
+DICOM_PREAMBLE_LEN = 128
+DICOM_MAGIC = b"DICM"
+
+
+def has_dicom_magic(fileobj):
+    """Check for the 'DICM' magic number that follows a dicom's preamble.
+
+    Only the first 132 bytes are read, so this is a very cheap way to rule
+    out non-dicom files. If a file object is given its position is restored
+    afterwards.
+
+    Args:
+        fileobj (:obj:`str` or file-like): A path or an open binary file.
+
+    Returns:
+        bool: True if the magic number is present, False otherwise.
+    """
+    size = DICOM_PREAMBLE_LEN + len(DICOM_MAGIC)
+    try:
+        if isinstance(fileobj, (str, bytes, os.PathLike)):
+            with open(fileobj, "rb") as fh:
+                prefix = fh.read(size)
+        else:
+            position = fileobj.tell()
+            prefix = fileobj.read(size)
+            fileobj.seek(position)
+    except (OSError, ValueError, AttributeError):
+        return False
+    return prefix[DICOM_PREAMBLE_LEN:] == DICOM_MAGIC
+
+
+def read_dicom_header(fileobj, specific_tags=None, defer_size=None):
+    """Read the headers of a dicom file without loading its pixel data.
+
+    Args:
+        fileobj (:obj:`str` or file-like): A path or an open binary file.
+        specific_tags (:obj:`list`, optional): If given, only these tags
+            (keywords or tag numbers) are read. Defaults to None.
+        defer_size (int or :obj:`str`, optional): Values larger than this
+            (e.g. '1 KB') are only read from disk when accessed. This only
+            works when a path is given, since the file is reopened to read
+            them. Defaults to None.
+
+    Raises:
+        pydicom.errors.InvalidDicomError: If the file is not a dicom.
+
+    Returns:
+        :obj:`pydicom.dataset.FileDataset`: The dicom's headers.
+    """
+    return dcm.dcmread(
+        fileobj,
+        stop_before_pixels=True,
+        specific_tags=specific_tags,
+        defer_size=defer_size
+    )
+
+
 def is_dicom(fileobj):
+    if not has_dicom_magic(fileobj):
+        return False
     try:
-        dcm.read_file(fileobj)
+        read_dicom_header(fileobj, defer_size="1 KB")
     except dcm.filereader.InvalidDicomError:
         return False
     except Exception:
@@ -1333,6 +2480,107 @@ def make_zip(source_dir, dest_zip):
                 zip_handle.write(item_path, archive_path)
 
 
+def write_raw_zip_member(zip_handle, zinfo, chunks):
+    """Add already compressed data to a zip file that's open for writing.
+
+    This mirrors how zipfile itself writes a member, but skips compression so
+    that data can be copied from another zip file as-is.
+
+    Args:
+        zip_handle (:obj:`zipfile.ZipFile`): A zip file open in 'w' or 'a'
+            mode.
+        zinfo (:obj:`zipfile.ZipInfo`): The member's info. Its
+            compress_type, CRC, file_size and compress_size must already
+            describe the data.
+        chunks (iterable): The member's compressed data, as bytes objects.
+    """
+    # This uses ZipFile's private attributes (_lock, _seekable, start_dir,
+    # _writecheck, _didModify) the same way ZipFile.write() does. They're
+    # unchanged in python 3.8 - 3.11, the versions datman is tested with,
+    # but must be checked against zipfile.ZipFile.write() when adding
+    # support for a new python version.
+    # Sizes are written in the local header, so no data descriptor follows
+    zinfo.flag_bits &= ~0x08
+    with zip_handle._lock:
+        if zip_handle._seekable:
+            zip_handle.fp.seek(zip_handle.start_dir)
+        zinfo.header_offset = zip_handle.fp.tell()
+        zip_handle._writecheck(zinfo)
+        zip_handle._didModify = True
+        zip_handle.fp.write(zinfo.FileHeader())
+        for chunk in chunks:
+            zip_handle.fp.write(chunk)
+        zip_handle.filelist.append(zinfo)
+        zip_handle.NameToInfo[zinfo.filename] = zinfo
+        zip_handle.start_dir = zip_handle.fp.tell()
+
+
+def filter_zip(source_zip, dest_zip, keep=None, rename=None):
+    """Copy selected members of a zip file into a new zip file.
+
+    Members are copied as-is, without being decompressed and compressed
+    again, so this is mostly a sequential copy of the source zip.
+
+    Args:
+        source_zip (:obj:`str`): The full path to the zip file to copy from.
+        dest_zip (:obj:`str`): The full path to the zip file to create. Any
+            existing file will be overwritten.
+        keep (callable, optional): A function that takes a member's
+            :obj:`zipfile.ZipInfo` and returns True if it should be copied.
+            Defaults to copying every member.
+        rename (callable, optional): A function that takes a member's name
+            and returns the name to use in the new zip file.
+
+    Returns:
+        list: The names of the members in the new zip file.
+    """
+    written = []
+    with zipfile.ZipFile(source_zip) as source, \
+            open(source_zip, "rb") as raw_source, \
+            zipfile.ZipFile(dest_zip, "w", allowZip64=True) as dest:
+        for info in source.infolist():
+            if keep is not None and not keep(info):
+                continue
+            zinfo = copy.copy(info)
+            if rename is not None:
+                zinfo.filename = zinfo.orig_filename = rename(info.filename)
+            if zinfo.filename in dest.NameToInfo:
+                logger.error(f"Can't copy {info.filename} from {source_zip}, "
+                             f"{zinfo.filename} already exists in {dest_zip}")
+                continue
+            # The new local header gets its own zip64 field if needed
+            zinfo.extra = zipfile._strip_extra(zinfo.extra, (1,))
+            write_raw_zip_member(
+                dest, zinfo, _read_raw_zip_member(raw_source, info))
+            written.append(zinfo.filename)
+    return written
+
+
+def _read_raw_zip_member(raw_zip, info, chunk_size=1024 ** 2):
+    """Yield the still compressed data for a zip member.
+    """
+    # Parses the local header with zipfile's private _FH_* constants, as
+    # ZipFile.open() does. Like zipfile._strip_extra in filter_zip, these
+    # are checked for python 3.8 - 3.11 only.
+    raw_zip.seek(info.header_offset)
+    header = raw_zip.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader:
+        raise zipfile.BadZipfile(f"Truncated header for {info.filename}")
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    if fields[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+        raise zipfile.BadZipfile(f"Bad header for {info.filename}")
+    raw_zip.seek(fields[zipfile._FH_FILENAME_LENGTH] +
+                 fields[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    remaining = info.compress_size
+    while remaining:
+        chunk = raw_zip.read(min(chunk_size, remaining))
+        if not chunk:
+            raise zipfile.BadZipfile(f"Truncated data for {info.filename}")
+        remaining -= len(chunk)
+        yield chunk
+
+
 def find_tech_notes(folder):
     """Find any technotes located within a given folder.
 
@@ -16,6 +16,7 @@ from zipfile import ZipFile
 
 import requests
 
+from datman.config import TagMatcher
 from datman.exceptions import UndefinedSetting, XnatException, ParseException
 from datman.utils import is_dicom
 
@@ -444,7 +445,8 @@ class xnat(object):
 
         return [item.get("label") for item in result["ResultSet"]["Result"]]
 
-    def get_experiment(self, project, subject_id, exper_id, create=False):
+    def get_experiment(self, project, subject_id, exper_id, create=False,
+                       keep_raw_json=True):
         """Get an experiment from the XNAT server.
 
         Args:
@@ -453,6 +455,9 @@ class xnat(object):
             exper_id (:obj:`str`): The name of the experiment to retrieve.
             create (bool, optional): Whether to create an experiment matching
                 exper_id if a match is not found. Defaults to False.
+            keep_raw_json (bool, optional): Whether the experiment should keep
+                the raw json from XNAT. See
+                :obj:`datman.xnat.XNATExperiment`. Defaults to True.
 
         Raises:
             XnatException: If the experiment doesn't exist and can't be made
@@ -483,7 +488,8 @@ class xnat(object):
             logger.info(
                 f"Creating experiment {exper_id} for subject_id {subject_id}")
             self.make_experiment(project, subject_id, exper_id)
-            return self.get_experiment(project, subject_id, exper_id)
+            return self.get_experiment(project, subject_id, exper_id,
+                                       keep_raw_json=keep_raw_json)
 
         try:
             exper_json = result["items"][0]
@@ -491,7 +497,8 @@ class xnat(object):
             raise XnatException(
                 f"Could not access metadata for experiment {exper_id}")
 
-        return XNATExperiment(project, subject_id, exper_json)
+        return XNATExperiment(project, subject_id, exper_json,
+                              keep_raw_json=keep_raw_json)
 
     def make_experiment(self, project, subject, experiment):
         """Make a new (empty) experiment on the XNAT server.
@@ -1277,6 +1284,8 @@ class xnat(object):
 
 
 class XNATObject(ABC):
+    __slots__ = ()
+
     def _get_field(self, key):
         if not self.raw_json.get("data_fields"):
             return ""
@@ -1315,8 +1324,22 @@ class XNATSubject(XNATObject):
 
 
 class XNATExperiment(XNATObject):
-    def __init__(self, project, subject_name, experiment_json):
+    """An experiment (scan session) on XNAT.
+
+    Args:
+        project (:obj:`str`): The XNAT project the experiment belongs to.
+        subject_name (:obj:`str`): The XNAT subject the experiment belongs to.
+        experiment_json (:obj:`dict`): The experiment's metadata from XNAT.
+        keep_raw_json (bool, optional): Whether to keep the raw json for the
+            experiment and its scans after all fields have been read from it.
+            Set to False to save memory when many experiments are kept.
+            Defaults to True.
+    """
+
+    def __init__(self, project, subject_name, experiment_json,
+                 keep_raw_json=True):
         self.raw_json = experiment_json
+        self._alt_labels = None
         self.project = project
         self.subject = subject_name
         self.uid = self._get_field("UID")
@@ -1343,6 +1366,12 @@ class XNATExperiment(XNATObject):
         # Misc - basically just OPT CU1 needs this
         self.misc_resource_IDs = self._get_other_resource_IDs()
 
+        if not keep_raw_json:
+            self.get_alt_labels()
+            for scan in self.scans:
+                scan.discard_raw_json()
+            self.raw_json = None
+
     def _get_contents(self, data_type):
         children = self.raw_json.get("children", [])
 
@@ -1614,10 +1643,16 @@ class XNATExperiment(XNATObject):
     def get_alt_labels(self):
         """Find the names for all shared copies of the XNAT experiment.
         """
+        if self._alt_labels is not None:
+            return self._alt_labels
         shared = self._get_contents("sharing/share")
         if not shared:
-            return []
-        return [item['data_fields']['label'] for item in shared[0]]
+            self._alt_labels = []
+        else:
+            self._alt_labels = [
+                item['data_fields']['label'] for item in shared[0]
+            ]
+        return self._alt_labels
 
     def __str__(self):
         return f"<XNATExperiment {self.name}>"
@@ -1627,6 +1662,11 @@ class XNATExperiment(XNATObject):
 
 
 class XNATScan(XNATObject):
+    __slots__ = ("project", "subject", "experiment", "shared",
+                 "source_experiment", "raw_json", "uid", "series",
+                 "image_type", "multiecho", "description", "type", "names",
+                 "tags", "download_dir", "echo_dict", "_raw_dicoms")
+
     def __init__(self, experiment, scan_json):
         self.project = experiment.project
         self.subject = experiment.subject
@@ -1660,7 +1700,18 @@ class XNATScan(XNATObject):
             return True
         return False
 
+    def discard_raw_json(self):
+        """Drop the scan's raw json from XNAT to reduce memory use.
+
+        All fields are read from the json when the scan is created, so the
+        rest of the scan's attributes are unaffected.
+        """
+        self._raw_dicoms = self.raw_dicoms_exist()
+        self.raw_json = None
+
     def raw_dicoms_exist(self):
+        if self.raw_json is None:
+            return self._raw_dicoms
         for child in self.raw_json["children"]:
             for item in child["items"]:
                 file_type = item["data_fields"].get("content")
@@ -1679,24 +1730,23 @@ class XNATScan(XNATObject):
         return False
 
     def set_tag(self, tag_map):
-        matches = {}
-        for tag, pattern in tag_map.items():
-
-            if 'SeriesDescription' in pattern:
-                regex = pattern['SeriesDescription']
-                search_target = self.description
-            elif 'XnatType' in pattern:
-                regex = pattern['XnatType']
-                search_target = self.type
-            else:
-                raise KeyError(
-                    "Missing keys 'SeriesDescription' or 'XnatType'"
-                    " for Pattern!")
+        """Find the tags whose export patterns match this scan.
+
+        Args:
+            tag_map (:obj:`datman.config.TagMatcher` or :obj:`dict`): A
+                matcher for the tag patterns, or the tag patterns themselves
+                (e.g. from :obj:`datman.config.TagInfo.series_map`).
+
+        Returns:
+            :obj:`dict`: The matching tags mapped to their patterns.
+        """
+        if not isinstance(tag_map, TagMatcher):
+            tag_map = TagMatcher(tag_map)
 
-            if isinstance(regex, list):
-                regex = "|".join(regex)
-            if re.search(regex, search_target, re.IGNORECASE):
-                matches[tag] = pattern
+        matches = {
+            tag: tag_map.patterns[tag]
+            for tag in tag_map.search(self.description, self.type)
+        }
 
         if len(matches) == 1 or (len(matches) == 2 and self.multiecho):
             self.tags = list(matches.keys())
@@ -1705,10 +1755,9 @@ class XNATScan(XNATObject):
 
     def _set_fmap_tag(self, tag_map, matches):
         try:
-            for tag, pattern in tag_map.items():
-                if tag in matches:
-                    if not re.search(pattern["ImageType"], self.image_type):
-                        del matches[tag]
+            for tag in list(matches):
+                if not tag_map.image_type_matches(tag, self.image_type):
+                    del matches[tag]
         except Exception:
             matches = {}
 
@@ -1720,7 +1769,7 @@ class XNATScan(XNATObject):
     def set_datman_name(self, base_name, tags):
         mangled_descr = self._mangle_descr()
         padded_series = self.series.zfill(2)
-        tag_settings = self.set_tag(tags.series_map)
+        tag_settings = self.set_tag(tags.matcher)
         if not tag_settings:
             raise ParseException(
                 f"Can't identify tag for series {self.series}")
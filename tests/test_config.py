@@ -3,7 +3,13 @@
 Tests for datman/config.py
 """
 
+import copy
 import os
+import pickle
+
+import pytest
+import yaml
+from mock import patch
 
 import datman.config as config
 
@@ -14,3 +20,229 @@ def test_initialise_from_environ():
     os.environ['DM_CONFIG'] = os.path.join(FIXTURE_DIR, 'site_config.yml')
     os.environ['DM_SYSTEM'] = 'test'
     config.config()
+
+
+class StudyConfigs:
+    site_config = """
+SystemSettings:
+  test:
+    DatmanProjectsDir: /archive/data
+    ConfigDir: {config_dir}
+Projects:
+  STUDYA: study_a.yml
+  STUDYB: study_b.yml
+"""
+    study_a = """
+StudyTag: STA01
+Sites:
+  CMH:
+    XnatArchive: STUDYA_CMH
+    SiteTags: [SHARED]
+  UTO:
+    SiteTags: SHRD
+"""
+    study_b = """
+StudyTag: STB01
+XnatArchive: STUDYB_ALL
+Sites:
+  CMH:
+    SiteTags: [SHARED]
+"""
+
+    def _make_config(self, tmp_path):
+        (tmp_path / "site_config.yml").write_text(
+            self.site_config.format(config_dir=tmp_path))
+        (tmp_path / "study_a.yml").write_text(self.study_a)
+        (tmp_path / "study_b.yml").write_text(self.study_b)
+        return config.config(
+            filename=str(tmp_path / "site_config.yml"), system="test")
+
+
+class TestStudyIndex(StudyConfigs):
+    def test_maps_study_and_site_tags_to_project(self, tmp_path):
+        cfg = self._make_config(tmp_path)
+
+        assert cfg.map_xnat_archive_to_project("STB01") == "STUDYB"
+        assert cfg.map_xnat_archive_to_project("shrd") == "STUDYA"
+        assert cfg.study_name == "STUDYA"
+
+    def test_shared_tag_resolved_by_site(self, tmp_path):
+        cfg = self._make_config(tmp_path)
+
+        assert cfg.map_xnat_archive_to_project(
+            "SHARED_CMH_0001_01_01") == "STUDYA"
+        assert cfg.map_xnat_archive_to_project(
+            "SHARED_UTO_0001_01_01") == "STUDYA"
+
+    def test_xnat_archive_mapped_to_study_and_site(self, tmp_path):
+        cfg = self._make_config(tmp_path)
+
+        assert cfg.find_archive_study("STUDYB_ALL") == ("STUDYB", "CMH")
+        assert cfg.find_archive_study("STUDYA_CMH", site="UTO") is None
+        assert cfg.map_xnat_archive_to_project("STUDYA_CMH") == "STUDYA"
+
+    def test_get_xnat_projects_uses_index(self, tmp_path):
+        cfg = self._make_config(tmp_path)
+
+        assert cfg.get_xnat_projects("STUDYA") == ["STUDYA_CMH"]
+        assert cfg.get_xnat_projects("STUDYB") == ["STUDYB_ALL"]
+
+    def test_saved_index_reused_by_new_config(self, tmp_path):
+        self._make_config(tmp_path).get_study_index()
+        cfg = config.config(
+            filename=str(tmp_path / "site_config.yml"), system="test")
+
+        with patch.object(cfg, "_build_study_index") as mock_build:
+            cfg.get_study_index()
+
+        assert not mock_build.called
+
+    def test_saved_index_rebuilt_when_study_config_changes(self, tmp_path):
+        self._make_config(tmp_path).get_study_index()
+        study_file = tmp_path / "study_b.yml"
+        study_file.write_text(self.study_b.replace("STB01", "STB02"))
+        mtime = os.stat(study_file).st_mtime + 10
+        os.utime(study_file, (mtime, mtime))
+
+        cfg = config.config(
+            filename=str(tmp_path / "site_config.yml"), system="test")
+
+        assert cfg.map_xnat_archive_to_project("STB02") == "STUDYB"
+
+
+class TestLoadYaml:
+    def test_unchanged_file_parsed_once(self, tmp_path):
+        path = tmp_path / "settings.yml"
+        path.write_text("Sites:\n  CMH:\n    XnatArchive: TEST\n")
+
+        with patch("yaml.load", wraps=yaml.load) as mock_load:
+            first = config.load_yaml(str(path))
+            second = config.load_yaml(str(path))
+
+        assert first is second
+        assert mock_load.call_count == 1
+
+    def test_modified_file_is_parsed_again(self, tmp_path):
+        path = tmp_path / "settings.yml"
+        path.write_text("StudyTag: ABC\n")
+        assert config.load_yaml(str(path))["StudyTag"] == "ABC"
+
+        path.write_text("StudyTag: ABCD\n")
+
+        assert config.load_yaml(str(path))["StudyTag"] == "ABCD"
+
+    def test_contents_are_read_only(self, tmp_path):
+        path = tmp_path / "settings.yml"
+        path.write_text("Sites:\n  CMH:\n    SiteTags: [A, B]\n")
+
+        contents = config.load_yaml(str(path))
+
+        with pytest.raises(TypeError):
+            contents["Sites"]["UTO"] = {}
+        with pytest.raises(TypeError):
+            contents["Sites"]["CMH"]["SiteTags"].append("C")
+
+        copied = contents["Sites"].copy()
+        copied["UTO"] = {}
+        assert "UTO" not in contents["Sites"]
+
+    def test_contents_can_be_pickled(self, tmp_path):
+        path = tmp_path / "settings.yml"
+        path.write_text("Sites:\n  CMH:\n    SiteTags: [A, B]\n")
+        contents = config.load_yaml(str(path))
+
+        assert pickle.loads(pickle.dumps(contents)) == contents
+        assert copy.deepcopy(contents) == contents
+
+
+class TestGetKeyCache(StudyConfigs):
+    def test_repeated_lookups_use_cache(self, tmp_path):
+        cfg = self._make_config(tmp_path)
+        cfg.set_study("STUDYA")
+
+        with patch.object(cfg, "_find_key", wraps=cfg._find_key) as mock_find:
+            for _ in range(3):
+                assert cfg.get_key("XnatArchive", site="CMH") == "STUDYA_CMH"
+
+        assert mock_find.call_count == 1
+
+    def test_missing_settings_raise_every_time(self, tmp_path):
+        cfg = self._make_config(tmp_path)
+        cfg.set_study("STUDYA")
+
+        for _ in range(2):
+            with pytest.raises(config.UndefinedSetting):
+                cfg.get_key("XnatArchive", site="UTO")
+
+    def test_cache_cleared_when_study_changes(self, tmp_path):
+        cfg = self._make_config(tmp_path)
+
+        cfg.set_study("STUDYA")
+        assert cfg.get_key("StudyTag") == "STA01"
+        cfg.set_study("STUDYB")
+        assert cfg.get_key("StudyTag") == "STB01"
+
+    def test_resolve_all_merges_every_level(self, tmp_path):
+        cfg = self._make_config(tmp_path)
+        cfg.set_study("STUDYB")
+
+        settings = cfg.resolve_all(site="CMH")
+
+        assert settings["StudyTag"] == "STB01"
+        assert settings["XnatArchive"] == "STUDYB_ALL"
+        assert settings["SiteTags"] == ["SHARED"]
+        assert settings["DatmanProjectsDir"] == "/archive/data"
+
+
+class TestTagMatcher:
+    series_map = {
+        "T1": {"SeriesDescription": ["T1", "BRAVO"]},
+        "RST": {"SeriesDescription": "^rest"},
+        "FMAP-AP": {"SeriesDescription": "fmap", "ImageType": "M"},
+        "FMAP-PA": {"SeriesDescription": "fmap", "ImageType": "P"},
+        "PDT2": {"XnatType": "PD.*T2"},
+    }
+
+    def test_finds_every_matching_tag_in_configured_order(self):
+        matcher = config.TagMatcher(self.series_map)
+
+        assert matcher.search("sag-t1-bravo", "") == ["T1"]
+        assert matcher.search("rest t1", "") == ["T1", "RST"]
+        assert matcher.search("fmap", "") == ["FMAP-AP", "FMAP-PA"]
+        assert matcher.search("my rest", "") == []
+
+    def test_xnat_type_patterns_match_type(self):
+        matcher = config.TagMatcher(self.series_map)
+
+        assert matcher.search("PD-T2 axial", "pd_t2") == ["PDT2"]
+
+    def test_patterns_that_cant_be_combined_still_match(self):
+        matcher = config.TagMatcher({
+            "DUP": {"SeriesDescription": r"(a)\1"},
+            "T1": {"SeriesDescription": "T1"},
+        })
+
+        assert matcher.search("xaa_T1", "") == ["DUP", "T1"]
+
+    def test_back_references_in_later_tags_match_their_own_group(self):
+        matcher = config.TagMatcher({
+            "A": {"SeriesDescription": "t1"},
+            "B": {"SeriesDescription": r"(ab)\1"},
+            "C": {"SeriesDescription": r"(?P<x>cd)(?P=x)"},
+        })
+
+        assert matcher.search("abab", "") == ["B"]
+        assert matcher.search("t1_cdcd", "") == ["A", "C"]
+        assert matcher.search("abcd", "") == []
+
+    def test_image_type_matches(self):
+        matcher = config.TagMatcher(self.series_map)
+
+        assert matcher.image_type_matches("FMAP-AP", "ORIGINAL\\M")
+        assert not matcher.image_type_matches("FMAP-PA", "ORIGINAL\\M")
+        with pytest.raises(KeyError):
+            matcher.image_type_matches("T1", "ORIGINAL\\M")
+
+    def test_raises_key_error_for_pattern_without_search_field(self):
+        with pytest.raises(KeyError):
+            config.TagMatcher({"T1": {"ImageType": "M"}})
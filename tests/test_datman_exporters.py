@@ -286,6 +286,80 @@ class TestNiiLinkExporter:
         return exp
 
 
+class TestNiiExporter:
+
+    def test_default_compression_matches_original_dcm2niix_command(self):
+        exporter = exporters.NiiExporter("/some/nii", "STUDY_CMH_0000_01_01")
+
+        cmd = exporter.get_niix_cmd("/tmp/out", "/tmp/raw")
+
+        assert cmd == "dcm2niix -z y -b y -o /tmp/out /tmp/raw"
+
+    def test_compression_level_is_passed_to_dcm2niix(self):
+        exporter = exporters.NiiExporter(
+            "/some/nii", "STUDY_CMH_0000_01_01",
+            compression={"Method": "internal", "Level": 3}
+        )
+
+        cmd = exporter.get_niix_cmd("/tmp/out", "/tmp/raw")
+
+        assert cmd.startswith("dcm2niix -z i -3 ")
+
+    def test_post_compression_leaves_dcm2niix_output_uncompressed(self):
+        exporter = exporters.NiiExporter(
+            "/some/nii", "STUDY_CMH_0000_01_01",
+            compression={"Method": "post", "Level": 3, "Threads": 4}
+        )
+
+        cmd = exporter.get_niix_cmd("/tmp/out", "/tmp/raw")
+
+        assert cmd.startswith("dcm2niix -z n -b y")
+
+    def test_pigz_thread_limit_compresses_after_conversion(self):
+        exporter = exporters.NiiExporter(
+            "/some/nii", "STUDY_CMH_0000_01_01",
+            compression={"Method": "pigz", "Threads": 2}
+        )
+
+        cmd = exporter.get_niix_cmd("/tmp/out", "/tmp/raw")
+
+        assert exporter.post_compress
+        assert cmd.startswith("dcm2niix -z n -b y")
+
+    def test_invalid_compression_settings_are_ignored(self):
+        exporter = exporters.NiiExporter(
+            "/some/nii", "STUDY_CMH_0000_01_01",
+            compression={"Method": "bzip2", "Level": 12, "Threads": "many"}
+        )
+
+        assert exporter.compression == {"Method": "pigz"}
+
+    def test_post_compression_gzips_files_without_pigz(self, tmp_path):
+        nii = tmp_path / "series.nii"
+        nii.write_bytes(b"0" * 1024)
+        exporter = exporters.NiiExporter(
+            str(tmp_path), "STUDY_CMH_0000_01_01",
+            compression={"Method": "post", "Threads": 2}
+        )
+
+        with patch("datman.exporters.shutil.which", return_value=None):
+            exporter.compress_niftis([str(nii)])
+
+        assert not nii.exists()
+        assert (tmp_path / "series.nii.gz").exists()
+
+    def test_tag_compression_settings_override_study_settings(self):
+        config = Mock()
+        config.get_key.return_value = {"Method": "post", "Threads": 8}
+
+        compression = exporters.get_nii_compression(
+            config, site="CMH",
+            tag_settings={"NiiCompression": {"Method": "pigz"}}
+        )
+
+        assert compression == {"Method": "pigz", "Threads": 8}
+
+
 def replace_sidecars(contents_dict):
     """Used to provide JSON side car contents to open() calls.
     """
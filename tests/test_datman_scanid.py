@@ -632,3 +632,94 @@ def test_bids_file_handles_prelapse_session_strings():
 
     parsed = scanid.parse_bids_filename(prelapse_file)
     assert str(parsed) == prelapse_file
+
+
+def test_parse_returns_cached_identifier_for_same_id():
+    first = scanid.parse("DTI_CMH_H001_01_02")
+    second = scanid.parse("DTI_CMH_H001_01_02")
+    assert first is second
+
+
+def test_parse_cache_respects_settings():
+    settings = {'IdType': 'KCNI', 'Study': {'DTI01': 'DTI'}}
+    ident = scanid.parse("DTI01_CMH_H001_01_SE02_MR", settings=settings)
+    assert ident.study == "DTI"
+
+    ident = scanid.parse("DTI01_CMH_H001_01_SE02_MR")
+    assert ident.study == "DTI01"
+
+
+def test_parse_cached_failures_still_raise():
+    for _ in range(2):
+        with pytest.raises(scanid.ParseException):
+            scanid.parse("lkjlksjdf")
+
+
+def test_identifiers_are_immutable():
+    ident = scanid.parse("DTI_CMH_H001_01")
+    with pytest.raises(AttributeError):
+        ident.session = "01"
+    with pytest.raises(AttributeError):
+        ident.site = "UTO"
+    assert str(ident) == "DTI_CMH_H001_01"
+
+
+def test_constructed_identifiers_are_mutable_unless_frozen():
+    ident = scanid.DatmanIdentifier("DTI_CMH_H001_01")
+    ident.session = "01"
+    assert str(ident) == "DTI_CMH_H001_01_01"
+
+    ident = scanid.DatmanIdentifier("DTI_CMH_H001_01", frozen=True)
+    with pytest.raises(AttributeError):
+        ident.session = "01"
+
+
+def test_parse_filename_cached_by_file_name():
+    first = scanid.parse_filename(
+        "/some/path/DTI_CMH_H001_01_01_T1_02_SagT1-BRAVO.nii.gz")
+    second = scanid.parse_filename(
+        "DTI_CMH_H001_01_01_T1_02_SagT1-BRAVO.nii.gz")
+    assert first is second
+
+
+def test_bids_files_are_immutable():
+    ident = scanid.parse_bids_filename("sub-CMH0001_ses-01_run-1_T1w.nii.gz")
+    with pytest.raises(AttributeError):
+        ident.run = "2"
+
+
+def test_parse_filenames_matches_parse_filename():
+    names = ["/some/path/DTI_CMH_H001_01_01_T1_02_SagT1-BRAVO.nii.gz",
+             "DTI_CMH_PHA_FBN0013_RST_04_Resting.nii",
+             "DTI_CMH_H001_01_02_DTI60-1000_05_Ax-DTI-60.bvec"]
+
+    parsed = scanid.parse_filenames(names)
+
+    assert parsed["name"] == names
+    for i, name in enumerate(names):
+        ident, tag, series, description = scanid.parse_filename(name)
+        assert parsed["error"][i] is None
+        assert parsed["id"][i] == str(ident)
+        assert parsed["session"][i] == ident.session
+        assert parsed["tag"][i] == tag
+        assert parsed["series"][i] == series
+        assert parsed["description"][i] == description
+    assert parsed["ext"] == [".nii.gz", ".nii", ".bvec"]
+
+
+def test_parse_filenames_reports_failures():
+    parsed = scanid.parse_filenames(
+        ["DTI_CMH_H001_01_01_T1_02_SagT1.nii", "lkjlksjdf", None])
+
+    assert parsed["error"][0] is None
+    assert parsed["error"][1] and parsed["error"][2]
+    assert parsed["tag"] == ["T1", None, None]
+    assert all(len(column) == 3 for column in parsed.values())
+
+
+def test_parse_filenames_df_has_row_per_name():
+    frame = scanid.parse_filenames_df(
+        ["DTI_CMH_H001_01_01_T1_02_SagT1.nii", "lkjlksjdf"])
+
+    assert list(frame["tag"]) == ["T1", None]
+    assert list(frame["error"].isna()) == [True, False]
@@ -0,0 +1,84 @@
+import importlib
+import json
+import logging
+import os
+
+from mock import MagicMock, patch
+
+import datman.config
+
+# Disable all logging output for tests
+logging.disable(logging.CRITICAL)
+
+backfill = importlib.import_module('bin.dm_export_backfill')
+
+
+def _write_side_car(ses_path, fname, contents):
+    anat = os.path.join(ses_path, "anat")
+    os.makedirs(anat, exist_ok=True)
+    with open(os.path.join(anat, fname), "w") as fh:
+        json.dump(contents, fh)
+
+
+class TestLocalExperiment:
+    def test_only_side_cars_for_the_session_repeat_are_used(self, tmp_path):
+        _write_side_car(tmp_path, "sub-CMH0001_ses-01_T1w.json", {
+            "SeriesNumber": 2, "SeriesDescription": "T1",
+            "AcquisitionDateTime": "2021-03-04T10:11:12.000000"})
+        _write_side_car(tmp_path, "sub-CMH0001_ses-01_run-02_T1w.json", {
+            "SeriesNumber": 3, "SeriesDescription": "T1", "Repeat": "02"})
+        session = MagicMock(bids_path=str(tmp_path), session="01")
+
+        experiment = backfill.LocalExperiment(session)
+
+        assert [scan.series for scan in experiment.scans] == ["2"]
+        assert experiment.date == "2021-03-04"
+        assert not experiment.is_shared()
+
+
+class TestFindSessions:
+    def _make_config(self, bids_root, sites, study_tags):
+        config = MagicMock(spec=datman.config.config)
+        config.get_sites.return_value = sites
+        config.get_study_tags.return_value = study_tags
+        config.get_path.side_effect = datman.config.UndefinedSetting
+        return config
+
+    def test_makes_datman_ids_for_each_bids_session(self, tmp_path):
+        _write_side_car(tmp_path / "sub-CMH0001" / "ses-01", "a.json", {})
+        _write_side_car(tmp_path / "sub-CMH0001" / "ses-01", "b.json",
+                        {"Repeat": "02"})
+        _write_side_car(tmp_path / "sub-CMHX0002" / "ses-02", "a.json", {})
+        os.makedirs(tmp_path / "sub-UNK0003" / "ses-01")
+        config = self._make_config(
+            tmp_path, ["CMH", "CMHX"], {"STUDY": ["CMH", "CMHX"]})
+
+        result = backfill.find_sessions(config, str(tmp_path))
+
+        assert result == ["STUDY_CMH_0001_01_01", "STUDY_CMH_0001_01_02",
+                          "STUDY_CMHX_0002_02_01"]
+
+
+class TestRunBackfill:
+    @patch('bin.dm_export_backfill._run_session')
+    def test_serial_when_one_job(self, mock_run):
+        mock_run.return_value = {"nii_link": 2}
+
+        result = backfill.run_backfill(
+            "STUDY", ["STUDY_CMH_0001_01_01", "STUDY_CMH_0002_01_01"],
+            ["nii_link"], dry_run=True, jobs=1)
+
+        assert mock_run.call_count == 2
+        assert result["STUDY_CMH_0002_01_01"] == {"nii_link": 2}
+
+    def test_count_pending_counts_missing_links(self):
+        exporter = MagicMock(spec=backfill.datman.exporters.NiiLinkExporter)
+        exporter.find_pending.return_value = ["a", "b"]
+
+        assert backfill.count_pending(exporter) == 2
+
+    def test_count_pending_for_other_exporters(self):
+        exporter = MagicMock(spec=backfill.datman.exporters.DBExporter)
+        exporter.outputs_exist.return_value = False
+
+        assert backfill.count_pending(exporter) == 1
@@ -102,6 +102,16 @@ class TestMakeQCCommand:
 
         assert result == f"{qc.__file__} {self.study} {self.subid}"
 
+    def test_bundle_size_not_passed_to_subject_jobs(self, mock_docopt):
+        mock_docopt.return_value = {
+            "<study>": self.study,
+            "--bundle-size": "10"
+        }
+
+        result = qc.make_command(self.subid)
+
+        assert result == f"{qc.__file__} {self.study} {self.subid}"
+
 
 class TestPrepareScan:
     subid = "STUDY_SITE_ID_01"
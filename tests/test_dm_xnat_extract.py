@@ -0,0 +1,89 @@
+import importlib
+import logging
+import os
+
+from mock import patch, Mock
+
+logging.disable(logging.CRITICAL)
+
+extract = importlib.import_module("bin.dm_xnat_extract")
+
+
+class TestRunSeriesExporters:
+
+    def make_work(self, *exporters):
+        scan = Mock()
+        scan.download_dir = "/tmp/download"
+        return {scan: list(exporters)}
+
+    def test_serial_failure_doesnt_stop_other_exporters(self):
+        failing = Mock()
+        failing.export.side_effect = RuntimeError("dcm2niix failed")
+        working = Mock()
+
+        extract.run_series_exporters(self.make_work(failing, working), jobs=1)
+
+        working.export.assert_called_once_with("/tmp/download")
+
+    @patch.object(extract, "as_completed", return_value=[])
+    @patch.object(extract, "get_allocated_cores", return_value=8)
+    @patch.object(extract, "ProcessPoolExecutor")
+    def test_workers_share_allocated_cores(self, mock_pool, mock_cores,
+                                           mock_completed):
+        work = self.make_work(Mock(), Mock(), Mock(), Mock())
+
+        extract.run_series_exporters(work, jobs=4)
+
+        _, kwargs = mock_pool.call_args
+        assert kwargs["max_workers"] == 4
+        assert kwargs["initargs"] == (2,)
+
+    @patch.dict(os.environ, {}, clear=False)
+    def test_worker_thread_limit_is_set_for_commands(self):
+        extract._limit_worker_threads(3)
+
+        assert os.environ["OMP_NUM_THREADS"] == "3"
+
+
+@patch.object(extract, "get_allocated_cores", return_value=8)
+@patch.object(extract, "is_blacklisted", return_value=False)
+@patch.object(extract, "get_transfer_methods", return_value=None)
+@patch("datman.exporters.get_nii_compression")
+class TestMakeSeriesExporters:
+
+    name = "STUDY_CMH_0001_01_01_T1_02_SagT1"
+
+    def make_exporters(self, convert_jobs):
+        scan = Mock()
+        scan.tags = ["T1"]
+        scan.names = [self.name]
+        scan.echo_dict = None
+        tag_config = Mock()
+        tag_config.get.return_value = {"Formats": ["nii"]}
+        tag_config.tags = {"T1": {}}
+        session = Mock()
+        session.nii_path = "/tmp/does_not_exist/nii"
+        return extract.make_series_exporters(
+            session, scan, tag_config, Mock(), convert_jobs=convert_jobs)
+
+    def test_threads_default_to_share_of_cores(self, mock_compression, *_):
+        mock_compression.return_value = {"Method": "post"}
+
+        exporter = self.make_exporters(convert_jobs=4)[0]
+
+        assert exporter.compression["Threads"] == 2
+
+    def test_configured_threads_are_kept(self, mock_compression, *_):
+        mock_compression.return_value = {"Method": "post", "Threads": 3}
+
+        exporter = self.make_exporters(convert_jobs=4)[0]
+
+        assert exporter.compression["Threads"] == 3
+
+    def test_threads_not_limited_without_parallel_jobs(self,
+                                                       mock_compression, *_):
+        mock_compression.return_value = {}
+
+        exporter = self.make_exporters(convert_jobs=1)[0]
+
+        assert "Threads" not in exporter.compression
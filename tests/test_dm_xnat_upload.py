@@ -1,10 +1,13 @@
 import unittest
 import importlib
 import logging
+import os
+import zipfile
 
 from mock import patch, MagicMock
 
 import datman
+import datman.utils
 import datman.xnat
 import datman.scanid
 
@@ -56,6 +59,24 @@ class CheckFilesExist(unittest.TestCase):
         assert data_exists
         assert resources_exist
 
+    @patch('bin.dm_xnat_upload.resource_data_exists')
+    @patch('datman.utils.get_archive_headers')
+    def test_headers_not_read_when_archive_has_no_dicoms(
+            self, mock_headers, mock_resources_exist):
+        mock_resources_exist.return_value = True
+        contents = {"dicom": [], "resource": ["notes.txt"], "empty": [],
+                    "snapshot": []}
+        xnat_session = self.__get_xnat_session(self.session)
+
+        data_exists, resources_exist = upload.check_files_exist(
+            self.archive, xnat_session.experiments["STUDY_SITE_9999_01_01"],
+            MagicMock(), contents=contents)
+
+        assert data_exists
+        assert resources_exist
+        assert not mock_headers.called
+        assert mock_resources_exist.call_args[1]["contents"] is contents
+
     def __generate_mock_headers(self, bad_id=False):
         headers = {}
         for num, item in enumerate(self.archive_scan_uids):
@@ -73,3 +94,40 @@ class CheckFilesExist(unittest.TestCase):
         with open(text_file, 'r') as session_data:
             xnat_session = eval(session_data.read())
         return datman.xnat.XNATSubject(xnat_session)
+
+
+class ResourceDataExists(unittest.TestCase):
+    contents = {"dicom": ["01/1.dcm"], "resource": ["notes one.txt"],
+                "empty": ["empty.txt"], "snapshot": []}
+
+    def test_uses_given_contents_without_opening_archive(self):
+        with patch('zipfile.ZipFile') as mock_zip:
+            assert upload.resource_data_exists(
+                ["notes%20one.txt"], "missing.zip", contents=self.contents)
+            assert not mock_zip.called
+
+    def test_empty_files_arent_expected_on_xnat(self):
+        assert upload.resource_data_exists(
+            ["notes%20one.txt"], "missing.zip", contents=self.contents)
+        assert not upload.resource_data_exists(
+            [], "missing.zip", contents=self.contents)
+
+
+class StripNiftis(unittest.TestCase):
+
+    def test_niftis_and_side_cars_removed(self):
+        with datman.utils.make_temp_directory() as temp:
+            archive = temp + "/STUDY_SITE_9999_01_01.zip"
+            with zipfile.ZipFile(archive, "w") as zf:
+                zf.writestr("01/1.dcm", b"dicom")
+                zf.writestr("02/dwi.nii.gz", b"nifti")
+                zf.writestr("02/dwi.bvec", b"bvec")
+                zf.writestr("02/notes.txt", b"notes")
+            dest = temp + "/stripped"
+            os.mkdir(dest)
+
+            result = upload.strip_niftis(archive, dest)
+
+            with zipfile.ZipFile(result) as zf:
+                assert zf.namelist() == ["01/1.dcm", "02/notes.txt"]
+                assert zf.read("01/1.dcm") == b"dicom"
@@ -0,0 +1,167 @@
+import json
+import os
+import zipfile
+import zlib
+
+import pydicom
+import pytest
+from mock import patch
+
+import datman.header_index
+import datman.scan_list
+import datman.utils
+
+
+def _make_dicom(path, series):
+    file_meta = pydicom.dataset.FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
+    file_meta.MediaStorageSOPInstanceUID = f"1.2.3.{series}"
+    file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+    ds = pydicom.dataset.FileDataset(
+        str(path), {}, file_meta=file_meta, preamble=b"\0" * 128)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.PatientName = "STUDY_CMH_0001_01_01"
+    ds.SeriesNumber = series
+    ds.SeriesDescription = f"Series{series}"
+    ds.BitsAllocated = 8
+    ds.PixelData = b"\0" * 16
+    ds.save_as(str(path), write_like_original=False)
+
+
+def _make_archive(tmp_path, series=(1, 2)):
+    archive = tmp_path / "STUDY_CMH_0001_01_01.zip"
+    with zipfile.ZipFile(archive, "w") as zip_file:
+        for num in series:
+            dicom = tmp_path / f"{num}.dcm"
+            _make_dicom(dicom, num)
+            zip_file.write(dicom, f"exam/{num}/{num}.dcm")
+            os.remove(dicom)
+    return str(archive)
+
+
+class TestHeaderIndex:
+
+    @pytest.fixture
+    def index(self, tmp_path):
+        index = datman.header_index.HeaderIndex(
+            str(tmp_path / datman.header_index.INDEX_NAME))
+        yield index
+        index.close()
+
+    def test_unchanged_archive_is_not_read_again(self, index, tmp_path):
+        archive = _make_archive(tmp_path)
+        expected = index.get_archive_headers(archive)
+
+        with patch("datman.utils.get_archive_headers") as mock_read:
+            headers = index.get_archive_headers(archive)
+            assert not mock_read.called
+
+        assert list(headers) == list(expected)
+        assert [item.SeriesDescription for item in headers.values()] == [
+            "Series1", "Series2"]
+        assert all("PixelData" not in item for item in headers.values())
+
+    def test_changed_archive_is_read_again(self, index, tmp_path):
+        archive = _make_archive(tmp_path)
+        index.get_archive_headers(archive)
+
+        archive = _make_archive(tmp_path, series=(1, 2, 3))
+        stat = os.stat(archive)
+        os.utime(archive, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        headers = index.get_archive_headers(archive)
+
+        assert len(headers) == 3
+
+    def test_stop_after_first_uses_complete_entry(self, index, tmp_path):
+        archive = _make_archive(tmp_path)
+        index.get_archive_headers(archive)
+
+        with patch("datman.utils.get_archive_headers") as mock_read:
+            headers = index.get_archive_headers(archive,
+                                                stop_after_first=True)
+            assert not mock_read.called
+
+        assert len(headers) == 1
+
+    def test_partial_entry_doesnt_satisfy_full_request(self, index,
+                                                       tmp_path):
+        archive = _make_archive(tmp_path)
+        index.get_archive_headers(archive, stop_after_first=True)
+
+        assert not index.is_current(archive)
+        assert len(index.get_archive_headers(archive)) == 2
+        assert index.is_current(archive)
+
+    def test_folders_are_not_indexed(self, index, tmp_path):
+        with patch("datman.utils.get_archive_headers") as mock_read:
+            index.get_archive_headers(str(tmp_path))
+            index.get_archive_headers(str(tmp_path))
+            assert mock_read.call_count == 2
+
+    def test_prune_removes_missing_archives(self, index, tmp_path):
+        archive = _make_archive(tmp_path)
+        index.get_archive_headers(archive)
+
+        assert index.prune() == 0
+        os.remove(archive)
+        assert index.prune() == 1
+
+
+class TestGetArchiveHeaders:
+
+    def test_reads_archive_directly_without_index(self):
+        with patch("datman.utils.get_archive_headers") as mock_read:
+            datman.header_index.get_archive_headers("exam.zip")
+            mock_read.assert_called_once_with("exam.zip", False)
+
+    def test_index_is_shared_by_path(self, tmp_path):
+        path = str(tmp_path / "index.sqlite")
+
+        index = datman.header_index.get_header_index(path=path)
+
+        assert datman.header_index.get_header_index(path=path) is index
+
+
+class TestScanList:
+
+    class Entry(datman.scan_list.ScanEntryABC):
+        def get_target_name(self):
+            return "STUDY_CMH_0001_01"
+
+    def test_second_run_reads_headers_from_index(self, tmp_path):
+        archive = _make_archive(tmp_path)
+        dest_dir = tmp_path / "meta"
+        dest_dir.mkdir()
+
+        datman.scan_list.generate_scan_list(self.Entry, [archive],
+                                            str(dest_dir))
+        os.remove(dest_dir / "scans.csv")
+
+        with patch("datman.utils.get_archive_headers") as mock_read:
+            datman.scan_list.generate_scan_list(self.Entry, [archive],
+                                                str(dest_dir))
+            assert not mock_read.called
+
+        assert (dest_dir / datman.header_index.INDEX_NAME).exists()
+        with open(dest_dir / "scans.csv") as fh:
+            assert "STUDY_CMH_0001_01_01" in fh.read()
+        assert self.Entry.header_index is None
+
+
+def test_headers_are_stored_as_dicom_json(tmp_path):
+    index = datman.header_index.HeaderIndex(str(tmp_path / "index.sqlite"))
+    archive = _make_archive(tmp_path)
+    index.get_archive_headers(archive)
+
+    blob = index._connect().execute(
+        "SELECT header FROM headers ORDER BY position").fetchone()[0]
+    stored = json.loads(zlib.decompress(blob))
+    header = list(index.get_archive_headers(archive).values())[0]
+    index.close()
+
+    assert stored["dataset"]["00200011"]["Value"] == [1]
+    assert header.SeriesNumber == 1
+    assert header.file_meta.TransferSyntaxUID == \
+        pydicom.uid.ExplicitVRLittleEndian
@@ -0,0 +1,114 @@
+import json
+import os
+
+import pytest
+from mock import Mock, patch
+
+import datman.config
+import datman.inventory
+import datman.scan
+
+
+class TestStudyInventory:
+    subject = "STUDY_CMH_0001_01"
+    niftis = ["STUDY_CMH_0001_01_01_T1_02_SagT1.nii.gz",
+              "STUDY_CMH_0001_01_01_RST_04_Resting.nii.gz",
+              "STUDY_CMH_0001_01_02_T1_02_SagT1.nii.gz"]
+
+    @pytest.fixture
+    def config(self, tmp_path):
+        paths = {key: str(tmp_path / key)
+                 for key in ["nii", "qc", "resources", "bids"]}
+
+        def get_path(key):
+            if key not in paths:
+                raise datman.config.UndefinedSetting
+            return paths[key]
+
+        nii_dir = tmp_path / "nii" / self.subject
+        nii_dir.mkdir(parents=True)
+        for fname in self.niftis:
+            (nii_dir / fname).touch()
+        (tmp_path / "nii" / "STUDY_CMH_0002_01").mkdir()
+
+        for session in ["01", "02"]:
+            (tmp_path / "resources" / f"{self.subject}_{session}").mkdir(
+                parents=True)
+        (tmp_path / "resources" / "STUDY_CMH_0002_01_01").mkdir()
+
+        anat = tmp_path / "bids" / "sub-CMH0001" / "ses-01" / "anat"
+        anat.mkdir(parents=True)
+        for repeat in ["01", "02"]:
+            stem = f"sub-CMH0001_ses-01_run-{repeat}_T1w"
+            (anat / f"{stem}.json").write_text(
+                json.dumps({"SeriesNumber": 2, "Repeat": repeat}))
+            (anat / f"{stem}.nii.gz").touch()
+
+        config = Mock(spec=datman.config.config)
+        config.get_path.side_effect = get_path
+        return config
+
+    def test_lists_session_folders(self, config):
+        inventory = datman.inventory.StudyInventory(config)
+
+        assert inventory.subject_ids("nii") == [
+            "STUDY_CMH_0001_01", "STUDY_CMH_0002_01"]
+        assert len(inventory.get_files("nii", self.subject)) == 3
+        assert inventory.get_files("nii", "STUDY_CMH_9999_01") == []
+
+    def test_resources_include_every_repeat_for_timepoint(self, config):
+        inventory = datman.inventory.StudyInventory(config)
+
+        found = inventory.get_files("resources", self.subject)
+
+        assert sorted(os.path.basename(item) for item in found) == [
+            "STUDY_CMH_0001_01_01", "STUDY_CMH_0001_01_02"]
+
+    def test_undefined_paths_are_skipped(self, config):
+        inventory = datman.inventory.StudyInventory(
+            config, folders=["nii", "dcm"])
+
+        assert inventory.has_folder("nii")
+        assert not inventory.has_folder("dcm")
+        assert not inventory.has_folder("bids")
+
+    def test_seeded_scan_matches_unseeded_scan(self, config):
+        inventory = datman.inventory.StudyInventory(config)
+
+        seeded = inventory.get_scan(self.subject + "_02")
+        unseeded = datman.scan.Scan(self.subject + "_02", config)
+
+        assert sorted(item.path for item in seeded.niftis) == sorted(
+            item.path for item in unseeded.niftis)
+        assert sorted(seeded.resources) == sorted(unseeded.resources)
+        assert seeded.find_files(
+            "STUDY_CMH_0001_01_02_T1_02_SagT1", format="bids") == \
+            unseeded.find_files(
+                "STUDY_CMH_0001_01_02_T1_02_SagT1", format="bids")
+
+    def test_seeded_scan_doesnt_search_file_system(self, config):
+        inventory = datman.inventory.StudyInventory(config)
+        session = inventory.get_scan(self.subject)
+
+        with patch("glob.glob") as mock_glob, \
+                patch("os.walk") as mock_walk:
+            assert len(session.niftis) == 3
+            assert len(session.resources) == 2
+            assert len(session.find_files(
+                "STUDY_CMH_0001_01_01_T1_02_SagT1", format="bids")) == 2
+            assert session.find_files("STUDY_CMH_0001_01_01_RST") == [
+                os.path.join(session.nii_path, self.niftis[1])]
+
+        assert not mock_glob.called
+        assert not mock_walk.called
+
+    def test_refresh_stops_using_inventory(self, config, tmp_path):
+        inventory = datman.inventory.StudyInventory(config)
+        session = inventory.get_scan(self.subject)
+        assert len(session.niftis) == 3
+
+        (tmp_path / "nii" / self.subject /
+         "STUDY_CMH_0001_01_01_DTI_05_Ax-DTI.nii.gz").touch()
+        session.refresh()
+
+        assert len(session.niftis) == 4
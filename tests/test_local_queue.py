@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+import datman.local_queue
+import datman.runner
+import datman.utils
+
+
+@pytest.fixture(autouse=True)
+def reset_concurrency():
+    datman.runner.set_max_concurrency(4)
+    yield
+    datman.runner.set_max_concurrency(4)
+
+
+class TestLocalScheduler:
+
+    @pytest.fixture
+    def scheduler(self):
+        scheduler = datman.local_queue.LocalScheduler(max_workers=2)
+        yield scheduler
+        scheduler.shutdown()
+
+    def test_runs_each_bundle_with_its_own_log(self, scheduler, tmp_path):
+        log_dir = str(tmp_path / "logs")
+        bundles = [["echo a", "echo b"], ["echo c"]]
+
+        job_id = scheduler.submit(bundles, "qc", log_dir,
+                                  script_dir=str(tmp_path))
+
+        assert scheduler.wait([job_id])
+        logs = sorted(os.listdir(log_dir))
+        assert logs == [f"qc_{job_id}_0", f"qc_{job_id}_1"]
+        with open(os.path.join(log_dir, logs[0])) as fh:
+            assert fh.read() == "a\nb\n"
+
+    def test_dependent_job_waits_for_dependency(self, scheduler, tmp_path):
+        marker = tmp_path / "done"
+        first = scheduler.submit([[f"sleep 0.2 && touch {marker}"]],
+                                 "first", str(tmp_path))
+        second = scheduler.submit([[f"test -e {marker}"]], "second",
+                                  str(tmp_path), depends_on=[first])
+
+        assert scheduler.wait([second])
+
+    def test_job_is_skipped_if_dependency_fails(self, scheduler, tmp_path):
+        marker = tmp_path / "ran"
+        first = scheduler.submit([["exit 3"]], "first", str(tmp_path))
+        second = scheduler.submit([[f"touch {marker}"]], "second",
+                                  str(tmp_path), depends_on=[first])
+
+        assert not scheduler.wait([second])
+        assert not marker.exists()
+
+    def test_unknown_dependency_raises_exception(self, scheduler, tmp_path):
+        with pytest.raises(ValueError):
+            scheduler.submit([["true"]], "job", str(tmp_path),
+                             depends_on=["12345"])
+
+    def test_walltime_kills_long_tasks(self, scheduler, tmp_path):
+        job_id = scheduler.submit([["sleep 30"]], "slow", str(tmp_path),
+                                  walltime="0:01")
+        assert not scheduler.wait([job_id])
+
+
+@pytest.mark.parametrize("walltime, expected", [
+    (None, None),
+    ("30", 30 * 60),
+    ("5:30", 5 * 60 + 30),
+    ("2:00:00", 2 * 3600),
+    ("1-2", 86400 + 2 * 3600),
+    ("1-02:30:10", 86400 + 2 * 3600 + 30 * 60 + 10),
+])
+def test_parse_walltime(walltime, expected):
+    assert datman.local_queue.parse_walltime(walltime) == expected
+
+
+def test_parse_walltime_rejects_bad_input():
+    with pytest.raises(ValueError):
+        datman.local_queue.parse_walltime("two hours")
+
+
+def test_submit_jobs_uses_local_scheduler(tmp_path):
+    job_id = datman.utils.submit_jobs(
+        ["echo a", "echo b", "echo c"], "qc", str(tmp_path / "logs"),
+        queue="local", bundle_size=2, workdir=str(tmp_path),
+        script_dir=str(tmp_path)
+    )
+
+    assert job_id.startswith("local-")
+    assert datman.local_queue.get_scheduler().wait([job_id])
+    assert len(os.listdir(tmp_path / "logs")) == 2
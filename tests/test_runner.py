@@ -0,0 +1,102 @@
+import sys
+import time
+
+import pytest
+
+import datman.runner
+
+
+@pytest.fixture(autouse=True)
+def reset_limit():
+    yield
+    datman.runner.set_max_concurrency(4)
+
+
+class TestRunCommand:
+
+    def test_output_and_cost_are_recorded(self):
+        result = datman.runner.run_command(
+            [sys.executable, "-c", "import sys; print('out'); "
+             "print('err', file=sys.stderr); sum(range(10**6))"])
+
+        assert result.succeeded
+        assert result.stdout == b"out\n"
+        assert result.stderr == b"err\n"
+        assert result.wall_time > 0
+        assert result.cpu_time > 0
+        assert result.max_rss > 0
+
+    def test_strings_are_split_without_shell(self):
+        result = datman.runner.run_command("echo 'a;b' $HOME")
+
+        assert result.stdout == b"a;b $HOME\n"
+
+    def test_failures_are_reported(self):
+        result = datman.runner.run_command("exit 3", shell=True)
+
+        assert result.returncode == 3
+        assert not result.succeeded
+
+    def test_exit_status_decoded_without_py39_helpers(self, monkeypatch):
+        monkeypatch.delattr("os.waitstatus_to_exitcode", raising=False)
+
+        failed = datman.runner.run_command("exit 3", shell=True)
+        killed = datman.runner.run_command("kill -9 $$", shell=True)
+
+        assert failed.returncode == 3
+        assert killed.returncode == -9
+
+    def test_timeout_kills_command_and_children(self):
+        start = time.monotonic()
+
+        result = datman.runner.run_command("sleep 5 | cat", shell=True,
+                                           timeout=0.2)
+
+        assert result.timed_out
+        assert result.returncode < 0
+        assert time.monotonic() - start < 4
+
+    def test_output_can_be_streamed_to_log(self, tmp_path):
+        log = tmp_path / "cmd.log"
+        log.write_text("previous\n")
+
+        result = datman.runner.run_command(
+            "echo out; echo err >&2", shell=True, log_file=str(log))
+
+        assert result.stdout is None
+        assert log.read_text() == "previous\nout\nerr\n"
+
+    def test_missing_command_raises(self):
+        with pytest.raises(OSError):
+            datman.runner.run_command(["not-a-real-datman-command"])
+
+
+class TestCommandRunner:
+
+    def test_map_returns_results_in_order(self):
+        with datman.runner.CommandRunner(max_workers=3) as runner:
+            results = runner.map([["echo", str(num)] for num in range(5)])
+
+        assert [item.stdout for item in results] == [
+            f"{num}\n".encode() for num in range(5)]
+        summary = runner.summary()
+        assert summary["commands"] == 5
+        assert summary["failed"] == 0
+
+    def test_commands_run_in_parallel(self):
+        with datman.runner.CommandRunner(max_workers=4) as runner:
+            start = time.monotonic()
+            runner.map([["sleep", "0.3"]] * 4)
+            elapsed = time.monotonic() - start
+
+        assert elapsed < 1.0
+
+    def test_process_wide_limit_applies(self):
+        datman.runner.set_max_concurrency(1)
+
+        with datman.runner.CommandRunner(max_workers=4) as runner:
+            start = time.monotonic()
+            runner.map([["sleep", "0.2"]] * 3)
+            elapsed = time.monotonic() - start
+
+        assert elapsed >= 0.6
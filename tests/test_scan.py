@@ -35,6 +35,19 @@ class TestSeries(unittest.TestCase):
         assert series.description == 'SagT1Bravo-09mm'
         assert series.full_id == 'STUDY_SITE_9999_01'
 
+    def test_series_has_no_instance_dict(self):
+        series = datman.scan.Series(self.good_name)
+
+        assert not hasattr(series, '__dict__')
+        series.description = 'Changed'
+        assert series.description == 'Changed'
+
+    def test_frozen_series_cant_be_modified(self):
+        series = datman.scan.Series(self.good_name, frozen=True)
+
+        with pytest.raises(AttributeError):
+            series.description = 'Changed'
+
 
 class TestScan(unittest.TestCase):
     good_name = "STUDY_CMH_9999_01"
@@ -119,6 +132,30 @@ class TestScan(unittest.TestCase):
             assert os.path.basename(folder) != malformed
             assert os.path.basename(folder) in repeats
 
+    @patch("os.walk")
+    @patch("glob.glob")
+    def test_construction_doesnt_read_filesystem(self, mock_glob, mock_walk):
+        datman.scan.Scan(self.good_name, self.config)
+
+        assert not mock_glob.called
+        assert not mock_walk.called
+
+    @patch("glob.glob")
+    def test_folder_contents_cached_until_refresh(self, mock_glob):
+        mock_glob.return_value = []
+        subject = datman.scan.Scan(self.good_name, self.config)
+
+        assert subject.resources == []
+        assert subject.resources == []
+        assert mock_glob.call_count == 1
+
+        found = os.path.join(self.config.get_path("resources"),
+                             "STUDY_CMH_9999_01_01")
+        mock_glob.return_value = [found]
+        subject.refresh()
+
+        assert subject.resources == [found]
+
     def test_returns_expected_subject_paths(self):
         subject = datman.scan.Scan(self.good_name, self.config)
 
@@ -205,3 +242,53 @@ class TestScan(unittest.TestCase):
         subject = datman.scan.Scan(self.good_name, self.config)
 
         assert subject.get_tagged_nii('DTI') == []
+
+
+class TestScanStudy:
+
+    @pytest.fixture
+    def config(self, tmp_path):
+        for study in ["STUDY", "OTHER"]:
+            (tmp_path / f"{study}.yaml").write_text(
+                f"ProjectDir: {study}\n"
+                f"StudyTag: {study}\n"
+                "Sites:\n"
+                "  CMH:\n"
+                f"    SiteTags: ['{study}']\n"
+            )
+        site_file = tmp_path / "site_config.yaml"
+        site_file.write_text(
+            "Projects:\n"
+            "  STUDY: STUDY.yaml\n"
+            "  OTHER: OTHER.yaml\n"
+            "SystemSettings:\n"
+            "  local:\n"
+            f"    DatmanProjectsDir: '{tmp_path}/'\n"
+            f"    ConfigDir: '{tmp_path}/'\n"
+            "Paths:\n"
+            "  nii: data/nii/\n"
+            "  resources: data/RESOURCES/\n"
+        )
+        return cfg.config(filename=str(site_file), system=system,
+                          study="OTHER")
+
+    def test_paths_use_the_sessions_study(self, config, tmp_path):
+        subject = datman.scan.Scan("STUDY_CMH_9999_01", config)
+
+        assert subject.nii_path == os.path.join(
+            str(tmp_path), "STUDY", "data", "nii", "STUDY_CMH_9999_01")
+
+    def test_study_is_reset_if_config_changes(self, config, tmp_path):
+        subject = datman.scan.Scan("STUDY_CMH_9999_01", config)
+        assert subject.project == "STUDY"
+        config.set_study("OTHER")
+
+        assert subject.resource_path == os.path.join(
+            str(tmp_path), "STUDY", "data", "RESOURCES",
+            "STUDY_CMH_9999_01_01")
+
+    def test_unknown_study_raises_exception_on_path_access(self, config):
+        subject = datman.scan.Scan("NOPE_CMH_9999_01", config)
+
+        with pytest.raises(Exception):
+            subject.nii_path
@@ -3,9 +3,11 @@
 import os
 import unittest
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from random import randint
 
 import pytest
+import pydicom
 from mock import patch, MagicMock
 
 import datman.utils as utils
@@ -239,3 +241,580 @@ class TestUpdateChecklist:
         utils.update_checklist(
             {'STUDY_SITE_SUB001_01_01': 'comment'}, study='STUDY'
         )
+
+
+class TestGetAllocatedCores:
+    @patch.dict(os.environ, {'SLURM_CPUS_PER_TASK': '6'})
+    def test_slurm_allocation_used_when_set(self):
+        assert utils.get_allocated_cores() == 6
+
+    @patch.dict(os.environ, {'SLURM_CPUS_PER_TASK': ''})
+    @patch('os.sched_getaffinity', create=True)
+    def test_cpu_affinity_used_without_slurm_allocation(self, mock_affinity):
+        mock_affinity.return_value = {0, 1, 2}
+        assert utils.get_allocated_cores() == 3
+
+
+class TestMaterializeFile:
+    def test_source_renamed_when_moving(self, tmp_path):
+        source = tmp_path / "source.nii.gz"
+        source.write_text("data")
+        dest = tmp_path / "dest.nii.gz"
+
+        method = utils.materialize_file(str(source), str(dest), move=True)
+
+        assert method == "rename"
+        assert not source.exists()
+        assert dest.read_text() == "data"
+
+    def test_source_linked_when_not_moving(self, tmp_path):
+        source = tmp_path / "source.dcm"
+        source.write_text("data")
+        dest = tmp_path / "dest.dcm"
+
+        method = utils.materialize_file(str(source), str(dest))
+
+        assert method == "link"
+        assert source.exists()
+        assert os.path.samefile(source, dest)
+
+    def test_falls_back_to_copy_when_other_methods_fail(self, tmp_path):
+        source = tmp_path / "source.dcm"
+        source.write_text("data")
+        dest = tmp_path / "dest.dcm"
+
+        with patch('os.link', side_effect=OSError), \
+                patch('datman.utils._reflink', side_effect=OSError):
+            method = utils.materialize_file(str(source), str(dest))
+
+        assert method == "copy"
+        assert dest.read_text() == "data"
+        assert not os.path.samefile(source, dest)
+
+    def test_existing_destination_is_replaced(self, tmp_path):
+        source = tmp_path / "source.dcm"
+        source.write_text("new")
+        dest = tmp_path / "dest.dcm"
+        dest.write_text("old")
+
+        utils.materialize_file(str(source), str(dest), methods=["copy"])
+
+        assert dest.read_text() == "new"
+        assert sorted(os.listdir(tmp_path)) == ["dest.dcm", "source.dcm"]
+
+    @pytest.mark.parametrize("methods", [["rename"], ["link"]])
+    def test_reset_mode_gives_mkstemp_files_default_permissions(
+            self, tmp_path, methods):
+        handle, source = utils.tempfile.mkstemp(dir=str(tmp_path))
+        os.close(handle)
+        dest = str(tmp_path / "resource.pdf")
+
+        utils.materialize_file(source, dest, move=True, methods=methods,
+                               reset_mode=True)
+
+        expected = 0o666 & ~utils.get_umask()
+        assert utils.stat.S_IMODE(os.stat(dest).st_mode) == expected
+        assert not os.path.exists(source)
+
+    def test_raises_os_error_when_no_method_succeeds(self, tmp_path):
+        with pytest.raises(OSError):
+            utils.materialize_file(
+                str(tmp_path / "missing"), str(tmp_path / "dest"))
+
+    def test_configured_methods_keep_default_order(self):
+        config = MagicMock()
+        config.get_key.return_value = ['copy', 'reflink', 'bad']
+
+        assert utils.get_transfer_methods(config) == ('reflink', 'copy')
+
+
+def _make_dicom(path, **tags):
+    file_meta = pydicom.dataset.FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
+    file_meta.MediaStorageSOPInstanceUID = "1.2.3.4"
+    file_meta.TransferSyntaxUID = pydicom.uid.ExplicitVRLittleEndian
+    ds = pydicom.dataset.FileDataset(
+        str(path), {}, file_meta=file_meta, preamble=b"\0" * 128)
+    ds.is_little_endian = True
+    ds.is_implicit_VR = False
+    ds.SeriesDescription = "T1"
+    for tag, value in tags.items():
+        setattr(ds, tag, value)
+    ds.BitsAllocated = 8
+    ds.PixelData = b"\0" * 16
+    ds.save_as(str(path), write_like_original=False)
+    return str(path)
+
+
+class TestDicomProbing:
+    def test_has_dicom_magic_detects_dicom(self, tmp_path):
+        path = _make_dicom(tmp_path / "scan.dcm")
+        assert utils.has_dicom_magic(path)
+
+    def test_has_dicom_magic_rejects_short_and_non_dicom_files(self, tmp_path):
+        short = tmp_path / "short.txt"
+        short.write_text("DICM")
+        other = tmp_path / "other.bin"
+        other.write_bytes(b"\0" * 200)
+
+        assert not utils.has_dicom_magic(str(short))
+        assert not utils.has_dicom_magic(str(other))
+        assert not utils.has_dicom_magic(str(tmp_path / "missing.dcm"))
+
+    def test_has_dicom_magic_restores_file_position(self, tmp_path):
+        path = _make_dicom(tmp_path / "scan.dcm")
+        with open(path, "rb") as fh:
+            assert utils.has_dicom_magic(fh)
+            assert fh.tell() == 0
+
+    def test_read_dicom_header_skips_pixel_data(self, tmp_path):
+        path = _make_dicom(tmp_path / "scan.dcm", EchoNumbers=2)
+
+        header = utils.read_dicom_header(path)
+
+        assert header.EchoNumbers == 2
+        assert "PixelData" not in header
+
+    def test_read_dicom_header_reads_only_specific_tags(self, tmp_path):
+        path = _make_dicom(tmp_path / "scan.dcm", EchoNumbers=2)
+
+        header = utils.read_dicom_header(path, specific_tags=["EchoNumbers"])
+
+        assert header.EchoNumbers == 2
+        assert "SeriesDescription" not in header
+
+    def test_is_dicom_skips_header_read_without_magic(self, tmp_path):
+        path = tmp_path / "notes.txt"
+        path.write_text("not a dicom " * 20)
+
+        with patch("datman.utils.read_dicom_header") as mock_read:
+            assert not utils.is_dicom(str(path))
+            assert not mock_read.called
+        assert utils.is_dicom(_make_dicom(tmp_path / "scan.dcm"))
+
+
+class TestArchiveHeaders:
+    @pytest.fixture
+    def exam_dir(self, tmp_path):
+        exam = tmp_path / "exam"
+        for series in [1, 2, 3]:
+            series_dir = exam / f"{series:02d}"
+            series_dir.mkdir(parents=True)
+            (series_dir / "notes.txt").write_text("not a dicom " * 20)
+            _make_dicom(series_dir / f"{series}.dcm", SeriesNumber=series)
+        (exam / "03" / "extra.dcm").write_bytes(b"\0" * 10)
+        return exam
+
+    def make_zip(self, exam_dir, tmp_path):
+        dest = str(tmp_path / "exam.zip")
+        utils.make_zip(str(exam_dir), dest)
+        return dest
+
+    def test_zip_headers_found_for_each_series(self, exam_dir, tmp_path):
+        archive = self.make_zip(exam_dir, tmp_path)
+
+        headers = utils.get_zipfile_headers(archive)
+
+        assert sorted(headers) == ["01", "02", "03"]
+        assert [headers[key].SeriesNumber for key in sorted(headers)] == [
+            1, 2, 3]
+        assert all("PixelData" not in item for item in headers.values())
+
+    def test_zip_skips_non_dicoms_unread(self, exam_dir, tmp_path):
+        archive = self.make_zip(exam_dir, tmp_path)
+
+        with patch("zipfile.ZipFile.open", autospec=True,
+                   side_effect=utils.zipfile.ZipFile.open) as mock_open:
+            utils.get_zipfile_headers(archive)
+
+        opened = [call.args[1] for call in mock_open.call_args_list]
+        assert sorted(opened) == ["01/1.dcm", "02/2.dcm", "03/3.dcm"]
+
+    def test_zip_parallel_matches_serial(self, exam_dir, tmp_path):
+        archive = self.make_zip(exam_dir, tmp_path)
+
+        serial = utils.get_zipfile_headers(archive)
+        parallel = utils.get_zipfile_headers(archive, max_workers=3)
+
+        assert list(serial) == list(parallel)
+        assert [item.SeriesNumber for item in serial.values()] == [
+            item.SeriesNumber for item in parallel.values()]
+
+    def test_zip_stop_after_first(self, exam_dir, tmp_path):
+        archive = self.make_zip(exam_dir, tmp_path)
+
+        assert len(utils.get_zipfile_headers(
+            archive, stop_after_first=True)) == 1
+
+    def make_tar(self, exam_dir, tmp_path):
+        dest = str(tmp_path / "exam.tar.gz")
+        with utils.tarfile.open(dest, "w:gz") as tar:
+            tar.add(str(exam_dir), arcname="exam")
+        return dest
+
+    def test_tar_headers_found_for_each_series(self, exam_dir, tmp_path):
+        archive = self.make_tar(exam_dir, tmp_path)
+
+        headers = utils.get_tarfile_headers(archive)
+
+        assert sorted(headers) == ["exam/01", "exam/02", "exam/03"]
+        assert sorted(item.SeriesNumber for item in headers.values()) == [
+            1, 2, 3]
+        assert all("PixelData" not in item for item in headers.values())
+
+    def test_tar_doesnt_list_members_first(self, exam_dir, tmp_path):
+        archive = self.make_tar(exam_dir, tmp_path)
+
+        with patch("tarfile.TarFile.getmembers") as mock_members, \
+                patch("datman.utils.read_streamed_header",
+                      wraps=utils.read_streamed_header) as mock_read:
+            headers = utils.get_tarfile_headers(archive,
+                                                stop_after_first=True)
+
+        assert len(headers) == 1
+        assert not mock_members.called
+        assert mock_read.call_count == 1
+
+    def test_streamed_header_reads_past_first_chunk(self, tmp_path):
+        size = utils.HEADER_CHUNK_SIZE * 3
+        path = _make_dicom(tmp_path / "scan.dcm", SeriesNumber=4,
+                           EncapsulatedDocument=b"x" * size)
+
+        with open(path, "rb") as stream:
+            header = utils.read_streamed_header(stream)
+
+        assert header.SeriesNumber == 4
+        assert len(header.EncapsulatedDocument) == size
+
+    def test_streamed_header_rejects_non_dicoms(self, tmp_path):
+        path = tmp_path / "notes.txt"
+        path.write_text("not a dicom " * 20)
+
+        with open(path, "rb") as stream:
+            assert utils.read_streamed_header(stream) is None
+
+
+class TestClassifyZipMembers:
+    @pytest.fixture
+    def archive(self, tmp_path):
+        exam = tmp_path / "exam"
+        (exam / "01" / "SNAPSHOTS").mkdir(parents=True)
+        _make_dicom(exam / "01" / "1.dcm")
+        _make_dicom(exam / "01" / "unnamed")
+        (exam / "01" / "SNAPSHOTS" / "thumb.gif").write_bytes(b"GIF" * 100)
+        (exam / "notes.txt").write_text("some notes")
+        (exam / "empty.txt").touch()
+        dest = str(tmp_path / "exam.zip")
+        utils.make_zip(str(exam), dest)
+        return dest
+
+    def test_members_are_labelled(self, archive):
+        with utils.zipfile.ZipFile(archive) as zf:
+            contents = utils.classify_zip_members(zf)
+
+        assert sorted(contents["dicom"]) == ["01/1.dcm", "01/unnamed"]
+        assert contents["resource"] == ["notes.txt"]
+        assert contents["empty"] == ["empty.txt"]
+        assert contents["snapshot"] == ["01/SNAPSHOTS/thumb.gif"]
+
+    def test_only_reads_magic_number(self, archive):
+        with utils.zipfile.ZipFile(archive) as zf, \
+                patch("datman.utils.read_dicom_header") as mock_read:
+            utils.classify_zip_members(zf)
+            assert not mock_read.called
+
+    def test_get_resources_includes_all_non_dicoms(self, archive):
+        with utils.zipfile.ZipFile(archive) as zf:
+            resources = utils.get_resources(zf)
+
+        assert sorted(resources) == [
+            "01/SNAPSHOTS/thumb.gif", "empty.txt", "notes.txt"]
+
+
+class TestFilterZip:
+    @pytest.fixture
+    def source(self, tmp_path):
+        path = str(tmp_path / "source.zip")
+        with utils.zipfile.ZipFile(path, "w") as zf:
+            zf.writestr("01/1.dcm", b"dicom" * 1000,
+                        compress_type=utils.zipfile.ZIP_DEFLATED)
+            zf.writestr("01/scan.nii.gz", os.urandom(500),
+                        compress_type=utils.zipfile.ZIP_STORED)
+            zf.writestr("resources/MISC/notes.txt", "notes",
+                        compress_type=utils.zipfile.ZIP_DEFLATED)
+        return path
+
+    def test_copies_selected_members_unchanged(self, source, tmp_path):
+        dest = str(tmp_path / "dest.zip")
+
+        written = utils.filter_zip(
+            source, dest, keep=lambda info: info.filename != "01/1.dcm")
+
+        assert written == ["01/scan.nii.gz", "resources/MISC/notes.txt"]
+        with utils.zipfile.ZipFile(source) as src, \
+                utils.zipfile.ZipFile(dest) as new:
+            assert new.testzip() is None
+            for name in written:
+                assert new.read(name) == src.read(name)
+                assert new.getinfo(name).compress_type == \
+                    src.getinfo(name).compress_type
+
+    def test_members_arent_recompressed(self, source, tmp_path):
+        with patch("zlib.compressobj") as mock_compress, \
+                patch("zlib.decompressobj") as mock_decompress:
+            utils.filter_zip(source, str(tmp_path / "dest.zip"))
+            assert not mock_compress.called
+            assert not mock_decompress.called
+
+    def test_members_can_be_renamed(self, source, tmp_path):
+        dest = str(tmp_path / "dest.zip")
+
+        utils.filter_zip(
+            source, dest, rename=lambda name: name.replace("resources/MISC/",
+                                                           ""))
+
+        with utils.zipfile.ZipFile(dest) as new:
+            assert new.read("notes.txt") == b"notes"
+
+    def test_duplicate_names_are_skipped(self, source, tmp_path):
+        dest = str(tmp_path / "dest.zip")
+
+        written = utils.filter_zip(source, dest,
+                                   rename=lambda name: "same.txt")
+
+        assert written == ["same.txt"]
+
+
+class TestSubmitJobs:
+    cmds = ["qc.py STUDY SUB1", "qc.py STUDY SUB2", "qc.py STUDY SUB3"]
+
+    @patch("datman.utils.run")
+    def test_slurm_submits_one_array_job(self, mock_run, tmp_path):
+        mock_run.return_value = (0, b"12345\n")
+
+        job_id = utils.submit_jobs(
+            self.cmds, "qc", "/logs", queue="slurm", bundle_size=2,
+            depends_on=["111", "222"], script_dir=str(tmp_path))
+
+        assert job_id == "12345"
+        assert mock_run.call_count == 1
+        job = mock_run.call_args[0][0]
+        assert "--array=0-1" in job
+        assert "--dependency=afterok:111:222" in job
+        scripts = list(tmp_path.iterdir())
+        assert len(scripts) == 1
+        assert job.endswith(str(scripts[0]))
+        contents = scripts[0].read_text()
+        assert contents.count("qc.py STUDY") == 3
+
+    @patch("datman.utils.run")
+    def test_job_scripts_dont_collide(self, mock_run, tmp_path):
+        mock_run.return_value = (0, b"1")
+
+        for _ in range(2):
+            utils.submit_jobs(self.cmds, "qc", "/logs",
+                              script_dir=str(tmp_path))
+
+        assert len(list(tmp_path.iterdir())) == 2
+
+    @patch("datman.utils.run")
+    def test_qbatch_bundles_with_chunk_size(self, mock_run, tmp_path):
+        mock_run.return_value = (0, b"Submitted job 42")
+
+        job_id = utils.submit_jobs(self.cmds, "qc", "/logs", queue="sge",
+                                   bundle_size=2, script_dir=str(tmp_path))
+
+        assert job_id == "42"
+        job = mock_run.call_args[0][0]
+        assert job.startswith("qbatch") and "-c 2" in job
+        cmd_file = list(tmp_path.iterdir())[0]
+        assert cmd_file.read_text().splitlines() == self.cmds
+
+    @patch("datman.utils.run")
+    def test_failed_submission_raises(self, mock_run, tmp_path):
+        mock_run.return_value = (1, b"rate limit")
+
+        with pytest.raises(RuntimeError):
+            utils.submit_jobs(self.cmds, "qc", "/logs",
+                              script_dir=str(tmp_path))
+
+    @patch("datman.utils.run")
+    def test_dryrun_doesnt_submit(self, mock_run, tmp_path):
+        assert utils.submit_jobs(self.cmds, "qc", "/logs", dryrun=True,
+                                 script_dir=str(tmp_path)) is None
+        assert not mock_run.called
+        assert not list(tmp_path.iterdir())
+
+    def test_array_script_runs_each_bundle(self, tmp_path):
+        script = tmp_path / "job.sh"
+        script.write_text(utils.make_array_script(
+            [["echo a", "false", "echo b"], ["echo c"]]))
+
+        first = utils.runner.run_command(
+            ["bash", str(script)], env={"SLURM_ARRAY_TASK_ID": "0"})
+        second = utils.runner.run_command(
+            ["bash", str(script)], env={"SLURM_ARRAY_TASK_ID": "1"})
+
+        assert first.stdout == b"a\nb\n"
+        assert first.returncode == 1
+        assert second.stdout == b"c\n"
+        assert second.succeeded
+
+    def test_queue_defaults_to_system_behaviour(self):
+        config = MagicMock()
+        config.get_key.side_effect = datman.config.UndefinedSetting
+        config.system = "kimel"
+        assert utils.get_queue(config) == "slurm"
+        config.system = "other"
+        assert utils.get_queue(config) == "qbatch"
+
+
+class TestParseBlacklist:
+    def test_reads_valid_entries_and_skips_malformed_lines(self):
+        lines = ["series\treason\n",
+                 "STUDY_CMH_0001_01_01_T1_02_SagT1 Bad motion, redo\n",
+                 "not_a_scan_name comment\n",
+                 "STUDY_CMH_0002_01_01_RST_04_Resting,Sleeping\n"]
+
+        entries = utils._parse_blacklist(lines)
+
+        assert entries == {
+            "STUDY_CMH_0001_01_01_T1_02_SagT1": "Bad motion  redo",
+            "STUDY_CMH_0002_01_01_RST_04_Resting": "Sleeping"
+        }
+
+    def test_returns_comment_for_requested_scan(self):
+        lines = ["STUDY_CMH_0001_01_01_T1_02_SagT1 Bad motion\n"]
+
+        assert utils._parse_blacklist(
+            lines, scan="STUDY_CMH_0001_01_01_T1_02_SagT1") == "Bad motion"
+        assert utils._parse_blacklist(
+            lines, scan="STUDY_CMH_0001_01_01_T1_03_SagT1") is None
+
+
+class TestMetadataStore:
+    blacklist = ("series\treason\n"
+                 "STUDY_CMH_0001_01_01_T1_02_SagT1 Bad motion\n"
+                 "STUDY_CMH_0001_01_02_RST_04_Resting Sleeping\n"
+                 "STUDY_CMH_0002_01_01_DTI_05_Ax-DTI Artifact\n"
+                 "STUDY_CMH_PHA_FBN0013_T1_02_SagT1 Phantom moved\n")
+    checklist = ("qc_STUDY_CMH_0001_01.html Reviewer\n"
+                 "qc_STUDY_CMH_0002_01.html\n")
+
+    def _make_store(self, tmp_path):
+        bl_path = tmp_path / "blacklist.csv"
+        bl_path.write_text(self.blacklist)
+        cl_path = tmp_path / "checklist.csv"
+        cl_path.write_text(self.checklist)
+        return utils.MetadataStore(
+            blacklist_path=str(bl_path), checklist_path=str(cl_path))
+
+    def test_blacklist_lookup_ignores_path_extension_and_description(
+            self, tmp_path):
+        store = self._make_store(tmp_path)
+
+        assert store.get_blacklist_comment(
+            "/data/nii/STUDY_CMH_0001_01_01_T1_02_SagT1.nii.gz"
+        ) == "Bad motion"
+        assert store.is_blacklisted("STUDY_CMH_0001_01_01_T1_02_Other")
+        assert not store.is_blacklisted("STUDY_CMH_0001_01_02_T1_02_SagT1")
+        assert not store.is_blacklisted("not_a_scan_name")
+
+    def test_blacklist_for_subject(self, tmp_path):
+        store = self._make_store(tmp_path)
+
+        assert sorted(store.get_blacklist(subject="STUDY_CMH_0001_01")) == [
+            "STUDY_CMH_0001_01_01_T1_02_SagT1",
+            "STUDY_CMH_0001_01_02_RST_04_Resting"]
+        assert list(store.get_blacklist(subject="STUDY_CMH_0001_01_02")) == [
+            "STUDY_CMH_0001_01_02_RST_04_Resting"]
+        assert len(store.get_blacklist()) == 4
+
+    def test_blacklist_for_phantom(self, tmp_path):
+        store = self._make_store(tmp_path)
+
+        assert store.get_blacklist(subject="STUDY_CMH_PHA_FBN0013") == {
+            "STUDY_CMH_PHA_FBN0013_T1_02_SagT1": "Phantom moved"}
+        assert store.is_blacklisted("STUDY_CMH_PHA_FBN0013_T1_02_SagT1")
+
+    def test_checklist_lookup(self, tmp_path):
+        store = self._make_store(tmp_path)
+
+        assert store.get_checklist_comment("STUDY_CMH_0001_01_02") == \
+            "Reviewer"
+        assert store.get_checklist_comment("STUDY_CMH_0002_01") == ""
+        assert store.get_checklist_comment("STUDY_CMH_0003_01") is None
+
+    def test_file_only_parsed_again_after_it_changes(self, tmp_path):
+        store = self._make_store(tmp_path)
+
+        with patch("datman.utils._parse_blacklist",
+                   wraps=utils._parse_blacklist) as mock_parse:
+            for _ in range(3):
+                store.is_blacklisted("STUDY_CMH_0001_01_01_T1_02_SagT1")
+            assert mock_parse.call_count == 1
+
+            utils.update_blacklist(
+                {"STUDY_CMH_0003_01_01_T1_02_SagT1": "Bad"},
+                path=store.blacklist_path)
+
+            assert store.is_blacklisted("STUDY_CMH_0003_01_01_T1_02_SagT1")
+
+    @patch("datman.utils.dashboard")
+    def test_dashboard_entries_fetched_once_per_subject(self, mock_dash):
+        mock_dash.dash_found = True
+        entry = MagicMock(comment="Bad motion")
+        entry.scan.__str__.return_value = "STUDY_CMH_0001_01_01_T1_02"
+        entry.scan.description = "SagT1"
+        db_subject = MagicMock(is_phantom=False)
+        db_subject.get_blacklist_entries.return_value = [entry]
+        db_subject.sessions = {1: MagicMock(signed_off=False)}
+        mock_dash.get_subject.return_value = db_subject
+
+        store = utils.MetadataStore(study="STUDY")
+
+        assert store.is_blacklisted("STUDY_CMH_0001_01_01_T1_02_SagT1")
+        assert not store.is_blacklisted("STUDY_CMH_0001_01_01_RST_03_Rest")
+        assert store.get_checklist_comment("STUDY_CMH_0001_01") == ""
+        assert mock_dash.get_subject.call_count == 1
+
+
+def _add_checklist_entries(path, start, count):
+    for num in range(start, start + count):
+        utils.update_checklist(
+            {f"STUDY_CMH_{num:04d}_01": "Reviewer"}, path=path)
+
+
+class TestWriteMetadata:
+    def test_parallel_updates_are_not_lost(self, tmp_path):
+        path = str(tmp_path / "checklist.csv")
+
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(_add_checklist_entries, path, i * 10, 10)
+                       for i in range(4)]
+        for future in futures:
+            future.result()
+
+        assert len(utils.read_checklist(path=path)) == 40
+
+    def test_replaced_file_keeps_permissions(self, tmp_path):
+        path = tmp_path / "blacklist.csv"
+        path.write_text("series\treason\n")
+        os.chmod(path, 0o664)
+
+        utils.write_metadata(["series\treason\n", "a b\n"], str(path))
+
+        assert path.read_text() == "series\treason\na b\n"
+        assert os.stat(path).st_mode & 0o777 == 0o664
+        assert os.listdir(tmp_path) == ["blacklist.csv"]
+
+    def test_function_given_current_contents_under_lock(self, tmp_path):
+        path = tmp_path / "checklist.csv"
+        path.write_text("qc_STUDY_CMH_0001_01.html\n")
+
+        utils.write_metadata(
+            lambda: [path.read_text(), "qc_STUDY_CMH_0002_01.html\n"],
+            str(path))
+
+        assert path.read_text().splitlines() == [
+            "qc_STUDY_CMH_0001_01.html", "qc_STUDY_CMH_0002_01.html"]
@@ -221,3 +221,45 @@ class TestXnatScan(unittest.TestCase):
         tag_map = {'MOCK_TYPE': {'SeriesDescription': 'SERIES_DESCRIPTION'}}
         xnat_scan.set_tag(tag_map)
         assert set(xnat_scan.tags) == set(['MOCK_TYPE'])
+
+
+class TestXnatExperimentRawJson:
+    scan_json = {
+        'data_fields': {'ID': '2', 'series_description': 'T1'},
+        'children': [{
+            'field': 'file',
+            'items': [{'data_fields': {
+                'label': 'DICOM', 'content': 'RAW', 'format': 'DICOM',
+                'xnat_abstractresource_id': 123
+            }}]
+        }]
+    }
+
+    def _make_experiment_json(self):
+        return {
+            'data_fields': {'label': 'STUDY_CMH_0001_01_01', 'ID': 'E01'},
+            'children': [
+                {'field': 'scans/scan', 'items': [self.scan_json]},
+                {'field': 'sharing/share', 'items': [
+                    {'data_fields': {'label': 'OTHER_CMH_0001_01_01'}}]}
+            ]
+        }
+
+    def test_raw_json_discarded_when_not_kept(self):
+        experiment = datman.xnat.XNATExperiment(
+            'STUDY', 'STUDY_CMH_0001', self._make_experiment_json(),
+            keep_raw_json=False)
+
+        assert experiment.raw_json is None
+        assert experiment.scans[0].raw_json is None
+        assert experiment.scans[0].raw_dicoms_exist()
+        assert experiment.scans[0].description == 'T1'
+        assert experiment.scan_resource_IDs == ['123']
+        assert experiment.get_alt_labels() == ['OTHER_CMH_0001_01_01']
+
+    def test_raw_json_kept_by_default(self):
+        experiment = datman.xnat.XNATExperiment(
+            'STUDY', 'STUDY_CMH_0001', self._make_experiment_json())
+
+        assert experiment.scans[0].raw_json == self.scan_json
+        assert not hasattr(experiment.scans[0], '__dict__')